@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+""" ASGI entry point serving the wrangler API from one asyncio event loop.
+
+    Run with any ASGI server, e.g. `uvicorn asgi:app`.
+"""
+
+import json
+import re
+import time
+
+from server import config, CURRENT_NET, provider_pool, w3
+
+from wrangler.aio import AsyncRPC, AsyncSimpleWrangler as Wrangler
+from wrangler.metrics import metrics, request_seconds
+
+
+rpc = AsyncRPC(provider_pool.endpoint_uri, pool=provider_pool)
+
+
+# shared by every request; each call runs on its own per-request context
+wrangler = Wrangler(
+    config=config,
+    web3_client=w3,
+    current_net=CURRENT_NET,
+    rpc=rpc
+)
+
+
+async def loan_requests(body):
+    """ Approve a loan request."""
+    loan, approval, errors = await wrangler.approve_loan(json.loads(body.decode('utf-8') or 'null'))
+    if len(errors):
+        return 400, {'message': {'error': errors}}
+
+    return 201, { 'data': loan, 'approval': approval }
+
+
+async def loan_health(body, position_index):
+    """ Return the health of the collateral for a loan, given its loan number."""
+    health, errors = await wrangler.get_loan_health(int(position_index))
+    if len(errors):
+        return 400, {'message': {'error': errors}}
+
+    return 201, { 'data': health }
+
+
+async def is_valid_protocol_transaction_sender(body, prover, txHash):
+    """ Return whether a protocol transaction was sent by the prover, or by the wrangler for fills."""
+    is_valid_sender = await wrangler.is_valid_protocol_transaction_sender(prover, txHash)
+    if not is_valid_sender:
+        return 400, {'message': 'The browser (or proxy) sent a request that this server could not understand.'}
+
+    return 200, {}
+
+
+async def prometheus_metrics(body):
+    """ Expose counters and timings in the Prometheus text format."""
+    return 200, metrics.render().encode('utf-8'), 'text/plain; version=0.0.4'
+
+
+routes = [
+    ('POST', re.compile(r'^/loan_requests/?$'), loan_requests),
+    ('GET', re.compile(r'^/loan_health/(\d+)/?$'), loan_health),
+    ('GET', re.compile(r'^/is_valid_protocol_transaction_sender/([^/]+)/([^/]+)/?$'), is_valid_protocol_transaction_sender),
+    ('GET', re.compile(r'^/metrics/?$'), prometheus_metrics),
+]
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+
+async def respond(send, status, content, content_type='application/json'):
+    if not isinstance(content, bytes):
+        content = json.dumps(content).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('utf-8')),
+            (b'access-control-allow-origin', b'*'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': content})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await rpc.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    assert scope['type'] == 'http'
+    for method, pattern, handler in routes:
+        match = pattern.match(scope['path'])
+        if match and scope['method'] == method:
+            started_at = time.perf_counter()
+            response = await handler(await read_body(receive), *match.groups())
+            request_seconds.observe(time.perf_counter() - started_at, handler.__name__)
+            return await respond(send, *response)
+    return await respond(send, 404, b'Sorry, nothing at this URL.', content_type='text/plain')
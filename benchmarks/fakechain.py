@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+""" In-process stand-in for an Ethereum node running the Lendroid protocol.
+
+    FakeChain answers JSON-RPC over HTTP like Infura would for the handful of
+    methods the wrangler uses. eth_calls are decoded against the protocol, ERC20 and
+    medianizer ABIs and answered from synthetic state: `positions` open positions
+    spread over a few lenders and borrowers, unlimited balances and allowances, and
+    position_hash/kernel_hash computed exactly like the contract. Every HTTP request
+    waits `latency` seconds first, so a JSON-RPC batch pays the latency once.
+"""
+
+import collections
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from eth_abi import decode_abi, encode_abi
+from eth_utils import function_abi_to_4byte_selector, keccak
+from web3 import Web3
+
+from wrangler import signing
+from wrangler.utils import get_abi
+
+
+POSITION_STATUS_OPEN = 1
+LENDERS = 50
+BORROWERS = 37
+UNLIMITED = 10 ** 30
+WEI_PER_ETHER = 10 ** 18
+# the medianizer's price of WETH
+DAI_PER_WETH = 200
+
+
+def address(n):
+    return Web3.toChecksumAddress('0x' + '{:040x}'.format(n))
+
+
+def zero_value(abi_type):
+    if abi_type.endswith(']'):
+        base, _, size = abi_type[:-1].rpartition('[')
+        return [zero_value(base)] * int(size or 0)
+    if abi_type == 'address':
+        return '0x' + '00' * 20
+    if abi_type == 'bool':
+        return False
+    if abi_type == 'bytes' or abi_type == 'string':
+        return b''
+    if abi_type.startswith('bytes'):
+        return b'\0' * int(abi_type[5:])
+    return 0
+
+
+class FakeChain:
+    """ Synthetic protocol state plus the JSON-RPC methods the wrangler calls."""
+
+    def __init__(self, config, current_net, positions=10, latency=0.0, expired=0.0, block_number=1000000):
+        net = config[current_net]
+        self.protocol = Web3.toChecksumAddress(net['contracts']['protocol'])
+        self.wrangler = Web3.toChecksumAddress(net['wrangler'])
+        self.tokens = {name: Web3.toChecksumAddress(token) for name, token in net['contracts'].items() if name not in ('protocol', 'maker_medianizer')}
+        self.latency = latency
+        self.block_number = block_number
+        self.timestamp = int(time.time())
+        self.counts = collections.Counter()
+        self.posts = 0
+        self.transactions = {}
+        self._lock = threading.Lock()
+        self.functions = {}
+        for abi_name in ('protocol', 'ERC20', 'MakerMedianizer-{0}'.format(current_net)):
+            for entry in get_abi(abi_name):
+                if entry.get('type', None) == 'function':
+                    self.functions.setdefault(function_abi_to_4byte_selector(entry), entry)
+        self.reset(positions, expired)
+
+    def reset(self, positions, expired=0.0):
+        """ Replace the chain's positions; every `1 / expired`-th position is past its expiry."""
+        self.hashes = [keccak(encode_abi(['uint256'], [index])) for index in range(positions)]
+        self.indexes = {position_hash: index for index, position_hash in enumerate(self.hashes)}
+        self.expire_every = int(round(1 / expired)) if expired else 0
+        self.lend_positions = collections.defaultdict(list)
+        self.borrow_positions = collections.defaultdict(list)
+        for index, position_hash in enumerate(self.hashes):
+            self.lend_positions[self.lender(index)].append(position_hash)
+            self.borrow_positions[self.borrower(index)].append(position_hash)
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+            self.posts = 0
+
+    # synthetic state
+
+    def lender(self, index):
+        return address(0x1000 + index % LENDERS)
+
+    def borrower(self, index):
+        return address(0x2000 + index % BORROWERS)
+
+    def position(self, index):
+        expires_at = self.timestamp + 86400 * (1 + index % 30)
+        if self.expire_every and index % self.expire_every == 0:
+            expires_at = self.timestamp - 60
+        filled = WEI_PER_ETHER * (1 + index % 10)
+        return [
+            index, self.lender(index), self.lender(index), self.borrower(index), address(0x3000), self.wrangler,
+            self.timestamp - 86400, self.timestamp - 86400, expires_at,
+            self.tokens['weth'], self.tokens['dai'],
+            filled * 3 // 400, filled * 3 // 400, filled, filled * 101 // 100,
+            POSITION_STATUS_OPEN, index, 0, WEI_PER_ETHER, 0, 0, self.hashes[index]
+        ]
+
+    # eth_call
+
+    def call(self, function, args):
+        name = function['name']
+        if name == 'last_position_index':
+            return [max(len(self.hashes) - 1, 0)]
+        if name == 'position_index':
+            return [self.hashes[args[0]] if args[0] < len(self.hashes) else b'\0' * 32]
+        if name == 'position':
+            index = self.indexes.get(args[0], None)
+            return self.position(index) if index is not None else None
+        if name in ('lend_positions_count', 'borrow_positions_count'):
+            positions = self.lend_positions if name.startswith('lend') else self.borrow_positions
+            return [len(positions.get(Web3.toChecksumAddress(args[0]), []))]
+        if name in ('lend_positions', 'borrow_positions'):
+            positions = self.lend_positions if name.startswith('lend') else self.borrow_positions
+            hashes = positions.get(Web3.toChecksumAddress(args[0]), [])
+            return [hashes[args[1]] if args[1] < len(hashes) else b'\0' * 32]
+        if name == 'position_counts':
+            account = Web3.toChecksumAddress(args[0])
+            return [len(self.borrow_positions.get(account, [])), len(self.lend_positions.get(account, []))]
+        if name == 'wranglers':
+            return [Web3.toChecksumAddress(args[0]) == self.wrangler]
+        if name == 'supported_tokens':
+            return [Web3.toChecksumAddress(args[0]) in self.tokens.values()]
+        if name == 'owed_value':
+            amount, daily_interest_rate, duration = args
+            return [amount + amount * daily_interest_rate * duration // (86400 * WEI_PER_ETHER)]
+        if name == 'position_hash':
+            return [signing.position_hash(self.protocol, *args)]
+        if name == 'kernel_hash':
+            return [signing.kernel_hash(self.protocol, *args)]
+        if name in ('balanceOf', 'allowance'):
+            return [UNLIMITED]
+        if name == 'fill_kernel':
+            # every kernel fills
+            return [True]
+        if name == 'read':
+            # DAI per WETH, as the Maker medianizer reports it
+            return [Web3.toBytes(DAI_PER_WETH * WEI_PER_ETHER).rjust(32, b'\0')]
+        return None
+
+    def eth_call(self, transaction, block_identifier):
+        data = Web3.toBytes(hexstr=transaction['data'])
+        function = self.functions[data[:4]]
+        input_types = [item['type'] for item in function['inputs']]
+        output_types = [item['type'] for item in function['outputs']]
+        values = self.call(function, list(decode_abi(input_types, data[4:])))
+        if values is None:
+            values = [zero_value(output_type) for output_type in output_types]
+        return Web3.toHex(encode_abi(output_types, values))
+
+    # JSON-RPC
+
+    def block(self):
+        return {
+            'number': Web3.toHex(self.block_number),
+            'timestamp': Web3.toHex(self.timestamp),
+            'hash': Web3.toHex(keccak(Web3.toBytes(self.block_number))),
+            'parentHash': Web3.toHex(keccak(Web3.toBytes(self.block_number - 1))),
+            'transactions': [],
+        }
+
+    def receipt(self, tx_hash):
+        if tx_hash not in self.transactions:
+            return None
+        return {
+            'transactionHash': tx_hash,
+            'transactionIndex': '0x0',
+            'blockHash': self.block()['hash'],
+            'blockNumber': Web3.toHex(self.block_number),
+            'cumulativeGasUsed': '0x30000',
+            'gasUsed': '0x30000',
+            'contractAddress': None,
+            'logs': [],
+            'status': '0x1',
+        }
+
+    def send_raw_transaction(self, raw_transaction):
+        tx_hash = Web3.toHex(keccak(Web3.toBytes(hexstr=raw_transaction)))
+        with self._lock:
+            self.transactions[tx_hash] = raw_transaction
+        return tx_hash
+
+    def answer(self, request):
+        method = request['method']
+        params = request.get('params', [])
+        with self._lock:
+            self.counts[method] += 1
+        try:
+            if method == 'eth_call':
+                result = self.eth_call(*params)
+            elif method == 'eth_blockNumber':
+                result = Web3.toHex(self.block_number)
+            elif method == 'eth_getBlockByNumber':
+                result = self.block()
+            elif method == 'eth_gasPrice':
+                result = Web3.toHex(10 ** 9)
+            elif method == 'eth_estimateGas':
+                result = Web3.toHex(250000)
+            elif method == 'eth_getTransactionCount':
+                result = Web3.toHex(len(self.transactions))
+            elif method == 'eth_sendRawTransaction':
+                result = self.send_raw_transaction(params[0])
+            elif method == 'eth_getTransactionReceipt':
+                result = self.receipt(params[0])
+            elif method == 'eth_getTransactionByHash':
+                result = None
+            elif method == 'eth_getLogs':
+                result = []
+            elif method == 'net_version':
+                result = '42'
+            elif method == 'web3_clientVersion':
+                result = 'FakeChain/0.1'
+            else:
+                return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32601, 'message': 'Method not found: {0}'.format(method)}}
+        except Exception as err:
+            return {'jsonrpc': '2.0', 'id': request['id'], 'error': {'code': -32000, 'message': repr(err)}}
+        return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+    def handle(self, body):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.posts += 1
+        if isinstance(body, list):
+            return [self.answer(request) for request in body]
+        return self.answer(body)
+
+    def serve(self):
+        """ Serve the chain on a local port from a daemon thread. Returns the endpoint URI."""
+        chain = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                data = json.dumps(chain.handle(body)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='fakechain', daemon=True).start()
+        return 'http://127.0.0.1:{0}'.format(server.server_address[1])
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+""" Benchmark the wrangler's hot paths against an in-process FakeChain.
+
+    python benchmarks/run.py --positions 10,1000,100000 --latency 0.02 --output results.json
+
+Each operation runs against a stand-in node with the given round-trip latency and
+stubbed price feeds. Per operation and position count it reports throughput, p50
+and p99 latency and the JSON-RPC calls and HTTP round-trips it made, as JSON, so
+results can be compared between commits.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eth_account import Account
+from web3 import Web3
+
+import wrangler.aio
+import wrangler.simplewrangler
+
+from wrangler import ProviderPool, SimpleWrangler
+from wrangler.aio import AsyncSimpleWrangler
+from wrangler.prices import rate_cache
+
+from fakechain import DAI_PER_WETH, FakeChain, address
+
+
+CURRENT_NET = 'kovan'
+PRIVATE_KEY = '0x' + '11' * 32
+OPERATIONS = [
+    'approve_loan', 'approve_loan_async', 'approve_loans', 'get_loan_health', 'get_loans_health',
+    'get_positions', 'get_lender_positions', 'monitor_bootstrap', 'monitor', 'monitor_restart',
+    'http_loan_requests', 'http_loan_requests_bulk', 'http_loan_health', 'http_loans_health', 'http_positions',
+]
+# operations whose cost grows with the number of positions
+SCANS = {'get_loans_health', 'get_positions', 'monitor_bootstrap', 'monitor_restart', 'http_loans_health'}
+
+
+def benchmark_config(endpoint_uri):
+    return {CURRENT_NET: {
+        'infura_key': '',
+        'http_provider_uris': [endpoint_uri],
+        'wrangler': Account.privateKeyToAccount(PRIVATE_KEY).address,
+        'private_key': PRIVATE_KEY,
+        'log_level': 'WARNING',
+        'contracts': {
+            'protocol': address(0x100),
+            'maker_medianizer': address(0x101),
+            'lst': address(0x102),
+            'weth': address(0x103),
+            'dai': address(0x104),
+        },
+    }}
+
+
+def loan_request(config, n=0):
+    contracts = config[CURRENT_NET]['contracts']
+    return {
+        'lender': address(0x1000 + n % 50),
+        'borrower': '0x' + '00' * 20,
+        'relayer': address(0x3000),
+        'wrangler': config[CURRENT_NET]['wrangler'],
+        'filler': address(0x2000 + n % 37),
+        'loanToken': contracts['dai'],
+        'collateralToken': contracts['weth'],
+        'offerExpiry': str(int(time.time()) + 86400),
+        'interestRatePerDay': '0.01',
+        'loanDuration': '864000',
+        'loanAmountOffered': str(100 * 10 ** 18),
+        'fillLoanAmount': str(10 * 10 ** 18),
+        'relayerFeeLST': '0',
+        'monitoringFeeLST': str(10 ** 18),
+        'rolloverFeeLST': '0',
+        'closureFeeLST': '0',
+        'creatorSalt': '0x' + '00' * 32,
+        'ecSignatureCreator': '0x' + '00' * 65,
+    }
+
+
+def stub_rate(from_ticker, to_ticker):
+    """ The price of from_ticker in to_ticker, at the fake chain's medianizer price."""
+    rates = {('weth', 'dai'): DAI_PER_WETH, ('dai', 'weth'): 1 / DAI_PER_WETH}
+    return rates.get((from_ticker.lower(), to_ticker.lower()), 1.0)
+
+
+def stub_price_feeds():
+    """ Replace the price feeds with fixed rates, so no request leaves the machine."""
+    def cryptocompare_rate(lend_currency_ticker, borrow_currency_ticker):
+        return stub_rate(lend_currency_ticker, borrow_currency_ticker)
+
+    def cmc_rate_per_weth(ticker):
+        return stub_rate(ticker, 'weth')
+
+    async def cryptocompare_rate_async(session, lend_currency_ticker, borrow_currency_ticker):
+        return stub_rate(lend_currency_ticker, borrow_currency_ticker)
+
+    async def cmc_rate_per_weth_async(session, ticker):
+        return stub_rate(ticker, 'weth')
+
+    wrangler.simplewrangler.cryptocompare_rate = cryptocompare_rate
+    wrangler.simplewrangler.cmc_rate_per_weth = cmc_rate_per_weth
+    wrangler.aio.cryptocompare_rate = cryptocompare_rate_async
+    wrangler.aio.cmc_rate_per_weth = cmc_rate_per_weth_async
+
+
+def import_server(config):
+    """ Import the Flask app configured against the fake chain, or None if Flask is unavailable."""
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix='wrangler-benchmark-')
+    with open(os.path.join(directory, 'secret.json'), 'w') as secret:
+        json.dump(config, secret)
+    os.chdir(directory)
+    try:
+        import server
+        return server
+    except ImportError as err:
+        print("Skipping the HTTP benchmarks: {0}".format(err), file=sys.stderr)
+        return None
+    finally:
+        os.chdir(cwd)
+
+
+class Benchmark:
+
+    def __init__(self, chain, config, web3_client, server=None, iterations=20, scan_iterations=3, bulk_size=10):
+        self.chain = chain
+        self.config = config
+        self.web3_client = web3_client
+        self.server = server
+        self.client = server.app.test_client() if server is not None else None
+        self.iterations = iterations
+        self.scan_iterations = scan_iterations
+        self.bulk_size = bulk_size
+        self.monitor_wrangler = None
+        self.wranglers = {}
+        self.snapshot_path = os.path.join(tempfile.mkdtemp(prefix='wrangler-benchmark-'), 'positions.sqlite')
+
+    def wrangler(self, cls=SimpleWrangler):
+        """ One shared wrangler per class, as the servers run them."""
+        if cls not in self.wranglers:
+            self.wranglers[cls] = cls(config=self.config, web3_client=self.web3_client, current_net=CURRENT_NET)
+        return self.wranglers[cls]
+
+    def check(self, errors):
+        assert not len(errors), errors
+
+    def check_response(self, response):
+        assert response.status_code < 300, response.get_data(as_text=True)
+
+    # operations
+
+    def approve_loan(self, i):
+        self.check(self.wrangler().approve_loan(loan_request(self.config, i))[2])
+
+    def approve_loans(self, i):
+        for result in self.wrangler().approve_loans([loan_request(self.config, i + j) for j in range(self.bulk_size)]):
+            self.check(result[2])
+
+    def get_loan_health(self, i):
+        self.check(self.wrangler().get_loan_health(i % len(self.chain.hashes))[1])
+
+    def get_loans_health(self, i):
+        records, errors = self.wrangler().get_loans_health()
+        self.check(errors)
+        list(records)
+
+    def get_positions(self, i):
+        self.wrangler().get_positions()
+
+    def get_lender_positions(self, i):
+        self.wrangler().get_positions(lender=self.chain.lender(i))
+
+    def monitor_bootstrap(self, i):
+        self.monitor_wrangler = SimpleWrangler(config=self.config, web3_client=self.web3_client, current_net=CURRENT_NET)
+        self.monitor_wrangler.monitor()
+
+    def monitor(self, i):
+        if self.monitor_wrangler is None:
+            self.monitor_bootstrap(i)
+        self.monitor_wrangler.monitor()
+
+    def prepare_monitor_restart(self):
+        # the snapshot a restarted monitor finds
+        SimpleWrangler(config=self.config, web3_client=self.web3_client, current_net=CURRENT_NET, position_snapshot=self.snapshot_path).monitor()
+
+    def monitor_restart(self, i):
+        restarted = SimpleWrangler(config=self.config, web3_client=self.web3_client, current_net=CURRENT_NET, position_snapshot=self.snapshot_path)
+        restarted.monitor()
+        restarted.position_store.snapshot.close()
+
+    def http_loan_requests(self, i):
+        self.check_response(self.client.post('/loan_requests', data=json.dumps(loan_request(self.config, i))))
+
+    def http_loan_requests_bulk(self, i):
+        self.check_response(self.client.post('/loan_requests/bulk', data=json.dumps([loan_request(self.config, i + j) for j in range(self.bulk_size)])))
+
+    def http_loan_health(self, i):
+        self.check_response(self.client.get('/loan_health/{0}'.format(i % len(self.chain.hashes))))
+
+    def http_loans_health(self, i):
+        self.check_response(self.client.get('/loan_health'))
+
+    def http_positions(self, i):
+        self.check_response(self.client.get('/positions?lender={0}'.format(self.chain.lender(i))))
+
+    # measurement
+
+    def measure(self, operation):
+        iterations = self.scan_iterations if operation in SCANS else self.iterations
+        if operation == 'approve_loan_async':
+            latencies = asyncio.run(self._measure_async(iterations))
+        else:
+            function = getattr(self, operation)
+            prepare = getattr(self, 'prepare_' + operation, None)
+            if prepare is not None:
+                prepare()
+            latencies = []
+            self.chain.reset_counts()
+            for i in range(iterations):
+                started_at = time.perf_counter()
+                function(i)
+                latencies.append(time.perf_counter() - started_at)
+        return self.report(operation, latencies)
+
+    async def _measure_async(self, iterations):
+        latencies = []
+        self.chain.reset_counts()
+        for i in range(iterations):
+            started_at = time.perf_counter()
+            async_wrangler = self.wrangler(AsyncSimpleWrangler)
+            self.check((await async_wrangler.approve_loan(loan_request(self.config, i)))[2])
+            latencies.append(time.perf_counter() - started_at)
+        # the session belongs to this event loop
+        await async_wrangler.rpc.close()
+        return latencies
+
+    def report(self, operation, latencies):
+        latencies = np.array(latencies)
+        iterations = len(latencies)
+        return {
+            'operation': operation,
+            'positions': len(self.chain.hashes),
+            'iterations': iterations,
+            'throughput_per_second': iterations / latencies.sum() if latencies.sum() else None,
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'mean_ms': float(latencies.mean() * 1000),
+            'rpc_round_trips': self.chain.posts / iterations,
+            'rpc_calls': sum(self.chain.counts.values()) / iterations,
+            'rpc_calls_by_method': {method: count / iterations for method, count in sorted(self.chain.counts.items())},
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--positions', default='10,100,1000', help='comma separated position counts, e.g. 10,1000,100000')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the stand-in node waits before each HTTP response')
+    parser.add_argument('--expired', type=float, default=0.0, help='fraction of positions that are past their expiry')
+    parser.add_argument('--iterations', type=int, default=20, help='iterations of each per-request operation')
+    parser.add_argument('--scan-iterations', type=int, default=3, help='iterations of operations that read every position')
+    parser.add_argument('--bulk-size', type=int, default=10, help='loan requests per bulk approval')
+    parser.add_argument('--operations', default=','.join(OPERATIONS), help='comma separated operations to run')
+    parser.add_argument('--no-http', action='store_true', help='skip the Flask endpoints')
+    parser.add_argument('--output', default=None, help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    stub_price_feeds()
+    config = benchmark_config('http://127.0.0.1:0')
+    chain = FakeChain(config, CURRENT_NET, positions=0, latency=args.latency, expired=args.expired)
+    endpoint_uri = chain.serve()
+    config[CURRENT_NET]['http_provider_uris'] = [endpoint_uri]
+    web3_client = Web3(ProviderPool([endpoint_uri]))
+    server = None if args.no_http else import_server(config)
+
+    operations = [operation for operation in args.operations.split(',') if operation]
+    if server is None:
+        operations = [operation for operation in operations if not operation.startswith('http_')]
+
+    results = []
+    for positions in [int(count) for count in args.positions.split(',')]:
+        chain.reset(positions, args.expired)
+        rate_cache.clear()
+        benchmark = Benchmark(chain, config, web3_client, server=server, iterations=args.iterations, scan_iterations=args.scan_iterations, bulk_size=args.bulk_size)
+        for operation in operations:
+            result = benchmark.measure(operation)
+            print("{positions:>7} positions  {operation:<24} p50 {p50_ms:9.2f}ms  p99 {p99_ms:9.2f}ms  {rpc_round_trips:8.1f} round-trips".format(**result), file=sys.stderr)
+            results.append(result)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'latency': args.latency,
+        'expired': args.expired,
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import json
+import logging
+import time
 import requests
 
-from flask import Flask, render_template, request, jsonify, abort
+from flask import Flask, Response, render_template, request, jsonify, abort, stream_with_context, g
 from flask_restplus import Resource, Api
 from flask_cors import CORS
 
 from web3 import Web3
 
-from wrangler import get_json_data_from_file, SimpleWrangler as Wrangler
+from wrangler import get_json_data_from_file, ProviderPool, SimpleWrangler as Wrangler
+from wrangler.positions import position_record
+from wrangler.metrics import metrics, request_seconds, rpc_metrics_middleware, SlowRequestProfiler
 
 
 config = get_json_data_from_file("./secret.json")
@@ -21,7 +25,35 @@ if LOCAL:
     CURRENT_NET = 'local'
     HTTP_PROVIDER_URI = 'http://localhost:8545'
 
-w3 = Web3(Web3.HTTPProvider(HTTP_PROVIDER_URI))
+logging.basicConfig(level=config[CURRENT_NET].get('log_level', 'INFO'))
+logger = logging.getLogger(__name__)
+# log the hottest stacks of requests slower than this many seconds
+PROFILE_SLOW_REQUESTS = config[CURRENT_NET].get('profile_slow_requests', None)
+
+# secret.json may list several endpoints under "http_provider_uris"; requests go to
+# the fastest healthy one and fail over to the others
+HTTP_PROVIDER_URIS = [HTTP_PROVIDER_URI] if LOCAL else config[CURRENT_NET].get('http_provider_uris', [HTTP_PROVIDER_URI])
+provider_pool = ProviderPool(HTTP_PROVIDER_URIS, hedge=config[CURRENT_NET].get('hedge_reads', False))
+if len(HTTP_PROVIDER_URIS) > 1:
+    provider_pool.health_check_forever()
+w3 = Web3(provider_pool)
+w3.middleware_stack.add(rpc_metrics_middleware, 'rpc_metrics')
+# one wrangler serves every request; each call runs on its own per-request context
+wrangler = Wrangler(
+    config=config,
+    web3_client=w3,
+    current_net=CURRENT_NET,
+    position_snapshot=config[CURRENT_NET].get('position_snapshot', None)
+)
+# keep supported wranglers, tokens, balances and allowances current off the request path
+for read_cache in wrangler.read_caches():
+    read_cache.follow_forever()
+# with "index_positions", positions are served from a local store synced every block
+# instead of being read from the chain on every request
+if config[CURRENT_NET].get('index_positions', False):
+    wrangler.follow_positions_forever()
+POSITIONS_PER_PAGE = 50
+MAX_POSITIONS_PER_PAGE = 500
 app = Flask(__name__)
 
 # Add CORS support for all domains
@@ -34,6 +66,31 @@ CORS(
 # Add support for Restplus api
 api = Api(app)
 
+profiler = SlowRequestProfiler(threshold=PROFILE_SLOW_REQUESTS) if PROFILE_SLOW_REQUESTS is not None else None
+
+
+@app.before_request
+def start_request():
+    g.started_at = time.perf_counter()
+    g.sampling = profiler.start() if profiler is not None else None
+
+
+# runs even when the request raised, so failing requests are timed and profiled too
+@app.teardown_request
+def finish_request(exception=None):
+    started_at = getattr(g, 'started_at', None)
+    if started_at is None:
+        return
+    request_seconds.observe(time.perf_counter() - started_at, request.endpoint or 'unknown')
+    if g.sampling is not None:
+        profiler.stop(g.sampling, request.full_path)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """ Expose counters and timings in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 # Error handlers
 @app.errorhandler(404)
@@ -48,29 +105,82 @@ class LoanRequests(Resource):
 
     def post(self):
         """ Approve a loan request."""
-        w = Wrangler(
-            config=config,
-            web3_client=w3,
-            current_net=CURRENT_NET
-        )
-        loan, approval, errors = w.approve_loan(request.get_json(force=True))
+        loan, approval, errors = wrangler.approve_loan(request.get_json(force=True))
         if len(errors):
             abort(400, {"error": errors})
 
         return { 'data': loan, 'approval': approval }, 201
 
 
+@api.route('/loan_requests/bulk', endpoint='bulk_loan_requests')
+class BulkLoanRequests(Resource):
+
+    def post(self):
+        """ Approve a list of loan requests, returning an approval or the errors for each."""
+        items = request.get_json(force=True)
+        if not isinstance(items, list):
+            abort(400, {"error": [{'label': 'invalid_paramaters', 'message': 'Expected a list of loan requests.'}]})
+        results = []
+        for loan, approval, errors in wrangler.approve_loans(items):
+            if len(errors):
+                results.append({ 'error': errors })
+            else:
+                results.append({ 'data': loan, 'approval': approval })
+
+        return { 'data': results }, 200
+
+
+@api.route('/positions', endpoint='positions')
+class Positions(Resource):
+
+    def get(self):
+        """ Return a page of the positions of a lender and/or borrower, optionally filtered by status."""
+        lender = request.args.get('lender', None)
+        borrower = request.args.get('borrower', None)
+        if not (lender or borrower):
+            abort(400, {"error": [{'label': 'invalid_paramaters', 'message': 'Specify a lender, a borrower or both.'}]})
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', POSITIONS_PER_PAGE, type=int), 1), MAX_POSITIONS_PER_PAGE)
+        try:
+            positions = wrangler.get_positions(lender=lender, borrower=borrower, status=request.args.get('status', None, type=int))
+        except ValueError as err:
+            abort(400, {"error": [{'label': 'invalid_paramaters', 'message': '{0}'.format(err)}]})
+
+        return {
+            'data': [position_record(position) for position in positions[(page - 1) * per_page:page * per_page]],
+            'page': page,
+            'per_page': per_page,
+            'total': len(positions)
+        }, 200
+
+
+@api.route('/loan_health', endpoint='loans_health')
+class LoansHealth(Resource):
+
+    def get(self):
+        """ Return the health of the collateral for all loans, optionally filtered by lender, borrower or status."""
+        records, errors = wrangler.get_loans_health(
+            lender=request.args.get('lender', None),
+            borrower=request.args.get('borrower', None),
+            status=request.args.get('status', None, type=int)
+        )
+        if len(errors):
+            abort(400, {"error": errors})
+
+        if request.args.get('format', None) == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', ''):
+            return Response(
+                stream_with_context(json.dumps(record) + '\n' for record in records),
+                mimetype='application/x-ndjson'
+            )
+        return { 'data': list(records) }, 200
+
+
 @api.route('/loan_health/<int:position_index>', endpoint='loan_health')
 class LoanHealth(Resource):
 
     def get(self, position_index):
         """ Return the health of the collateral for a loan, given its loan number."""
-        w = Wrangler(
-            config=config,
-            web3_client=w3,
-            current_net=CURRENT_NET
-        )
-        health, errors = w.get_loan_health(position_index)
+        health, errors = wrangler.get_loan_health(position_index)
         if len(errors):
             abort(400, {"error": errors})
 
@@ -82,14 +192,8 @@ class LoanHealth(Resource):
 
     def get(self, prover, txHash):
         """ Return the health of the collateral for a loan, given its loan number."""
-        w = Wrangler(
-            config=config,
-            web3_client=w3,
-            current_net=CURRENT_NET
-        )
-
-        is_valid_sender = w.is_valid_protocol_transaction_sender(prover, txHash)
-        print('\n\nis_valid_sender: {0}\n\n'.format(is_valid_sender))
+        is_valid_sender = wrangler.is_valid_protocol_transaction_sender(prover, txHash)
+        logger.debug("is_valid_sender: %s", is_valid_sender)
         if not is_valid_sender:
             abort(400)
 
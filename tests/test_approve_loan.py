@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+""" Loan approvals against the in-process stand-in node of benchmarks/fakechain.py.
+
+    python -m unittest discover tests
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from web3 import HTTPProvider, Web3
+
+from wrangler import SimpleWrangler
+from wrangler.aio import AsyncSimpleWrangler
+
+from fakechain import FakeChain, address
+from run import CURRENT_NET, benchmark_config, loan_request, stub_price_feeds
+
+
+UNSUPPORTED_TOKEN = address(0x9999)
+
+
+class ApproveLoanTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        stub_price_feeds()
+        cls.config = benchmark_config('http://127.0.0.1:0')
+        cls.chain = FakeChain(cls.config, CURRENT_NET, positions=10)
+        endpoint_uri = cls.chain.serve()
+        cls.config[CURRENT_NET]['http_provider_uris'] = [endpoint_uri]
+        cls.web3_client = Web3(HTTPProvider(endpoint_uri))
+
+    def wrangler(self, wrangler_class=SimpleWrangler, **kwargs):
+        return wrangler_class(config=self.config, web3_client=self.web3_client, current_net=CURRENT_NET, **kwargs)
+
+    def labels(self, errors):
+        return sorted(error['label'] for error in errors)
+
+    def test_unsupported_currencies_are_rejected(self):
+        for fail_fast in (True, False):
+            wrangler = self.wrangler(fail_fast=fail_fast)
+            for token, label in (('loanToken', 'lend_currency_not_supported'), ('collateralToken', 'borrow_currency_not_supported')):
+                data = dict(loan_request(self.config), **{token: UNSUPPORTED_TOKEN})
+                loan, approval, errors = wrangler.approve_loan(data)
+                self.assertEqual(self.labels(errors), [label])
+                self.assertEqual(approval, {})
+                [(loan, approval, errors)] = wrangler.approve_loans([data])
+                self.assertEqual(self.labels(errors), [label])
+
+    def test_unsupported_currencies_are_rejected_async(self):
+        async def approve(wrangler, data):
+            return await wrangler.approve_loan(data)
+        for fail_fast in (True, False):
+            wrangler = self.wrangler(AsyncSimpleWrangler, fail_fast=fail_fast)
+            data = dict(loan_request(self.config), loanToken=UNSUPPORTED_TOKEN)
+            loan, approval, errors = asyncio.run(approve(wrangler, data))
+            self.assertEqual(self.labels(errors), ['lend_currency_not_supported'])
+
+    def test_identical_retry_is_served_from_the_cache(self):
+        wrangler = self.wrangler()
+        data = loan_request(self.config, 1)
+        first = wrangler.approve_loan(data)
+        self.assertEqual(first[2], [])
+        self.chain.reset_counts()
+        self.assertEqual(wrangler.approve_loan(dict(data)), first)
+        self.assertEqual(self.chain.posts, 0)
+
+    def test_tampered_retry_is_approved_afresh(self):
+        wrangler = self.wrangler()
+        data = loan_request(self.config, 2)
+        loan, approval, errors = wrangler.approve_loan(data)
+        self.assertEqual(errors, [])
+        # same signature, salt, fill amount and filler, other fields changed
+        tampered = dict(data, lender=address(0x1234), loanAmountOffered=str(50 * 10 ** 18))
+        loan, approval, errors = wrangler.approve_loan(tampered)
+        self.assertEqual(errors, [])
+        self.assertEqual(loan['lender'], address(0x1234))
+        self.assertEqual(approval['_addresses'][0], address(0x1234))
+        self.assertEqual(approval['_values'][1], 50 * 10 ** 18)
+        self.chain.reset_counts()
+        loan, approval, errors = wrangler.approve_loan(dict(tampered, wrangler=address(0x5678)))
+        self.assertEqual(self.labels(errors), ['invalid_wrangler'])
+        self.assertEqual(approval, {})
+        self.assertEqual(self.chain.posts, 0)
+
+    def test_tampered_retry_is_approved_afresh_async(self):
+        async def approve(wrangler, items):
+            try:
+                return [await wrangler.approve_loan(data) for data in items]
+            finally:
+                await wrangler.rpc.close()
+        wrangler = self.wrangler(AsyncSimpleWrangler)
+        data = loan_request(self.config, 3)
+        first, (loan, approval, errors) = asyncio.run(approve(wrangler, [data, dict(data, lender=address(0x1234))]))
+        self.assertEqual(first[2], [])
+        self.assertEqual(errors, [])
+        self.assertEqual(loan['lender'], address(0x1234))
+
+
+if __name__ == '__main__':
+    unittest.main()
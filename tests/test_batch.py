@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+""" Batched reads against the in-process stand-in node of benchmarks/fakechain.py.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from web3 import HTTPProvider, Web3
+
+from wrangler import SimpleWrangler
+from wrangler.batch import BatchReader
+from wrangler.prices import rate_cache
+from wrangler.registry import registry
+
+from fakechain import FakeChain, address
+from run import CURRENT_NET, benchmark_config, loan_request, stub_price_feeds
+
+
+class BatchReadsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        stub_price_feeds()
+        cls.config = benchmark_config('http://127.0.0.1:0')
+        cls.chain = FakeChain(cls.config, CURRENT_NET, positions=10)
+        endpoint_uri = cls.chain.serve()
+        cls.config[CURRENT_NET]['http_provider_uris'] = [endpoint_uri]
+        cls.web3_client = Web3(HTTPProvider(endpoint_uri))
+        contracts = cls.config[CURRENT_NET]['contracts']
+        cls.protocol = registry.contract(cls.web3_client, CURRENT_NET, contracts['protocol'], 'protocol')
+        cls.tokens = [registry.contract(cls.web3_client, CURRENT_NET, contracts[name], 'ERC20') for name in ('lst', 'weth', 'dai')]
+
+    def read(self, batched):
+        functions = self.protocol.functions
+        reader = BatchReader(self.web3_client, block_identifier=self.chain.block_number, batched=batched)
+        reader.add('last_position_index', functions.last_position_index())
+        reader.add('wrangler', functions.wranglers(self.config[CURRENT_NET]['wrangler']))
+        for index in range(3):
+            reader.add(('position_index', index), functions.position_index(index))
+        for token in self.tokens:
+            reader.add(('supported', token.address), functions.supported_tokens(token.address))
+            reader.add(('balance', token.address), token.functions.balanceOf(address(0x1000)))
+            reader.add(('allowance', token.address), token.functions.allowance(address(0x1000), self.protocol.address))
+        self.chain.reset_counts()
+        reader.execute()
+        return reader
+
+    def test_batched_reads_take_one_round_trip(self):
+        sequential = self.read(batched=False)
+        self.assertEqual(self.chain.posts, len(sequential.calls))
+        batched = self.read(batched=True)
+        self.assertEqual(self.chain.posts, 1)
+        self.assertEqual(batched.round_trips, 1)
+        self.assertEqual(self.chain.counts['eth_call'], len(batched.calls))
+        self.assertEqual(batched.results, sequential.results)
+        self.assertEqual(batched.errors, {})
+
+    def approve(self, batch_reads):
+        wrangler = SimpleWrangler(
+            config=self.config,
+            web3_client=self.web3_client,
+            current_net=CURRENT_NET,
+            batch_reads=batch_reads,
+            cache_protocol_parameters=False,
+            cache_balances=False,
+            cache_approvals=False
+        )
+        context = wrangler.context()
+        context.reset_approval(loan_request(self.config))
+        rate_cache.clear()
+        # the block header is fetched either way
+        context.validate_kernel()
+        self.chain.reset_counts()
+        context.prefetch_reads()
+        context.validate_loan_request()
+        context.create_loan_object()
+        context.validate_loan_object()
+        return context, self.chain.posts
+
+    def test_approval_reads_take_one_round_trip(self):
+        sequential, sequential_posts = self.approve(batch_reads=False)
+        batched, batched_posts = self.approve(batch_reads=True)
+        self.assertEqual(sequential_posts, len(sequential._approval_read_functions()))
+        self.assertEqual(batched_posts, 1)
+        self.assertEqual(batched.errors, [])
+        self.assertEqual(batched.errors, sequential.errors)
+        self.assertEqual(batched.loan_object.serialize(), sequential.loan_object.serialize())
+
+
+if __name__ == '__main__':
+    unittest.main()
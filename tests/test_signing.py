@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+""" Bit-for-bit vectors for the off-chain position_hash, kernel_hash and signatures.
+
+    python -m unittest discover tests
+
+The expected hashes are the keccak256 of the protocol address followed by every
+argument as a 32-byte word, the way the contract concatenates them, worked out
+independently of wrangler.signing. Set WRANGLER_TEST_NODE (a JSON-RPC URI) and
+WRANGLER_TEST_PROTOCOL (the deployed protocol address) to also check the vectors
+against the contract's own position_hash and kernel_hash.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eth_account import Account
+from eth_utils import keccak
+from web3 import HTTPProvider, Web3
+
+from wrangler import signing
+from wrangler.block import BlockContext
+from wrangler.utils import get_abi
+
+
+PROTOCOL = Web3.toChecksumAddress('0x' + 'ab' * 20)
+MAX_ADDRESS = Web3.toChecksumAddress('0x' + 'ff' * 20)
+MAX_UINT = 2 ** 256 - 1
+PRIVATE_KEY = '0x' + '11' * 32
+
+
+def address(n):
+    return Web3.toChecksumAddress('0x{:040x}'.format(n))
+
+
+# (addresses, values, lend_currency_owed_value, nonce), expected position_hash
+POSITION_VECTORS = [
+    (([address(0)] * 7, [0] * 7, 0, 0),
+        '0xe61a8efe2c3b2aa086eb38d650f5b197c7ee022827cc03e7c2cf98cc626b64e7'),
+    (([address(0x1000 + i) for i in range(7)], [10 ** 18 * (i + 1) for i in range(7)], 101 * 10 ** 16, 1),
+        '0xfa2c4a83e6173a4e611134de3bd9d590a06c64b4e0e85f53752a13d4739d9e73'),
+    (([MAX_ADDRESS] * 7, [MAX_UINT] * 7, MAX_UINT, MAX_UINT),
+        '0x2b38079d8b83e116a87db3881550d05e3a2724b0ee6a178b9b032059ba31db22'),
+]
+# (addresses, values, kernel_expires_at, creator_salt, daily_interest_rate, position_duration_in_seconds), expected kernel_hash
+KERNEL_VECTORS = [
+    (([address(0)] * 6, [0] * 5, 0, b'\0' * 32, 0, 0),
+        '0x03165d3059b63d72edb34b02cc82fff137616950dd769c10475a6dabbd889685'),
+    (([address(0x1000 + i) for i in range(6)], [10 ** 18 * (i + 1) for i in range(5)], 1546300800, keccak(b'salt'), 10 ** 16, 864000),
+        '0xe642568e3c9bd49238992bdd988efddcc96c35103f2806c7498934518d405d2c'),
+    (([MAX_ADDRESS] * 6, [MAX_UINT] * 5, MAX_UINT, b'\xff' * 32, MAX_UINT, MAX_UINT),
+        '0xe33af75810eafd6f814c0cb1c483e18965d778e985a7833fe0e4cfb100bc78fa'),
+]
+
+
+class SigningVectorsTest(unittest.TestCase):
+
+    def test_position_hash(self):
+        for vector, expected in POSITION_VECTORS:
+            self.assertEqual(Web3.toHex(signing.position_hash(PROTOCOL, *vector)), expected)
+
+    def test_kernel_hash(self):
+        for vector, expected in KERNEL_VECTORS:
+            self.assertEqual(Web3.toHex(signing.kernel_hash(PROTOCOL, *vector)), expected)
+
+    def test_kernel_hash_takes_a_hex_salt(self):
+        vector, expected = KERNEL_VECTORS[1]
+        addresses, values, kernel_expires_at, creator_salt, daily_interest_rate, position_duration_in_seconds = vector
+        self.assertEqual(Web3.toHex(signing.kernel_hash(PROTOCOL, addresses, values, kernel_expires_at, Web3.toHex(creator_salt), daily_interest_rate, position_duration_in_seconds)), expected)
+
+    def test_signed_message_hash(self):
+        for vector, expected in POSITION_VECTORS:
+            message_hash = Web3.toBytes(hexstr=expected)
+            self.assertEqual(signing.signed_message_hash(message_hash), keccak(b'\x19Ethereum Signed Message:\n32' + message_hash))
+
+    def test_sign_hash_matches_account(self):
+        key = signing.private_key(PRIVATE_KEY)
+        for vector, expected in POSITION_VECTORS:
+            message_hash = signing.signed_message_hash(Web3.toBytes(hexstr=expected))
+            self.assertEqual(signing.sign_hash(key, message_hash), bytes(Account.signHash(message_hash, private_key=PRIVATE_KEY)['signature']))
+
+
+@unittest.skipUnless(os.environ.get('WRANGLER_TEST_NODE') and os.environ.get('WRANGLER_TEST_PROTOCOL'), "needs a node and a deployed protocol")
+class DeployedContractTest(unittest.TestCase):
+
+    def setUp(self):
+        web3_client = Web3(HTTPProvider(os.environ['WRANGLER_TEST_NODE']))
+        self.block = BlockContext(web3_client)
+        self.protocol = web3_client.eth.contract(address=Web3.toChecksumAddress(os.environ['WRANGLER_TEST_PROTOCOL']), abi=get_abi('protocol'))
+
+    def test_position_hash(self):
+        self.assertEqual(signing.verify_position_hash(self.block, self.protocol, [vector for vector, expected in POSITION_VECTORS]), [])
+
+    def test_kernel_hash(self):
+        self.assertEqual(signing.verify_kernel_hash(self.block, self.protocol, [vector for vector, expected in KERNEL_VECTORS]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,15 @@
 
 from .simplewrangler import SimpleWrangler
 from .utils import get_json_data_from_file, get_abi
+from .registry import ContractRegistry, registry
+from .positions import PositionStore
+from .snapshot import PositionSnapshot
+from .monitor import ExpiryQueue
+from .health import HealthEngine
+from .models import LoanRequest, LoanObject, checksum_address
+from .gas import GasEstimates, GasPriceOracle
+from .parameters import ProtocolParameters
+from .balances import TokenBalances
+from .validation import Step, ValidationGraph
+from .approvals import ApprovalCache
+from .providers import ProviderPool
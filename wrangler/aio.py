@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import itertools
+import time
+
+from collections import OrderedDict
+
+import aiohttp
+
+from web3 import Web3
+
+from . import signing
+from .batch import BatchReader, encode_call, decode_call, block_param
+from .block import BlockContext
+from .metrics import count_rpc_payload, price_feed_calls, timed
+from .providers import EndpointError, ProviderPool, is_rate_limited_response
+from .simplewrangler import SimpleWrangler, request_scoped
+from .utils import cmc_api_url, cryptocompare_api_url
+from .validation import Step, ValidationGraph
+
+
+class AsyncRPC:
+    """ Minimal asyncio JSON-RPC client over one pooled aiohttp session.
+
+        The same session is used for the price feeds, so one process keeps a single
+        connection pool for all outgoing HTTP.
+    """
+
+    def __init__(self, endpoint_uri, timeout=10, pool=None):
+        self.endpoint_uri = endpoint_uri
+        self.timeout = timeout
+        # with a ProviderPool, requests go to its best endpoint and fail over like the sync path
+        self.pool = pool
+        self._session = None
+        self._ids = itertools.count()
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def _post(self, endpoint_uri, payload):
+        count_rpc_payload(payload, 'aiohttp')
+        async with self.session().post(endpoint_uri, json=payload) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def post(self, payload):
+        if self.pool is None:
+            return await self._post(self.endpoint_uri, payload)
+        error = None
+        for endpoint in self.pool.ranked():
+            started_at = time.monotonic()
+            try:
+                response = await self._post(endpoint.uri, payload)
+                if is_rate_limited_response(response):
+                    raise EndpointError("{0}: rate limited".format(endpoint.uri), rate_limited=True)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, EndpointError) as err:
+                self.pool.record_failure(endpoint)
+                error = err
+                continue
+            endpoint.latencies.append(time.monotonic() - started_at)
+            self.pool.record_success(endpoint)
+            return response
+        raise error
+
+    async def request(self, method, params):
+        response = await self.post({'jsonrpc': '2.0', 'method': method, 'params': params, 'id': next(self._ids)})
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response['result']
+
+    async def batch(self, requests):
+        """ Send (method, params) pairs as one batch and return their results in order."""
+        payload = [{'jsonrpc': '2.0', 'method': method, 'params': params, 'id': _id} for _id, (method, params) in enumerate(requests)]
+        items = sorted(await self.post(payload), key=lambda item: item['id'])
+        for item in items:
+            if 'error' in item:
+                raise ValueError(item['error'])
+        return [item['result'] for item in items]
+
+    async def call(self, contract_function, block_identifier='latest'):
+        return_data = await self.request('eth_call', [encode_call(contract_function), block_param(block_identifier)])
+        return decode_call(contract_function, return_data)
+
+    async def execute(self, reader):
+        """ Run a BatchReader's calls as one batch request."""
+        reader.load(await self.post(reader.payload()))
+        reader.round_trips += 1
+        return reader
+
+    async def latest_block(self):
+        header = await self.request('eth_getBlockByNumber', ['latest', False])
+        return {
+            'number': Web3.toInt(hexstr=header['number']),
+            'timestamp': Web3.toInt(hexstr=header['timestamp']),
+            'hash': header['hash'],
+        }
+
+
+async def cmc_rate_per_weth(session, ticker):
+    price_feed_calls.inc('coinmarketcap')
+    async with session.get(cmc_api_url(ticker)) as response:
+        return (await response.json(content_type=None))[0]["price_eth"]
+
+
+async def cryptocompare_rate(session, lend_currency_ticker, borrow_currency_ticker):
+    api_url, borrow_currency_ticker = cryptocompare_api_url(lend_currency_ticker, borrow_currency_ticker)
+    price_feed_calls.inc('cryptocompare')
+    async with session.get(api_url) as response:
+        return (await response.json(content_type=None))[borrow_currency_ticker]
+
+
+_rpcs = {}
+
+
+class AsyncSimpleWrangler(SimpleWrangler):
+    """ asyncio variant of SimpleWrangler for the read and approval paths.
+
+        Every network call (block header, batched contract reads, position hash, gas
+        estimate, price feeds) is awaited on a shared AsyncRPC, while validation,
+        loan object creation and signing reuse the synchronous implementation.
+    """
+
+    # one awaited prefetch makes every read, the checks run on its results
+    APPROVAL_STEPS = ValidationGraph([
+        Step('prefetch_approval_reads'),
+        Step('validate_kernel', after=['prefetch_approval_reads'], local=True),
+        Step('validate_supported_wrangler', after=['prefetch_approval_reads'], local=True),
+        Step('validate_supported_lend_currency', after=['prefetch_approval_reads'], local=True),
+        Step('validate_supported_borrow_currency', after=['prefetch_approval_reads'], local=True),
+        Step('create_loan_object', after=['validate_kernel', 'validate_supported_wrangler', 'validate_supported_lend_currency', 'validate_supported_borrow_currency'], local=True),
+        Step('validate_lend_currency_balance', after=['create_loan_object'], local=True),
+        Step('validate_lend_currency_allowance', after=['create_loan_object'], local=True),
+        Step('validate_borrow_currency_balance', after=['create_loan_object'], local=True),
+        Step('validate_borrow_currency_allowance', after=['create_loan_object'], local=True),
+        Step('validate_protocol_currency_balance', after=['create_loan_object'], local=True),
+        Step('validate_protocol_currency_allowance', after=['create_loan_object'], local=True),
+    ])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rpc = kwargs.get('rpc', None)
+        if self.rpc is None:
+            provider = self.web3_client.providers[0]
+            if isinstance(provider, ProviderPool):
+                self.rpc = _rpcs.setdefault(provider, AsyncRPC(provider.endpoint_uri, pool=provider))
+            else:
+                self.rpc = _rpcs.setdefault(provider.endpoint_uri, AsyncRPC(provider.endpoint_uri))
+
+    def _reset_request_state(self):
+        super()._reset_request_state()
+        self.prefetched_position_hash = None
+
+    def _remote_position_hash(self):
+        if self.prefetched_position_hash is not None:
+            return self.prefetched_position_hash
+        return super()._remote_position_hash()
+
+    async def fetch_block(self):
+        self.block = BlockContext(self.web3_client, header=await self.rpc.latest_block())
+        return self.block
+
+    async def fetch_borrow_currency_rate(self):
+        return await self.rate_cache.get_async(
+            self._rate_key(self.supported_addresses[self.loan_request.loanToken], self.supported_addresses[self.loan_request.collateralToken]),
+            self._fetch_borrow_currency_rate_async
+        )
+
+    async def _fetch_borrow_currency_rate_async(self):
+        if self._is_weth_dai_pair():
+            medianizer_rate = float(Web3.fromWei(Web3.toInt(self._read('medianizer_rate')), 'ether'))
+            if medianizer_rate != 0.0:
+                return 1/medianizer_rate
+            return float(await cmc_rate_per_weth(self.rpc.session(), 'dai'))
+        return await cryptocompare_rate(
+            self.rpc.session(),
+            self.supported_addresses[self.loan_request.loanToken],
+            self.supported_addresses[self.loan_request.collateralToken])
+
+    async def _sync_read_caches_async(self):
+        # the caches are usually synced already, by another request or a follower thread
+        if not self.read_caches_synced(self.block.number):
+            await asyncio.get_event_loop().run_in_executor(None, self.sync_read_caches)
+
+    @timed
+    async def prefetch_approval_reads(self):
+        await self.fetch_block()
+        await self._sync_read_caches_async()
+        reader = BatchReader(self.web3_client, block_identifier=self.block.number)
+        for key, contract_function in self._uncached_approval_read_functions().items():
+            reader.add(key, contract_function())
+        if self._is_weth_dai_pair():
+            # the rate comes from the medianizer read in the batch
+            self.reads = await self.rpc.execute(reader)
+            self.rate = await self.fetch_borrow_currency_rate()
+        else:
+            self.reads, self.rate = await asyncio.gather(self.rpc.execute(reader), self.fetch_borrow_currency_rate())
+
+    @timed
+    async def _sign_fill_kernel_transaction(self):
+        # only what is not cached for this block goes out, as one batch
+        block_number = self.block.number
+        transaction = self._fill_kernel_transaction()
+        shape = self._fill_kernel_shape()
+        gas_estimate = self.gas_estimates.get(shape)
+        gas_price_oracle = self.gas_price_oracle()
+        nonces = self.transaction_submitter().nonces
+        requests = OrderedDict()
+        if gas_estimate is None and self.live_gas_estimate:
+            requests['gas_estimate'] = ('eth_estimateGas', [transaction])
+        else:
+            requests['preflight'] = ('eth_call', self._fill_kernel_preflight(transaction))
+        if not gas_price_oracle.is_current(block_number):
+            requests['gas_price'] = ('eth_gasPrice', [])
+        if not nonces.is_synced(block_number):
+            requests['nonce'] = ('eth_getTransactionCount', [nonces.address, 'pending'])
+        results = {}
+        if len(requests):
+            results = dict(zip(requests.keys(), await self.rpc.batch(list(requests.values()))))
+        if 'preflight' in results:
+            self._check_fill_kernel_preflight(results['preflight'])
+        if 'gas_estimate' in results:
+            gas_estimate = Web3.toInt(hexstr=results['gas_estimate'])
+            self.gas_estimates.record(shape, gas_estimate)
+        elif gas_estimate is None:
+            gas_estimate = self.fill_kernel_gas_limit
+        if 'gas_price' in results:
+            gas_price_oracle.update(block_number, Web3.toInt(hexstr=results['gas_price']))
+        if 'nonce' in results:
+            nonces.update(block_number, Web3.toInt(hexstr=results['nonce']))
+        signed_raw_tx_hex = self._signed_fill_kernel_transaction(
+            transaction,
+            gas_estimate,
+            gas_price_oracle.price(block_number),
+            nonces.current(block_number)
+        )
+
+        return gas_estimate, signed_raw_tx_hex
+
+    @request_scoped
+    @timed
+    async def approve_loan(self, data):
+        self.reset_approval(data)
+        # local checks run on every request, cached or not
+        if not self.run_local_checks():
+            return self.approval_result()
+        if self.approval_cache is None or len(self.errors):
+            return await self._approve_loan()
+        return await self.approval_cache.get_async(self.loan_request, self._approve_loan)
+
+    async def _approve_loan(self):
+        # perform the remaining validations and create the loan object
+        if not await self.APPROVAL_STEPS.run_async(self, self.fail_fast):
+            return self.approval_result()
+        # create approval
+        if not (self.local_signing and signing.is_verified(self.protocol_contract().address)):
+            self.prefetched_position_hash = await self.rpc.call(self._position_hash_function(), self.block.number)
+        self.create_approval()
+
+        if not len(self.errors):
+            # estimate gas cost for transaction
+            try:
+                self.set_fill_kernel_transaction(*(await self._sign_fill_kernel_transaction()))
+            except ValueError as err:
+                self.set_invalid_parameters(err)
+
+        return self.approval_result()
+
+    @request_scoped
+    async def get_loan_health(self, position_index):
+        health = 0
+        self.errors = []
+        if position_index < 0:
+            self.errors.append({
+                'label': 'invalid_position_index',
+                'message': 'Loan position index cannot be negative'
+            })
+        # get the position
+        await self.fetch_block()
+        position_hash = await self.rpc.call(self.protocol_contract().functions.position_index(position_index), self.block.number)
+        position = await self.rpc.call(self.protocol_contract().functions.position(position_hash), self.block.number)
+        tickers = self._position_tickers(position)
+        lend_currency_current_rate_per_borrow_currency = await self.rate_cache.get_async(
+            self._rate_key(*tickers),
+            lambda: cryptocompare_rate(self.rpc.session(), *tickers)
+        )
+
+        health = self._position_health(position, lend_currency_current_rate_per_borrow_currency)
+
+        return health, self.errors
+
+    @request_scoped
+    async def is_valid_protocol_transaction_sender(self, sender, txHash):
+        protocol_tx = await self.rpc.request('eth_getTransactionByHash', [txHash])
+        protocol_tx = dict(protocol_tx, gas=Web3.toInt(hexstr=protocol_tx['gas']))
+        return self._is_valid_sender(protocol_tx, sender)
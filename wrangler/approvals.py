@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import threading
+import time
+
+from concurrent.futures import Future
+
+from .metrics import cache_requests
+from .models import LoanRequest
+
+
+class ApprovalCache:
+    """ Approval results keyed on the kernel signature, salt, fill amount and filler.
+
+        A retried loan request gets the approval it was already given, as long as
+        that approval is more than `margin` seconds away from the end of its validity
+        window (_timestamps[1]). Each entry keeps a digest of every field of the
+        request it approved, and only a request with the same digest is answered from
+        it; one that reuses the signature, salt, fill amount and filler with any other
+        field changed is approved afresh. Only approvals without errors are kept. A
+        request that arrives while the same one is being approved waits for that
+        approval instead of computing its own, so duplicates never take separate
+        wrangler nonces.
+    """
+
+    def __init__(self, margin=15, clock=time.time):
+        self.margin = margin
+        self.clock = clock
+        # key -> (result, expires_at, digest)
+        self.entries = {}
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+
+    def key(self, loan_request):
+        return (
+            loan_request.ecSignatureCreator.lower(),
+            loan_request.creatorSalt.lower(),
+            loan_request.fillLoanAmount,
+            loan_request.filler
+        )
+
+    def digest(self, loan_request):
+        """ A digest of every parsed field of a loan request."""
+        return hashlib.sha256(repr(tuple(getattr(loan_request, field) for field in LoanRequest.__slots__)).encode()).digest()
+
+    def _lookup(self, key, digest):
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return None
+        result, expires_at, entry_digest = entry
+        if self.clock() >= expires_at:
+            self.entries.pop(key, None)
+            return None
+        return result if entry_digest == digest else None
+
+    def _store(self, key, digest, result):
+        loan, approval, errors = result
+        if not len(errors):
+            self.entries[key] = (result, approval['_timestamps'][1] - self.margin, digest)
+
+    def _expire(self):
+        now = self.clock()
+        for key in [key for key, (result, expires_at, digest) in self.entries.items() if now >= expires_at]:
+            del self.entries[key]
+
+    def get(self, loan_request, approve):
+        """ The cached result for loan_request, else the result of approve(), computed once for concurrent callers."""
+        key, digest = self.key(loan_request), self.digest(loan_request)
+        with self._lock:
+            result = self._lookup(key, digest)
+            flight = self._flights.get((key, digest), None)
+            is_leader = result is None and flight is None
+            if is_leader:
+                flight = self._flights[(key, digest)] = Future()
+        if result is not None:
+            cache_requests.inc('approvals', 'hit')
+            return result
+        if not is_leader:
+            cache_requests.inc('approvals', 'coalesced')
+            return flight.result()
+        cache_requests.inc('approvals', 'miss')
+        try:
+            result = approve()
+        except BaseException as err:
+            with self._lock:
+                del self._flights[(key, digest)]
+            flight.set_exception(err)
+            raise
+        with self._lock:
+            self._expire()
+            self._store(key, digest, result)
+            del self._flights[(key, digest)]
+        flight.set_result(result)
+        return result
+
+    async def get_async(self, loan_request, approve):
+        """ Like get(), for an approve function that returns an awaitable."""
+        key, digest = self.key(loan_request), self.digest(loan_request)
+        with self._lock:
+            result = self._lookup(key, digest)
+        if result is not None:
+            cache_requests.inc('approvals', 'hit')
+            return result
+        flight = self._async_flights.get((key, digest), None)
+        if flight is not None:
+            cache_requests.inc('approvals', 'coalesced')
+            return await asyncio.shield(flight)
+        cache_requests.inc('approvals', 'miss')
+        flight = self._async_flights[(key, digest)] = asyncio.ensure_future(approve())
+        try:
+            result = await asyncio.shield(flight)
+            with self._lock:
+                self._expire()
+                self._store(key, digest, result)
+            return result
+        finally:
+            self._async_flights.pop((key, digest), None)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from .events import LogTailer, TailedCache
+from .metrics import cache_requests
+from .models import checksum_address
+from .utils import get_abi
+
+
+def _address_event(name, argument):
+    return {
+        'anonymous': False,
+        'inputs': [{'indexed': True, 'name': argument, 'type': 'address'}, {'indexed': False, 'name': 'wad', 'type': 'uint256'}],
+        'name': name,
+        'type': 'event',
+    }
+
+
+# WETH and ds-token (SAI) change balances without a Transfer
+NON_ERC20_EVENTS = [
+    _address_event('Deposit', 'dst'),
+    _address_event('Withdrawal', 'src'),
+    _address_event('Mint', 'guy'),
+    _address_event('Burn', 'guy'),
+]
+
+
+def balance_events():
+    return [item for item in get_abi('ERC20') if item['type'] == 'event'] + NON_ERC20_EVENTS
+
+
+def address_topic(_address):
+    return '0x' + checksum_address(_address)[2:].lower().rjust(64, '0')
+
+
+class TokenBalances(TailedCache):
+    """ Balances and allowances of token holders, keyed on (token, owner, spender).
+
+        A balance is cached under spender None. Entries are recorded as approvals read
+        them and dropped when a log of the token names the owner: a Transfer from or to
+        it (which may also spend its allowances), an Approval by it, or a WETH or
+        ds-token Deposit, Withdrawal, Mint or Burn. Only the configured tokens are
+        cached, and only their logs naming a cached owner are tailed. A lookup at a
+        block the cache has not been synced to misses.
+    """
+
+    name = 'token balances'
+
+    def __init__(self, web3_client, tokens, reorg_depth=12):
+        super().__init__(web3_client, reorg_depth=reorg_depth)
+        self.tokens = set(map(checksum_address, tokens))
+        # (token, owner) -> {spender: amount}
+        self.values = {}
+
+    def load(self, block_number):
+        """ Start empty and tail the tokens' logs from the next block."""
+        with self._lock:
+            self.values = {}
+            self.tailer = LogTailer(
+                self.web3_client,
+                sorted(self.tokens),
+                balance_events(),
+                from_block=block_number + 1,
+                reorg_depth=self.reorg_depth,
+                topic_filters=self.owner_topics
+            )
+
+    def owner_topics(self):
+        """ The log topics naming a cached owner: first (from, owner, dst, src, guy), or second (to)."""
+        with self._lock:
+            owners = sorted(set(address_topic(owner) for token, owner in self.values))
+        if not len(owners):
+            return []
+        return [[owners], [None, owners]]
+
+    def invalidate(self, log):
+        token = checksum_address(log['address'])
+        for argument, value in log['args'].items():
+            if isinstance(value, str) and argument != '_spender':
+                self.values.pop((token, checksum_address(value)), None)
+
+    def amount(self, token, owner, spender=None, block_number=None, count=True):
+        """ The cached amount, or None, also when the cache is behind block_number. A lookup with count=False is left out of the hit/miss metrics."""
+        token = checksum_address(token)
+        if token not in self.tokens:
+            return None
+        with self._lock:
+            value = None
+            if block_number is None or self.is_current(block_number):
+                value = self.values.get((token, checksum_address(owner)), {}).get(spender and checksum_address(spender), None)
+        if count:
+            cache_requests.inc('token_balances', 'miss' if value is None else 'hit')
+        return value
+
+    def record(self, token, owner, spender, value, block_number):
+        """ Cache an amount read at block_number, unless a log may have changed it since."""
+        token = checksum_address(token)
+        if token not in self.tokens:
+            return
+        with self._lock:
+            if self.tailer is not None and block_number >= self.tailer.last_block:
+                self.values.setdefault((token, checksum_address(owner)), {})[spender and checksum_address(spender)] = value
+
+
+_balances = {}
+_balances_lock = threading.Lock()
+
+
+def get_token_balances(web3_client, tokens):
+    """ The process-wide TokenBalances of a set of tokens."""
+    key = (web3_client, frozenset(map(checksum_address, tokens)))
+    with _balances_lock:
+        if key not in _balances:
+            _balances[key] = TokenBalances(web3_client, tokens)
+        return _balances[key]
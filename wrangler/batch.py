@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import json
+
+from collections import OrderedDict
+
+import requests
+
+from eth_abi import decode_abi
+from web3 import Web3
+from web3.utils.abi import get_abi_output_types, map_abi_data
+from web3.utils.normalizers import BASE_RETURN_NORMALIZERS
+
+from .metrics import count_rpc_payload
+from .providers import ProviderPool
+
+
+_session = requests.Session()
+
+
+def encode_call(contract_function):
+    """ Return the eth_call transaction for a contract function that has its arguments bound."""
+    return {
+        'to': contract_function.address,
+        'data': contract_function._encode_transaction_data(),
+    }
+
+
+def decode_call(contract_function, return_data):
+    """ Decode eth_call return data the same way ContractFunction.call() does."""
+    if isinstance(return_data, str):
+        return_data = Web3.toBytes(hexstr=return_data)
+    output_types = get_abi_output_types(contract_function.abi)
+    output_data = decode_abi(output_types, return_data)
+    normalizers = itertools.chain(BASE_RETURN_NORMALIZERS, contract_function._return_data_normalizers)
+    normalized_data = map_abi_data(normalizers, output_types, output_data)
+    if len(normalized_data) == 1:
+        return normalized_data[0]
+    return normalized_data
+
+
+def call_key(contract_function):
+    """ Identify a read by its target and call data, so identical reads can be shared."""
+    call = encode_call(contract_function)
+    return (call['to'], call['data'])
+
+
+def block_param(block_identifier):
+    if isinstance(block_identifier, int):
+        return Web3.toHex(block_identifier)
+    return block_identifier
+
+
+class BatchReader:
+    """ Collect contract reads and execute them against one block.
+
+        When batching is enabled and the provider talks HTTP, all reads go out as a
+        single JSON-RPC batch request. Otherwise they are sent as sequential eth_calls.
+    """
+
+    def __init__(self, web3_client, block_identifier='latest', batched=True):
+        self.web3_client = web3_client
+        self.block_identifier = block_identifier
+        self.batched = batched
+        self.calls = OrderedDict()
+        self.results = {}
+        self.errors = {}
+        self.round_trips = 0
+
+    def __contains__(self, key):
+        return key in self.results or key in self.errors
+
+    def add(self, key, contract_function):
+        self.calls[key] = contract_function
+
+    def add_call(self, contract_function):
+        """ Add a read keyed by its call data; a read that is already queued is not sent twice."""
+        key = call_key(contract_function)
+        self.calls.setdefault(key, contract_function)
+        return key
+
+    def result(self, key):
+        if key in self.errors:
+            raise ValueError(self.errors[key])
+        return self.results[key]
+
+    def endpoint_uri(self):
+        providers = self.web3_client.providers
+        if len(providers) != 1:
+            return None
+        return getattr(providers[0], 'endpoint_uri', None)
+
+    def execute(self):
+        if not len(self.calls):
+            return self
+        if self.batched and self.endpoint_uri():
+            self._execute_batch()
+        else:
+            self._execute_sequential()
+        return self
+
+    def _execute_sequential(self):
+        for key, contract_function in self.calls.items():
+            try:
+                return_data = self.web3_client.eth.call(encode_call(contract_function), block_identifier=block_param(self.block_identifier))
+                self.results[key] = decode_call(contract_function, return_data)
+            except ValueError as err:
+                self.errors[key] = err.args[0] if err.args else err
+            self.round_trips += 1
+
+    def payload(self):
+        """ The JSON-RPC batch request for the collected calls."""
+        return [{
+            'jsonrpc': '2.0',
+            'method': 'eth_call',
+            'params': [encode_call(contract_function), block_param(self.block_identifier)],
+            'id': _id,
+        } for _id, contract_function in enumerate(self.calls.values())]
+
+    def load(self, items):
+        """ Decode the items of a JSON-RPC batch response."""
+        keys = list(self.calls.keys())
+        for item in items:
+            key = keys[item['id']]
+            if 'error' in item:
+                self.errors[key] = item['error']
+            else:
+                self.results[key] = decode_call(self.calls[key], item['result'])
+
+    def _post(self, payload):
+        count_rpc_payload(payload, 'batch')
+        provider = self.web3_client.providers[0]
+        if isinstance(provider, ProviderPool):
+            # fail over and hedge like any other read through the pool
+            return provider.post(payload)
+        response = _session.post(
+            self.endpoint_uri(),
+            data=json.dumps(payload),
+            headers={'Content-Type': 'application/json'},
+            timeout=10
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _execute_batch(self):
+        items = self._post(self.payload())
+        self.round_trips += 1
+        if not isinstance(items, list):
+            # the node does not support batch requests
+            self._execute_sequential()
+            return
+        self.load(items)
+
+
+class BatchView:
+    """ One consumer's own keys onto a shared BatchReader."""
+
+    def __init__(self, reader, keys):
+        self.reader = reader
+        self.keys = keys
+
+    def __contains__(self, key):
+        return key in self.keys and self.keys[key] in self.reader
+
+    def result(self, key):
+        return self.reader.result(self.keys[key])
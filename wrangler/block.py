@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from .batch import encode_call, decode_call, block_param
+
+
+class BlockContext:
+    """ Latest block header, fetched once and shared by every read of one operation.
+
+        Contract reads made through call() are pinned to the header's block number,
+        so an operation never straddles two blocks. refresh() re-fetches the header
+        only when a newer block has arrived.
+    """
+
+    def __init__(self, web3_client, header=None):
+        self.web3_client = web3_client
+        self._header = header
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = self.web3_client.eth.getBlock('latest')
+        return self._header
+
+    @property
+    def number(self):
+        return self.header['number']
+
+    @property
+    def timestamp(self):
+        return self.header['timestamp']
+
+    def refresh(self):
+        """ Re-fetch the header if a new block was mined. Returns True when it changed."""
+        if self._header is None:
+            self.header
+            return True
+        if self.web3_client.eth.blockNumber <= self.number:
+            return False
+        self._header = self.web3_client.eth.getBlock('latest')
+        return True
+
+    def call(self, contract_function):
+        """ eth_call a bound contract function at this block."""
+        return_data = self.web3_client.eth.call(encode_call(contract_function), block_identifier=block_param(self.number))
+        return decode_call(contract_function, return_data)
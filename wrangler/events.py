@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from web3.utils.events import get_event_data
+
+
+logger = logging.getLogger(__name__)
+
+
+def event_abi(abi, event_name):
+    for item in abi:
+        if item['type'] == 'event' and item['name'] == event_name:
+            return item
+    raise ValueError("event {0} not found in abi".format(event_name))
+
+
+def log_id(log):
+    return (Web3.toHex(log['blockHash']), log['logIndex'])
+
+
+class LogTailer:
+    """ Tail decoded contract event logs from the last processed block.
+
+        Every poll re-reads the last `reorg_depth` blocks. Logs seen on an earlier poll
+        that are no longer on the canonical chain are returned as rolled back, and only
+        logs that were not delivered before are returned as new.
+
+        Logs are requested `page_size` blocks at a time, so a poll after a long pause
+        (e.g. a restart from an old snapshot) stays within the node's eth_getLogs limits.
+        A page the node still refuses as too large is split in halves.
+
+        `topics` are the topics after the event signature every log must match. A
+        `topic_filters` function instead returns, on every poll, a list of such topics
+        to match any of (one eth_getLogs each); with an empty list nothing is requested.
+    """
+
+    def __init__(self, web3_client, address, event_abis, from_block, reorg_depth=12, topics=None, topic_filters=None, page_size=5000):
+        assert reorg_depth > 0, "reorg_depth must be positive"
+        self.web3_client = web3_client
+        self.address = address
+        self.event_abis = {Web3.toHex(event_abi_to_log_topic(abi)): abi for abi in event_abis}
+        self.topics = topics or []
+        self.topic_filters = topic_filters or (lambda: [self.topics])
+        self.start_block = from_block
+        self.last_block = from_block - 1
+        self.reorg_depth = reorg_depth
+        self.page_size = page_size
+        # logs delivered for the most recent `reorg_depth` blocks, by block number
+        self.journal = OrderedDict()
+
+    def get_logs(self, from_block, to_block):
+        logs = []
+        for page_from_block in range(from_block, to_block + 1, self.page_size):
+            logs.extend(self._get_logs_page(page_from_block, min(page_from_block + self.page_size - 1, to_block)))
+        return logs
+
+    def _get_logs_page(self, from_block, to_block):
+        try:
+            return self._get_logs(from_block, to_block)
+        except ValueError as err:
+            # e.g. Infura's "query returned more than 10000 results"
+            if from_block == to_block:
+                raise
+            logger.debug("Splitting eth_getLogs over blocks %s-%s: %s", from_block, to_block, err)
+            middle = (from_block + to_block) // 2
+            return self._get_logs_page(from_block, middle) + self._get_logs_page(middle + 1, to_block)
+
+    def _get_logs(self, from_block, to_block):
+        logs = OrderedDict()
+        for topics in self.topic_filters():
+            for log in self.web3_client.eth.getLogs({
+                'address': self.address,
+                'fromBlock': Web3.toHex(from_block),
+                'toBlock': Web3.toHex(to_block),
+                'topics': [list(self.event_abis.keys())] + topics,
+            }):
+                logs[log_id(log)] = log
+        ordered = sorted(logs.values(), key=lambda log: (log['blockNumber'], log['logIndex']))
+        return [get_event_data(self.event_abis[Web3.toHex(log['topics'][0])], log) for log in ordered]
+
+    def poll(self, to_block):
+        """ Return (rolled_back, new) lists of decoded logs up to and including to_block."""
+        from_block = max(self.start_block, self.last_block - self.reorg_depth + 1)
+        if to_block < from_block:
+            return [], []
+        logs = self.get_logs(from_block, to_block)
+
+        previous = OrderedDict()
+        for block_number in [number for number in self.journal if number >= from_block]:
+            for log in self.journal.pop(block_number):
+                previous[log_id(log)] = log
+        current_ids = set(log_id(log) for log in logs)
+        rolled_back = [log for _id, log in previous.items() if _id not in current_ids]
+        new = [log for log in logs if log_id(log) not in previous]
+
+        for log in logs:
+            self.journal.setdefault(log['blockNumber'], []).append(log)
+        self.last_block = max(self.last_block, to_block)
+        for block_number in [number for number in self.journal if number <= self.last_block - self.reorg_depth]:
+            del self.journal[block_number]
+
+        return rolled_back, new
+
+
+class TailedCache:
+    """ Base of the caches kept current by tailing logs.
+
+        Subclasses create self.tailer in load(block_number), which runs on the first
+        sync, and drop whatever a log makes stale in invalidate(log), which runs with
+        self._lock held for new and rolled back logs alike. sync() polls at most once
+        per block.
+    """
+
+    name = 'cache'
+
+    def __init__(self, web3_client, reorg_depth=12):
+        self.web3_client = web3_client
+        self.reorg_depth = reorg_depth
+        self.tailer = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    @property
+    def block_number(self):
+        """ The block the cache is synced to, or None before it is loaded."""
+        return self.tailer.last_block if self.tailer is not None else None
+
+    def is_current(self, block_number):
+        return self.tailer is not None and block_number <= self.tailer.last_block
+
+    def load(self, block_number):
+        raise NotImplementedError
+
+    def invalidate(self, log):
+        raise NotImplementedError
+
+    def start(self, block_number):
+        """ Load the cache at block_number on first use, leaving a loaded cache as it is."""
+        if self.tailer is not None:
+            return
+        with self._sync_lock:
+            if self.tailer is None:
+                self.load(block_number)
+
+    def sync(self, block_number):
+        """ Bring the cache up to block_number, loading it on first use."""
+        if self.is_current(block_number):
+            return
+        with self._sync_lock:
+            if self.tailer is None:
+                self.load(block_number)
+                return
+            if self.is_current(block_number):
+                return
+            rolled_back, new = self.tailer.poll(block_number)
+            with self._lock:
+                for log in rolled_back + new:
+                    self.invalidate(log)
+
+    def follow_forever(self, interval=15):
+        """ Sync to the latest block on a daemon thread every `interval` seconds, so requests rarely have to."""
+        def run():
+            while True:
+                try:
+                    self.sync(self.web3_client.eth.blockNumber)
+                except Exception:
+                    logger.exception("Failed to sync the %s", self.name)
+                time.sleep(interval)
+        thread = threading.Thread(target=run, name='wrangler-' + self.name.replace(' ', '-'), daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from .metrics import cache_requests
+
+
+class GasPriceOracle:
+    """ eth_gasPrice, read at most once per block."""
+
+    def __init__(self, web3_client):
+        self.web3_client = web3_client
+        self._price = None
+        self._block_number = None
+        self._lock = threading.Lock()
+
+    def is_current(self, block_number):
+        return self._price is not None and block_number is not None and block_number == self._block_number
+
+    def price(self, block_number=None):
+        with self._lock:
+            if self.is_current(block_number):
+                cache_requests.inc('gas_price', 'hit')
+            else:
+                cache_requests.inc('gas_price', 'miss')
+                self._price = self.web3_client.eth.gasPrice
+                self._block_number = block_number
+            return self._price
+
+    def update(self, block_number, price):
+        """ Record a gas price read elsewhere, e.g. in a JSON-RPC batch."""
+        with self._lock:
+            self._price = price
+            self._block_number = block_number
+
+
+class GasEstimates:
+    """ Gas estimates remembered per transaction shape, returned with a safety margin.
+
+        A shape is whatever determines the gas a transaction uses (for fill_kernel the
+        token pair, who created the kernel and which fees are paid), so transactions of
+        a known shape need no eth_estimateGas. The highest estimate seen is kept.
+    """
+
+    def __init__(self, margin=1.2):
+        self.margin = margin
+        self._estimates = {}
+        self._lock = threading.Lock()
+
+    def get(self, shape):
+        with self._lock:
+            gas_estimate = self._estimates.get(shape, None)
+        if gas_estimate is None:
+            cache_requests.inc('gas_estimates', 'miss')
+            return None
+        cache_requests.inc('gas_estimates', 'hit')
+        return int(gas_estimate * self.margin)
+
+    def record(self, shape, gas_estimate):
+        with self._lock:
+            self._estimates[shape] = max(gas_estimate, self._estimates.get(shape, 0))
+
+    def clear(self):
+        with self._lock:
+            self._estimates.clear()
+
+
+_oracles = {}
+_oracles_lock = threading.Lock()
+
+
+def get_gas_price_oracle(web3_client):
+    """ The process-wide GasPriceOracle for a node."""
+    with _oracles_lock:
+        if web3_client not in _oracles:
+            _oracles[web3_client] = GasPriceOracle(web3_client)
+        return _oracles[web3_client]
+
+
+fill_kernel_gas = GasEstimates()
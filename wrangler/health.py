@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import numpy as np
+
+from web3 import Web3
+
+from .models import checksum_address
+from .monitor import POSITION_STATUS_OPEN
+
+
+WEI_PER_ETHER = 10 ** 18
+
+
+def positions_health(positions, rates, initial_margin):
+    """ Collateral health of many positions in one vectorized pass.
+
+        `rates` holds the lend currency rate per borrow currency for each position,
+        NaN where it is unknown. Returns a float array, NaN where health is undefined.
+    """
+    collateral = np.fromiter((position[11] for position in positions), dtype=np.float64, count=len(positions)) / WEI_PER_ETHER
+    filled = np.fromiter((position[13] for position in positions), dtype=np.float64, count=len(positions)) / WEI_PER_ETHER
+    rates = np.asarray(rates, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        health = collateral * rates * 100 / initial_margin / filled
+    health[~np.isfinite(health)] = np.nan
+    return health
+
+
+def filter_positions(positions, lender=None, borrower=None, status=None):
+    lender = checksum_address(lender) if lender else None
+    borrower = checksum_address(borrower) if borrower else None
+    return [
+        position for position in positions
+        if (lender is None or checksum_address(position[2]) == lender)
+        and (borrower is None or checksum_address(position[3]) == borrower)
+        and (status is None or position[15] == status)
+    ]
+
+
+def health_record(position, health):
+    return {
+        'position_index': position[0],
+        'position_hash': Web3.toHex(position[21]),
+        'lender': position[2],
+        'borrower': position[3],
+        'status': position[15],
+        'health': None if np.isnan(health) else float(health),
+    }
+
+
+class PairPositions:
+    """ Open positions of one currency pair, as contiguous arrays.
+
+        Rows are kept dense: removing a position moves the last row into its place,
+        so health is always computed over the first `size` rows.
+    """
+
+    def __init__(self, capacity=64):
+        self.size = 0
+        self.collateral = np.empty(capacity, dtype=np.float64)
+        self.filled = np.empty(capacity, dtype=np.float64)
+        # whether the position was below the threshold at the last rate, NaN health counts as not below
+        self.below = np.zeros(capacity, dtype=bool)
+        self.positions = []
+        self.rows = {}
+
+    def _grow(self):
+        capacity = 2 * len(self.collateral)
+        for name in ('collateral', 'filled', 'below'):
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, name, grown)
+
+    def update(self, position):
+        position_hash = bytes(position[21])
+        row = self.rows.get(position_hash, None)
+        if row is None:
+            if self.size == len(self.collateral):
+                self._grow()
+            row = self.rows[position_hash] = self.size
+            self.positions.append(position)
+            self.below[row] = False
+            self.size += 1
+        self.positions[row] = position
+        self.collateral[row] = position[11] / WEI_PER_ETHER
+        self.filled[row] = position[13] / WEI_PER_ETHER
+
+    def discard(self, position_hash):
+        row = self.rows.pop(bytes(position_hash), None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            for array in (self.collateral, self.filled, self.below):
+                array[row] = array[last]
+            self.positions[row] = self.positions[last]
+            self.rows[bytes(self.positions[row][21])] = row
+        self.positions.pop()
+        self.size = last
+
+    def health(self, rate, initial_margin):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            health = self.collateral[:self.size] * rate * 100 / initial_margin / self.filled[:self.size]
+        health[~np.isfinite(health)] = np.nan
+        return health
+
+    def __len__(self):
+        return self.size
+
+
+class HealthEngine:
+    """ Collateral health of the open positions, recomputed per currency pair on every rate.
+
+        Positions are indexed by (borrow_currency_address, lend_currency_address). A new
+        rate for a pair (lend currency per borrow currency) recomputes the health of
+        that pair's positions only, in one vectorized pass. Positions whose health drops
+        below `threshold` are emitted once, as health records, to `callback` (a list per
+        rate) and/or `queue` (one record per put); a position that recovers can be
+        emitted again.
+    """
+
+    def __init__(self, threshold, initial_margin=1.5, callback=None, queue=None):
+        self.threshold = threshold
+        self.initial_margin = initial_margin
+        self.callback = callback
+        self.queue = queue
+        self.pairs = {}
+        self.rates = {}
+        self._pair_of = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def pair(position):
+        return (checksum_address(position[9]), checksum_address(position[10]))
+
+    def update(self, position):
+        """ Track an open position, or stop tracking one that is no longer open."""
+        position_hash = bytes(position[21])
+        with self._lock:
+            if position[15] != POSITION_STATUS_OPEN:
+                self._discard(position_hash)
+                return
+            pair = self.pair(position)
+            if self._pair_of.get(position_hash, pair) != pair:
+                self._discard(position_hash)
+            self._pair_of[position_hash] = pair
+            self.pairs.setdefault(pair, PairPositions()).update(position)
+
+    def discard(self, position_hash):
+        with self._lock:
+            self._discard(bytes(position_hash))
+
+    def _discard(self, position_hash):
+        pair = self._pair_of.pop(position_hash, None)
+        if pair is not None:
+            self.pairs[pair].discard(position_hash)
+
+    def on_rate(self, pair, rate):
+        """ Recompute the health of a pair's positions at a new rate. Returns the records that crossed the threshold."""
+        with self._lock:
+            self.rates[pair] = rate
+            positions = self.pairs.get(pair, None)
+            if positions is None or not len(positions):
+                return []
+            health = positions.health(rate, self.initial_margin)
+            below = health < self.threshold
+            crossed = np.flatnonzero(below & ~positions.below[:positions.size])
+            positions.below[:positions.size] = below
+            records = [health_record(positions.positions[row], health[row]) for row in crossed]
+        if len(records):
+            self.emit(records)
+        return records
+
+    def emit(self, records):
+        if self.callback is not None:
+            self.callback(records)
+        if self.queue is not None:
+            for record in records:
+                self.queue.put(record)
+
+    def __len__(self):
+        return len(self._pair_of)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def _format_labels(labelnames, labels):
+    if not len(labelnames):
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('"', '\\"')) for name, value in zip(labelnames, labels)) + '}'
+
+
+class Counter:
+    """ A monotonically increasing count, per combination of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        assert len(labels) == len(self.labelnames), "{0} takes labels {1}".format(self.name, self.labelnames)
+        with self._lock:
+            self.values[labels] += amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """ Observed durations in cumulative buckets, per combination of label values."""
+
+    kind = 'histogram'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.sums = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        assert len(labels) == len(self.labelnames), "{0} takes labels {1}".format(self.name, self.labelnames)
+        with self._lock:
+            counts = self.counts.setdefault(labels, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.sums[labels] += value
+
+    def count(self, *labels):
+        return self.counts.get(labels, [0])[-1]
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, list(counts), self.sums[labels]) for labels, counts in self.counts.items())
+        labelnames = self.labelnames + ('le',)
+        for labels, counts, total in items:
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                yield self.name + '_bucket' + _format_labels(labelnames, labels + (bound,)), count
+            yield self.name + '_sum' + _format_labels(self.labelnames, labels), total
+            yield self.name + '_count' + _format_labels(self.labelnames, labels), counts[-1]
+
+
+class MetricsRegistry:
+    """ The process's metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+            for sample, value in metric.samples():
+                lines.append('{0} {1}'.format(sample, repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+rpc_calls = metrics.counter('wrangler_rpc_calls_total', 'JSON-RPC calls sent to the node, by method.', ('method',))
+rpc_round_trips = metrics.counter('wrangler_rpc_round_trips_total', 'HTTP requests sent to the node; a batch counts once.', ('transport',))
+price_feed_calls = metrics.counter('wrangler_price_feed_calls_total', 'Requests to external price feeds.', ('feed',))
+cache_requests = metrics.counter('wrangler_cache_requests_total', 'Cache lookups, by cache and result.', ('cache', 'result'))
+stage_seconds = metrics.histogram('wrangler_stage_seconds', 'Time spent in each stage of an operation.', ('stage',))
+request_seconds = metrics.histogram('wrangler_request_seconds', 'Time to serve an API request.', ('endpoint',))
+
+
+def count_rpc_payload(payload, transport):
+    """ Count the calls of a JSON-RPC request or batch about to be sent."""
+    for item in (payload if isinstance(payload, list) else [payload]):
+        rpc_calls.inc(item['method'])
+    rpc_round_trips.inc(transport)
+
+
+def rpc_metrics_middleware(make_request, web3):
+    """ web3 middleware counting every request made through the client."""
+    def middleware(method, params):
+        rpc_calls.inc(method)
+        rpc_round_trips.inc('web3')
+        return make_request(method, params)
+    return middleware
+
+
+def timed(function):
+    """ Record the duration of every call of a (sync or async) function under its name."""
+    stage = function.__name__.lstrip('_')
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                stage_seconds.observe(time.perf_counter() - started_at, stage)
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stage_seconds.observe(time.perf_counter() - started_at, stage)
+    return wrapper
+
+
+class Sampling:
+    """ Stack samples of one thread, taken by a background thread until stopped."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.started_at = time.perf_counter()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='wrangler-profiler', daemon=True)
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append('{0}:{1}:{2}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+        return time.perf_counter() - self.started_at
+
+
+class SlowRequestProfiler:
+    """ Sampling profiler for requests slower than `threshold` seconds.
+
+        start() begins sampling the calling thread's stack every `interval` seconds;
+        stop() logs the `top` most sampled stacks, as collapsed stacks, if the request
+        took longer than the threshold.
+    """
+
+    def __init__(self, threshold=1.0, interval=0.005, top=10):
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+
+    def start(self):
+        return Sampling(threading.get_ident(), self.interval)
+
+    def stop(self, sampling, label):
+        elapsed = sampling.stop()
+        if elapsed < self.threshold:
+            return None
+        stacks = sampling.stacks.most_common(self.top)
+        logger.warning("Slow request %s took %.3fs; hottest stacks (of %d samples):\n%s",
+            label, elapsed, sum(sampling.stacks.values()),
+            '\n'.join('{0} {1}'.format(stack, count) for stack, count in stacks))
+        return stacks
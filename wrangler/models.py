@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import functools
+
+from web3 import Web3
+
+
+@functools.lru_cache(maxsize=4096)
+def checksum_address(address):
+    """ Checksummed form of an address; the same few addresses recur in every request."""
+    return Web3.toChecksumAddress(address)
+
+
+class LoanRequest:
+    """ A filled order sent from the relayer UI, parsed once into checksummed addresses and ints."""
+
+    ADDRESS_FIELDS = ('lender', 'borrower', 'relayer', 'wrangler', 'filler', 'loanToken', 'collateralToken')
+    INT_FIELDS = ('offerExpiry', 'loanDuration', 'loanAmountOffered', 'fillLoanAmount', 'relayerFeeLST', 'monitoringFeeLST', 'rolloverFeeLST', 'closureFeeLST')
+
+    __slots__ = ADDRESS_FIELDS + INT_FIELDS + ('interestRatePerDay', 'dailyInterestRate', 'creatorSalt', 'ecSignatureCreator')
+
+    def __init__(self, *args, **kwargs):
+        for field in self.ADDRESS_FIELDS:
+            setattr(self, field, checksum_address(kwargs.get(field, None)))
+        for field in self.INT_FIELDS:
+            value = kwargs.get(field, None)
+            assert value is not None
+            setattr(self, field, int(value))
+        self.interestRatePerDay = kwargs.get('interestRatePerDay', None)
+        assert self.interestRatePerDay is not None
+        # daily interest rate in wei, as the protocol takes it
+        self.dailyInterestRate = Web3.toWei(self.interestRatePerDay, 'ether')
+        self.creatorSalt = kwargs.get('creatorSalt', None)
+        assert self.creatorSalt is not None
+        self.ecSignatureCreator = kwargs.get('ecSignatureCreator', None)
+        assert self.ecSignatureCreator is not None
+
+
+class LoanObject:
+    """ The loan a wrangler approves, with ints and checksummed addresses throughout."""
+
+    __slots__ = (
+        'collateralToken', 'loanToken', 'collateralAmount', 'loanAmountFilled', 'loanAmountOwed',
+        'expiresAtTimestamp', 'lender', 'borrower', 'relayer', 'wrangler',
+        'relayerFeeLST', 'monitoringFeeLST', 'rolloverFeeLST', 'closureFeeLST', 'nonce'
+    )
+    # serialized as decimal strings in the API response
+    STRING_FIELDS = ('loanAmountFilled', 'loanAmountOwed', 'relayerFeeLST', 'monitoringFeeLST', 'rolloverFeeLST', 'closureFeeLST')
+
+    def __init__(self, *args, **kwargs):
+        for field in self.__slots__:
+            value = kwargs.get(field, None)
+            assert value is not None
+            setattr(self, field, value)
+
+    def serialize(self):
+        """ The loan object as returned by the API."""
+        return {
+            field: str(getattr(self, field)) if field in self.STRING_FIELDS else getattr(self, field)
+            for field in self.__slots__
+        }
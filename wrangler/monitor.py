@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import threading
+
+
+POSITION_STATUS_OPEN = 1
+
+
+class ExpiryQueue:
+    """ Min-heap of open positions keyed on their expiry timestamp (position[8]).
+
+        Positions whose status leaves open, or whose expiry changes, are evicted
+        lazily: their stale heap entries are skipped when they reach the top.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.expiries = {}
+        self._lock = threading.Lock()
+
+    def update(self, position):
+        position_hash = bytes(position[21])
+        with self._lock:
+            if position[15] != POSITION_STATUS_OPEN:
+                self.expiries.pop(position_hash, None)
+                return
+            if self.expiries.get(position_hash, None) == position[8]:
+                return
+            self.expiries[position_hash] = position[8]
+            heapq.heappush(self.heap, (position[8], position_hash))
+
+    def discard(self, position_hash):
+        with self._lock:
+            self.expiries.pop(bytes(position_hash), None)
+
+    def _is_current(self, entry):
+        return self.expiries.get(entry[1], None) == entry[0]
+
+    def _drop_stale(self):
+        while len(self.heap) and not self._is_current(self.heap[0]):
+            heapq.heappop(self.heap)
+
+    def due(self, timestamp):
+        """ The hashes of open positions that expire at or before timestamp, earliest first.
+
+            They stay queued until update() sees them leave open, so a liquidation that
+            fails is retried on a later sweep.
+        """
+        due = set()
+        with self._lock:
+            self._drop_stale()
+            # the entries at or before timestamp form a subtree at the top of the heap
+            indexes = [0]
+            while len(indexes):
+                index = indexes.pop()
+                if index < len(self.heap) and self.heap[index][0] <= timestamp:
+                    if self._is_current(self.heap[index]):
+                        due.add(self.heap[index])
+                    indexes.extend((2 * index + 1, 2 * index + 2))
+        return [position_hash for expires_at, position_hash in sorted(due)]
+
+    def next_expiry(self, after=None):
+        """ The earliest expiry of a queued position, or the earliest one later than after."""
+        with self._lock:
+            self._drop_stale()
+            if after is None:
+                return self.heap[0][0] if len(self.heap) else None
+            expiries = []
+            indexes = [0]
+            while len(indexes):
+                index = indexes.pop()
+                if index >= len(self.heap):
+                    continue
+                if self.heap[index][0] > after and self._is_current(self.heap[index]):
+                    # its children expire no earlier
+                    expiries.append(self.heap[index][0])
+                else:
+                    indexes.extend((2 * index + 1, 2 * index + 2))
+            return min(expiries, default=None)
+
+    def __len__(self):
+        return len(self.expiries)
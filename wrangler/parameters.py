@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+from .batch import BatchReader
+from .events import LogTailer, TailedCache, event_abi
+from .metrics import cache_requests
+from .models import checksum_address
+from .utils import get_abi
+
+
+logger = logging.getLogger(__name__)
+
+# per-address flags, by the protocol getter that reads them
+FLAGS = ('wranglers', 'supported_tokens')
+
+
+class ProtocolParameters(TailedCache):
+    """ In-memory copy of the protocol's rarely changing parameters.
+
+        Holds the wranglers and supported_tokens flags of the addresses looked up so
+        far, read at the block the cache is synced to. sync() tails
+        ProtocolParameterUpdateNotification logs: a notification drops the flags of its
+        address, so they are read again on the next lookup. Notifications rolled back by
+        a reorg do the same.
+    """
+
+    name = 'protocol parameters'
+
+    def __init__(self, web3_client, protocol_contract, wranglers=(), tokens=(), reorg_depth=12):
+        super().__init__(web3_client, reorg_depth=reorg_depth)
+        self.protocol = protocol_contract
+        # flags read up front by load()
+        self.known = {'wranglers': list(wranglers), 'supported_tokens': list(tokens)}
+        self.flags = {name: {} for name in FLAGS}
+
+    def load(self, block_number):
+        """ Read the known flags at block_number in one batch, and tail from the next block."""
+        reader = BatchReader(self.web3_client, block_identifier=block_number)
+        for name in FLAGS:
+            for _address in map(checksum_address, self.known[name]):
+                reader.add((name, _address), getattr(self.protocol.functions, name)(_address))
+        reader.execute()
+        with self._lock:
+            self.flags = {name: {} for name in FLAGS}
+            for (name, _address), value in reader.results.items():
+                self.flags[name][_address] = value
+            self.tailer = LogTailer(
+                self.web3_client,
+                self.protocol.address,
+                [event_abi(get_abi('protocol'), 'ProtocolParameterUpdateNotification')],
+                from_block=block_number + 1,
+                reorg_depth=self.reorg_depth
+            )
+
+    def invalidate(self, log):
+        logger.info("Protocol parameter %s updated for %s", log['args']['_notification_key'], log['args']['_address'])
+        _address = checksum_address(log['args']['_address'])
+        for flags in self.flags.values():
+            flags.pop(_address, None)
+
+    def flag(self, name, _address, count=True):
+        """ The cached wranglers or supported_tokens flag of an address, or None. A lookup with count=False is left out of the hit/miss metrics."""
+        with self._lock:
+            value = self.flags[name].get(checksum_address(_address), None)
+        if count:
+            cache_requests.inc('protocol_parameters', 'miss' if value is None else 'hit')
+        return value
+
+    def record(self, name, _address, value, block_number):
+        """ Cache a flag read elsewhere at block_number, unless an update may have happened since."""
+        with self._lock:
+            if self.tailer is not None and block_number >= self.tailer.last_block:
+                self.flags[name][checksum_address(_address)] = value
+
+
+_parameters = {}
+_parameters_lock = threading.Lock()
+
+
+def get_protocol_parameters(web3_client, protocol_contract, wranglers=(), tokens=()):
+    """ The process-wide ProtocolParameters of a protocol deployment."""
+    key = (web3_client, protocol_contract.address)
+    with _parameters_lock:
+        if key not in _parameters:
+            _parameters[key] = ProtocolParameters(web3_client, protocol_contract, wranglers=wranglers, tokens=tokens)
+        return _parameters[key]
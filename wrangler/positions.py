@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+
+from web3 import Web3
+
+from .events import LogTailer, event_abi
+from .models import checksum_address
+from .utils import get_abi
+
+
+EMPTY_HASH = b'\0' * 32
+# the position fields holding the address of each role
+ROLES = {'lend': 2, 'borrow': 3}
+POSITION_FIELDS = (
+    'index', 'kernel_creator', 'lender', 'borrower', 'relayer', 'wrangler',
+    'created_at', 'updated_at', 'expires_at',
+    'borrow_currency_address', 'lend_currency_address',
+    'borrow_currency_value', 'borrow_currency_current_value', 'lend_currency_filled_value', 'lend_currency_owed_value',
+    'status', 'nonce', 'relayer_fee', 'monitoring_fee', 'rollover_fee', 'closure_fee', 'hash',
+)
+# uint256 amounts, serialized as strings like LoanObject does
+AMOUNT_FIELDS = (
+    'borrow_currency_value', 'borrow_currency_current_value', 'lend_currency_filled_value', 'lend_currency_owed_value',
+    'relayer_fee', 'monitoring_fee', 'rollover_fee', 'closure_fee',
+)
+
+
+def position_record(position):
+    record = dict(zip(POSITION_FIELDS, position))
+    for field in AMOUNT_FIELDS:
+        record[field] = str(record[field])
+    record['hash'] = Web3.toHex(position[21])
+    return record
+
+
+class PositionStore:
+    """ Local copy of the protocol's positions.
+
+        The store bootstraps with one full scan and then stays current by tailing
+        PositionUpdateNotification logs, so each sync() only re-reads the positions
+        that changed since the last one. Positions touched by logs that were rolled
+        back in a reorg of up to `reorg_depth` blocks are re-read as well.
+
+        With a PositionSnapshot every sync is persisted, and a restarted store
+        bootstraps from the snapshot and only catches up on the blocks since.
+
+        The store also indexes position hashes by lender and by borrower, so the
+        positions of one address are found without going through all of them.
+    """
+
+    def __init__(self, wrangler, reorg_depth=12, snapshot=None):
+        self.wrangler = wrangler
+        self.reorg_depth = reorg_depth
+        self.snapshot = snapshot
+        self.positions = {}
+        self.addresses = {role: collections.defaultdict(set) for role in ROLES}
+        self.tailer = None
+        self._lock = threading.Lock()
+        # the monitor and request contexts may sync the same store concurrently
+        self._sync_lock = threading.Lock()
+
+    def _tail(self, from_block):
+        self.tailer = LogTailer(
+            self.wrangler.web3_client,
+            self.wrangler.protocol_contract().address,
+            [event_abi(get_abi('protocol'), 'PositionUpdateNotification')],
+            from_block=from_block,
+            reorg_depth=self.reorg_depth
+        )
+
+    def bootstrap(self):
+        block = self.wrangler.block_context()
+        if self.snapshot is not None and self._restore(block):
+            return
+        positions = self.wrangler.position_scanner().scan()
+        with self._lock:
+            self._clear()
+            self._update(positions)
+            self._tail(block.number + 1)
+        self._save(block.number, self.values(), reset=True)
+
+    def _restore(self, block):
+        restored = self.snapshot.load()
+        if restored is None or restored[0] > block.number:
+            return False
+        block_number, positions, recent = restored
+        with self._lock:
+            self._clear()
+            self._update(positions)
+            # re-read the snapshot's last reorg_depth blocks, they may have been reorged out since
+            self._tail(max(block_number - self.reorg_depth + 1, 0))
+        self._catch_up(recent)
+        return True
+
+    def sync(self):
+        """ Bring the store up to the wrangler's current block. Returns the positions that changed."""
+        with self._sync_lock:
+            return self._sync()
+
+    def _sync(self):
+        if self.tailer is None:
+            self.bootstrap()
+            return self.values()
+        return self._catch_up()
+
+    def _catch_up(self, position_hashes=()):
+        block = self.wrangler.block_context()
+        rolled_back, new = self.tailer.poll(block.number)
+        position_hashes = set(position_hashes) | set(bytes(log['args']['_position_hash']) for log in rolled_back + new)
+        if not len(position_hashes):
+            self._save(block.number)
+            return []
+        positions = self.wrangler.position_scanner().positions(sorted(position_hashes))
+        with self._lock:
+            for position_hash in position_hashes:
+                self._remove(position_hash)
+            updated = self._update(positions)
+        self._save(block.number, updated, position_hashes - set(bytes(position[21]) for position in updated))
+        return updated
+
+    def _recent_position_hashes(self):
+        return set(bytes(log['args']['_position_hash']) for logs in self.tailer.journal.values() for log in logs)
+
+    def _save(self, block_number, updated=(), removed=(), reset=False):
+        if self.snapshot is not None:
+            self.snapshot.save(block_number, updated, removed, self._recent_position_hashes(), reset=reset)
+
+    def _clear(self):
+        self.positions = {}
+        self.addresses = {role: collections.defaultdict(set) for role in ROLES}
+
+    def _remove(self, position_hash):
+        position = self.positions.pop(position_hash, None)
+        if position is None:
+            return
+        for role, field in ROLES.items():
+            position_hashes = self.addresses[role].get(checksum_address(position[field]), None)
+            if position_hashes is not None:
+                position_hashes.discard(position_hash)
+
+    def _update(self, positions):
+        updated = []
+        for position in positions:
+            # positions created in blocks that were reorged out read back empty
+            if bytes(position[21]) != EMPTY_HASH:
+                self.positions[bytes(position[21])] = position
+                for role, field in ROLES.items():
+                    self.addresses[role][checksum_address(position[field])].add(bytes(position[21]))
+                updated.append(position)
+        return updated
+
+    def is_bootstrapped(self):
+        return self.tailer is not None
+
+    def get(self, position_hash):
+        return self.positions.get(bytes(position_hash), None)
+
+    def position_hashes(self, role, _address):
+        """ The hashes of the positions an address takes part in as 'lend'er or 'borrow'er."""
+        with self._lock:
+            return set(self.addresses[role].get(checksum_address(_address), ()))
+
+    def values(self):
+        """ All known positions, in descending position index order."""
+        with self._lock:
+            return sorted(self.positions.values(), key=lambda position: position[0], reverse=True)
+
+    def __len__(self):
+        return len(self.positions)
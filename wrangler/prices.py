@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import cache_requests
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """ One in-flight fetch that concurrent callers wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RateCache:
+    """ Shared cache of exchange rates keyed on currency pair.
+
+        A rate younger than `ttl` seconds is served from memory. A rate older than
+        that but younger than `stale_ttl` is still served while one background fetch
+        refreshes it (stale-while-revalidate). Concurrent callers asking for a missing
+        rate coalesce onto a single in-flight fetch. Listeners added with subscribe()
+        are called with (key, rate) for every rate fetched.
+    """
+
+    def __init__(self, ttl=30, stale_ttl=300, clock=time.monotonic):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._flights = {}
+        self._async_flights = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='wrangler-rates')
+
+    def _lookup(self, key):
+        """ Return (value, is_fresh), or (None, False) when there is no usable entry."""
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return None, False
+        value, fetched_at = entry
+        age = self.clock() - fetched_at
+        if age < self.ttl:
+            return value, True
+        if age < self.stale_ttl:
+            return value, False
+        return None, False
+
+    def _store(self, key, value):
+        self.entries[key] = (value, self.clock())
+        for reference in list(self.listeners):
+            listener = reference()
+            if listener is None:
+                self.unsubscribe(None)
+                continue
+            try:
+                listener(key, value)
+            except Exception:
+                logger.exception("Rate listener failed for %s", key)
+
+    def subscribe(self, listener):
+        """ Call listener(key, rate) for every rate fetched. Bound methods are held weakly."""
+        self.listeners.append(weakref.WeakMethod(listener) if hasattr(listener, '__self__') else lambda: listener)
+
+    def unsubscribe(self, listener):
+        self.listeners = [reference for reference in self.listeners if reference() is not listener]
+
+    def _count(self, result):
+        if result == 'miss':
+            self.misses += 1
+        else:
+            self.hits += 1
+        cache_requests.inc('rates', result)
+
+    def get(self, key, fetch):
+        value, is_fresh = self._lookup(key)
+        if is_fresh:
+            self._count('hit')
+            return value
+        if value is not None:
+            self._count('stale')
+            self._revalidate(key, fetch)
+            return value
+        self._count('miss')
+        return self._fetch(key, fetch)
+
+    def _fetch(self, key, fetch):
+        with self._lock:
+            flight = self._flights.get(key, None)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = _Flight()
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = fetch()
+            self._store(key, flight.value)
+            return flight.value
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _revalidate(self, key, fetch):
+        with self._lock:
+            if key in self._flights:
+                return
+        self._executor.submit(self._fetch_quietly, key, fetch)
+
+    def _fetch_quietly(self, key, fetch):
+        try:
+            self._fetch(key, fetch)
+        except Exception as err:
+            logger.warning("Failed to refresh rate %s: %s", key, err)
+
+    async def get_async(self, key, fetch):
+        """ Like get(), for a fetch function that returns an awaitable."""
+        value, is_fresh = self._lookup(key)
+        if is_fresh:
+            self._count('hit')
+            return value
+        if value is not None:
+            self._count('stale')
+            if key not in self._async_flights:
+                asyncio.ensure_future(self._fetch_async_quietly(key, fetch))
+            return value
+        self._count('miss')
+        return await self._fetch_async(key, fetch)
+
+    async def _fetch_async(self, key, fetch):
+        flight = self._async_flights.get(key, None)
+        if flight is not None:
+            return await asyncio.shield(flight)
+        flight = self._async_flights[key] = asyncio.ensure_future(fetch())
+        try:
+            value = await asyncio.shield(flight)
+            self._store(key, value)
+            return value
+        finally:
+            self._async_flights.pop(key, None)
+
+    async def _fetch_async_quietly(self, key, fetch):
+        try:
+            await self._fetch_async(key, fetch)
+        except Exception as err:
+            logger.warning("Failed to refresh rate %s: %s", key, err)
+
+    def clear(self):
+        self.entries.clear()
+
+
+rate_cache = RateCache()
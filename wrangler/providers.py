@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import logging
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from web3.providers.base import JSONBaseProvider
+
+from .scanner import RPC_LIMIT_EXCEEDED
+
+
+logger = logging.getLogger(__name__)
+
+# methods that only read chain state and can safely be sent to two endpoints at once
+READ_METHODS = frozenset([
+    'eth_blockNumber', 'eth_call', 'eth_estimateGas', 'eth_gasPrice', 'eth_getBalance',
+    'eth_getBlockByHash', 'eth_getBlockByNumber', 'eth_getCode', 'eth_getLogs',
+    'eth_getTransactionByHash', 'eth_getTransactionCount', 'eth_getTransactionReceipt',
+    'net_version', 'web3_clientVersion',
+])
+
+
+class EndpointError(IOError):
+    """ An endpoint failed to answer, as opposed to answering with a JSON-RPC error.
+
+        rate_limited is set when it answered HTTP 429 or RPC_LIMIT_EXCEEDED, so callers
+        that back off on rate limiting (see scanner.is_rate_limited) still can. sent is
+        cleared when the request cannot have reached the node, e.g. when no connection
+        could be made or it was turned away by rate limiting.
+    """
+
+    def __init__(self, message, rate_limited=False, sent=True):
+        super().__init__(message)
+        self.rate_limited = rate_limited
+        self.sent = sent and not rate_limited
+
+
+def was_sent(err):
+    """ Whether a request that failed with err may have been processed by the endpoint."""
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return False
+    if isinstance(err, requests.exceptions.ConnectionError) and len(err.args):
+        return not isinstance(getattr(err.args[0], 'reason', None), NewConnectionError)
+    return True
+
+
+def is_rate_limited_response(response):
+    items = response if isinstance(response, list) else [response]
+    return any(isinstance(item, dict) and item.get('error', {}).get('code', None) == RPC_LIMIT_EXCEEDED for item in items)
+
+
+class Endpoint:
+    """ One JSON-RPC endpoint with its own keep-alive session and latency record."""
+
+    def __init__(self, uri, timeout=10, pool_size=16, window=100):
+        self.uri = uri
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.latencies = collections.deque(maxlen=window)
+        self.failures = 0
+        self.down_until = 0
+
+    def post(self, data):
+        started_at = time.monotonic()
+        try:
+            response = self.session.post(self.uri, data=data, headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+            response.raise_for_status()
+            decoded = response.json()
+        except (requests.exceptions.RequestException, ValueError) as err:
+            rate_limited = isinstance(err, requests.exceptions.HTTPError) and err.response is not None and err.response.status_code == 429
+            raise EndpointError("{0}: {1}".format(self.uri, err), rate_limited=rate_limited, sent=was_sent(err))
+        if is_rate_limited_response(decoded):
+            raise EndpointError("{0}: rate limited".format(self.uri), rate_limited=True)
+        self.latencies.append(time.monotonic() - started_at)
+        return decoded
+
+    def is_up(self, now):
+        return now >= self.down_until
+
+    def latency(self):
+        """ Median latency of the recent requests, 0 until there are any."""
+        if not len(self.latencies):
+            return 0
+        return sorted(self.latencies)[len(self.latencies) // 2]
+
+    def percentile(self, q):
+        if not len(self.latencies):
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+class ProviderPool(JSONBaseProvider):
+    """ A web3 provider spreading requests over several HTTP endpoints.
+
+        Endpoints are ranked by their median latency and every request goes to the
+        fastest one that is up. An endpoint that fails (connection error, timeout,
+        HTTP error or rate limiting) is skipped for `cooldown` seconds and the request
+        fails over to the next one.
+
+        With `hedge` set, a read still unanswered after the primary endpoint's p95
+        latency (or after `hedge_after` seconds, if given) is also sent to the next
+        endpoint, and whichever answers first wins. Transactions are never hedged, and
+        only fail over when the failed endpoint cannot have received them, so a
+        transaction is never broadcast twice.
+    """
+
+    def __init__(self, endpoint_uris, timeout=10, cooldown=30, hedge=False, hedge_after=None, hedge_percentile=0.95):
+        assert len(endpoint_uris), "at least one endpoint is needed"
+        self.endpoints = [Endpoint(uri, timeout=timeout) for uri in endpoint_uris]
+        self.cooldown = cooldown
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(self.endpoints) + 2) if hedge else None
+        super().__init__()
+
+    def __str__(self):
+        return "RPC pool {0}".format(', '.join(endpoint.uri for endpoint in self.endpoints))
+
+    @property
+    def endpoint_uri(self):
+        """ The endpoint currently ranked first."""
+        return self.ranked()[0].uri
+
+    def ranked(self):
+        now = time.monotonic()
+        with self._lock:
+            up = [endpoint for endpoint in self.endpoints if endpoint.is_up(now)]
+            down = [endpoint for endpoint in self.endpoints if not endpoint.is_up(now)]
+        # when every endpoint is down, try them anyway, soonest to recover first
+        return sorted(up, key=lambda endpoint: endpoint.latency()) + sorted(down, key=lambda endpoint: endpoint.down_until)
+
+    def record_failure(self, endpoint):
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.down_until = time.monotonic() + self.cooldown
+
+    def record_success(self, endpoint):
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.down_until = 0
+
+    def _post_to(self, endpoint, data):
+        try:
+            response = endpoint.post(data)
+        except EndpointError:
+            self.record_failure(endpoint)
+            raise
+        self.record_success(endpoint)
+        return response
+
+    def _failover(self, endpoints, data, reads=True):
+        error = None
+        for endpoint in endpoints:
+            try:
+                return self._post_to(endpoint, data)
+            except EndpointError as err:
+                if not reads and err.sent:
+                    raise
+                error = err
+        raise error
+
+    def _hedge_delay(self, endpoint):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        return endpoint.percentile(self.hedge_percentile)
+
+    def _hedged(self, endpoints, data):
+        delay = self._hedge_delay(endpoints[0])
+        if delay is None:
+            # no latency history yet to hedge against
+            return self._failover(endpoints, data)
+        primary = self._executor.submit(self._failover, endpoints, data)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        hedge = self._executor.submit(self._failover, endpoints[1:] + endpoints[:1], data)
+        futures = [primary, hedge]
+        error = None
+        while len(futures):
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                try:
+                    return future.result()
+                except EndpointError as err:
+                    error = err
+        raise error
+
+    def _send(self, data, reads):
+        endpoints = self.ranked()
+        if self.hedge and reads and len(endpoints) > 1:
+            return self._hedged(endpoints, data)
+        return self._failover(endpoints, data, reads=reads)
+
+    def post(self, payload):
+        """ Send a JSON-RPC request or batch, e.g. a BatchReader payload, through the pool."""
+        items = payload if isinstance(payload, list) else [payload]
+        return self._send(json.dumps(payload), all(item['method'] in READ_METHODS for item in items))
+
+    def make_request(self, method, params):
+        return self._send(self.encode_rpc_request(method, params), method in READ_METHODS)
+
+    def health_check(self):
+        """ Time an eth_blockNumber against every endpoint, so the ranking reflects all of them."""
+        for endpoint in self.endpoints:
+            try:
+                self._post_to(endpoint, json.dumps({'jsonrpc': '2.0', 'method': 'eth_blockNumber', 'params': [], 'id': 0}))
+            except EndpointError as err:
+                logger.warning("Endpoint failed its health check: %s", err)
+
+    def health_check_forever(self, interval=30):
+        """ Run health checks on a daemon thread every `interval` seconds."""
+        def run():
+            while True:
+                self.health_check()
+                time.sleep(interval)
+        thread = threading.Thread(target=run, name='wrangler-health-check', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from web3 import Web3
+
+from .utils import get_abi
+
+
+class ContractRegistry:
+    """ Process-wide cache of contract objects, keyed on (web3 client, network, address, abi).
+
+        ABIs are loaded once through the memoized `utils.get_abi`, and contract
+        objects are built once per key and shared by every wrangler instance.
+    """
+
+    def __init__(self):
+        self._contracts = {}
+        self._lock = threading.Lock()
+
+    def contract(self, web3_client, current_net, address, abi_name):
+        address = Web3.toChecksumAddress(address)
+        key = (web3_client, current_net, address, abi_name)
+        contract = self._contracts.get(key, None)
+        if contract is None:
+            with self._lock:
+                contract = self._contracts.get(key, None)
+                if contract is None:
+                    contract = web3_client.eth.contract(address=address, abi=get_abi(abi_name))
+                    self._contracts[key] = contract
+        return contract
+
+    def preload(self, web3_client, config, current_net):
+        """ Load all ABIs and build the contracts listed in the config for current_net."""
+        contracts = config[current_net]["contracts"]
+        self.contract(web3_client, current_net, contracts["protocol"], 'protocol')
+        if "maker_medianizer" in contracts:
+            try:
+                self.contract(web3_client, current_net, contracts["maker_medianizer"], 'MakerMedianizer-{}'.format(current_net))
+            except FileNotFoundError:
+                # no medianizer ABI is bundled for this network
+                pass
+        for contract_name, contract_address in contracts.items():
+            if contract_name not in ("protocol", "maker_medianizer"):
+                self.contract(web3_client, current_net, contract_address, 'ERC20')
+
+    def clear(self):
+        with self._lock:
+            self._contracts.clear()
+
+
+registry = ContractRegistry()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+
+# JSON-RPC error code Infura returns once a project exceeds its request rate
+RPC_LIMIT_EXCEEDED = -32005
+
+
+def is_rate_limited(err):
+    # a ProviderPool reports rate limiting as an EndpointError
+    if getattr(err, 'rate_limited', False):
+        return True
+    if isinstance(err, requests.exceptions.HTTPError):
+        return err.response is not None and err.response.status_code == 429
+    if isinstance(err, ValueError) and len(err.args) and isinstance(err.args[0], dict):
+        return err.args[0].get('code', None) == RPC_LIMIT_EXCEEDED
+    return False
+
+
+class RateLimiter:
+    """ Token bucket shared by the scanner's worker threads."""
+
+    def __init__(self, rate):
+        assert rate > 0, "rate must be positive"
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class PositionScanner:
+    """ Read positions from the protocol contract with a bounded pool of worker threads.
+
+        Every read is pinned to the given BlockContext, optionally rate limited, and
+        retried with exponential backoff when the provider answers 429, directly or
+        through a ProviderPool.
+    """
+
+    def __init__(self, block, protocol_contract, concurrency=8, rate_limit=None, retries=3, backoff=0.5):
+        assert concurrency > 0, "concurrency must be positive"
+        self.block = block
+        self.protocol_contract = protocol_contract
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.retries = retries
+        self.backoff = backoff
+
+    def call(self, contract_function):
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                return self.block.call(contract_function)
+            except (IOError, ValueError) as err:
+                if not is_rate_limited(err) or attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+                attempt += 1
+
+    def position_at(self, index):
+        position_hash = self.call(self.protocol_contract.functions.position_index(index))
+        return self.call(self.protocol_contract.functions.position(position_hash))
+
+    def positions(self, position_hashes, ordered=True):
+        """ Read the positions for a list of position hashes."""
+        return self._map(lambda position_hash: self.call(self.protocol_contract.functions.position(position_hash)), position_hashes, ordered)
+
+    def address_position_hashes(self, role, _address):
+        """ Read the hashes of the positions an address takes part in as 'lend'er or 'borrow'er."""
+        functions = self.protocol_contract.functions
+        count = self.call(getattr(functions, role + '_positions_count')(_address))
+        return self._map(lambda index: self.call(getattr(functions, role + '_positions')(_address, index)), range(count), True)
+
+    def scan(self, last_position_index=None, ordered=True):
+        """ Read every position from last_position_index down to 0.
+
+            With ordered=True positions come back in descending index order, otherwise
+            in the order their reads completed.
+        """
+        if last_position_index is None:
+            last_position_index = self.call(self.protocol_contract.functions.last_position_index())
+        return self._map(self.position_at, range(last_position_index, -1, -1), ordered)
+
+    def _map(self, fn, items, ordered):
+        items = list(items)
+        if not len(items):
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(items))) as executor:
+            if ordered:
+                return list(executor.map(fn, items))
+            futures = [executor.submit(fn, item) for item in items]
+            return [future.result() for future in as_completed(futures)]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import logging
+import threading
+
+from eth_abi import encode_abi
+from eth_keys import keys
+from eth_utils import keccak
+
+from web3 import Web3
+
+
+logger = logging.getLogger(__name__)
+
+# The protocol hashes the concatenation of 32-byte words, starting with its own
+# address, which is exactly the ABI encoding of the same values as static types.
+POSITION_HASH_TYPES = ['address'] * 8 + ['uint256'] * 9
+KERNEL_HASH_TYPES = ['address'] * 7 + ['uint256'] * 6 + ['bytes32', 'uint256', 'uint256']
+
+SIGNED_MESSAGE_PREFIX = Web3.toBytes(text='\x19Ethereum Signed Message:\n32')
+
+
+def position_hash(protocol_address, addresses, values, lend_currency_owed_value, nonce):
+    """ Off-chain equivalent of protocol.position_hash(_addresses[7], _values[7], _lend_currency_owed_value, _nonce)."""
+    assert len(addresses) == 7 and len(values) == 7
+    return keccak(encode_abi(
+        POSITION_HASH_TYPES,
+        [protocol_address] + list(addresses) + list(values) + [lend_currency_owed_value, nonce]
+    ))
+
+
+def kernel_hash(protocol_address, addresses, values, kernel_expires_at, creator_salt, daily_interest_rate, position_duration_in_seconds):
+    """ Off-chain equivalent of protocol.kernel_hash(_addresses[6], _values[5], _kernel_expires_at, _creator_salt, ...)."""
+    assert len(addresses) == 6 and len(values) == 5
+    if isinstance(creator_salt, str):
+        creator_salt = Web3.toBytes(hexstr=creator_salt)
+    return keccak(encode_abi(
+        KERNEL_HASH_TYPES,
+        [protocol_address] + list(addresses) + list(values) + [kernel_expires_at, creator_salt, daily_interest_rate, position_duration_in_seconds]
+    ))
+
+
+def signed_message_hash(message_hash):
+    """ Same as Web3.soliditySha3(['bytes32', 'bytes32'], [prefix, message_hash])."""
+    return keccak(SIGNED_MESSAGE_PREFIX + bytes(message_hash))
+
+
+@functools.lru_cache(maxsize=None)
+def private_key(private_key_hex):
+    """ Decode a hex private key once per process."""
+    return keys.PrivateKey(Web3.toBytes(hexstr=private_key_hex))
+
+
+def sign_hash(key, message_hash):
+    """ Same signature bytes as Account.signHash, without re-deriving the key."""
+    v, r, s = key.sign_msg_hash(bytes(message_hash)).vrs
+    return r.to_bytes(32, 'big') + s.to_bytes(32, 'big') + bytes([v + 27])
+
+
+_verified = {}
+_verified_lock = threading.Lock()
+
+
+def is_verified(protocol_address):
+    """ True once the off-chain hash has matched the contract, False if it ever did not."""
+    return _verified.get(protocol_address, None)
+
+
+def record_verification(protocol_address, local_hash, remote_hash):
+    matches = bytes(local_hash) == bytes(remote_hash)
+    with _verified_lock:
+        if _verified.get(protocol_address, None) is not False:
+            _verified[protocol_address] = matches
+    if not matches:
+        logger.warning("Off-chain position_hash %s does not match the contract's %s, using the contract.", Web3.toHex(local_hash), Web3.toHex(remote_hash))
+    return matches
+
+
+def verify_position_hash(block, protocol_contract, vectors):
+    """ Compare position_hash against the contract for (addresses, values, owed_value, nonce) vectors.
+
+        Returns the vectors that do not match.
+    """
+    mismatches = []
+    for addresses, values, lend_currency_owed_value, nonce in vectors:
+        remote_hash = block.call(protocol_contract.functions.position_hash(addresses, values, lend_currency_owed_value, nonce))
+        local_hash = position_hash(protocol_contract.address, addresses, values, lend_currency_owed_value, nonce)
+        if not record_verification(protocol_contract.address, local_hash, remote_hash):
+            mismatches.append((addresses, values, lend_currency_owed_value, nonce))
+    return mismatches
+
+
+def verify_kernel_hash(block, protocol_contract, vectors):
+    """ Compare kernel_hash against the contract for (addresses, values, expires_at, salt, rate, duration) vectors.
+
+        Returns the vectors that do not match.
+    """
+    mismatches = []
+    for vector in vectors:
+        remote_hash = block.call(protocol_contract.functions.kernel_hash(*vector))
+        if bytes(kernel_hash(protocol_contract.address, *vector)) != bytes(remote_hash):
+            mismatches.append(vector)
+    return mismatches
+
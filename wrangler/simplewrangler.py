@@ -1,9 +1,34 @@
 # -*- coding: utf-8 -*-
 
+import copy
+import functools
+import logging
 import time
 import pprint
-
-from .utils import get_abi, cmc_rate_per_weth, cryptocompare_rate, to_32byte_hex
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import signing
+from .approvals import ApprovalCache
+from .balances import get_token_balances
+from .batch import BatchReader, BatchView, block_param, decode_call, encode_call
+from .block import BlockContext
+from .gas import fill_kernel_gas, get_gas_price_oracle
+from .metrics import timed
+from .health import HealthEngine, filter_positions, health_record, positions_health
+from .models import LoanObject, LoanRequest, checksum_address
+from .monitor import ExpiryQueue, POSITION_STATUS_OPEN
+from .parameters import get_protocol_parameters
+from .positions import PositionStore
+from .prices import rate_cache
+from .snapshot import PositionSnapshot
+from .registry import registry
+from .scanner import PositionScanner
+from .transactions import chain_id_for, get_submitter
+from .validation import Step, ValidationGraph
+from .utils import cmc_rate_per_weth, cryptocompare_rate, to_32byte_hex
 
 from datetime import timezone, datetime as dt
 from dateutil.relativedelta import relativedelta
@@ -11,6 +36,19 @@ from dateutil.relativedelta import relativedelta
 from web3 import Web3
 
 
+logger = logging.getLogger(__name__)
+
+
+def request_scoped(method):
+    """ Run an entry point on a fresh per-request context when it is called on the shared wrangler."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.shared:
+            return method(self.context(), *args, **kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
 def wait_for_receipt(w3, tx_hash, poll_interval):
    while True:
        tx_receipt = w3.eth.getTransactionReceipt(tx_hash)
@@ -19,82 +57,41 @@ def wait_for_receipt(w3, tx_hash, poll_interval):
        time.sleep(poll_interval)
 
 
-class LoanRequest:
-    """ Base Python class to represent a filled order sent from the relayer UI."""
-
-    def __init__(self, *args, **kwargs):
-        self.lender = Web3.toChecksumAddress(kwargs.get('lender', None))
-        self.borrower = Web3.toChecksumAddress(kwargs.get('borrower', None))
-        self.relayer = Web3.toChecksumAddress(kwargs.get('relayer', None))
-        self.wrangler = Web3.toChecksumAddress(kwargs.get('wrangler', None))
-        self.filler = Web3.toChecksumAddress(kwargs.get('filler', None))
-        self.loanToken = Web3.toChecksumAddress(kwargs.get('loanToken', None))
-        self.collateralToken = Web3.toChecksumAddress(kwargs.get('collateralToken', None))
-        self.offerExpiry = kwargs.get('offerExpiry', None)
-        assert self.offerExpiry is not None
-        self.interestRatePerDay = kwargs.get('interestRatePerDay', None)
-        assert self.interestRatePerDay is not None
-        self.loanDuration = kwargs.get('loanDuration', None)
-        assert self.loanDuration is not None
-        self.loanAmountOffered = kwargs.get('loanAmountOffered', None)
-        assert self.loanAmountOffered is not None
-        self.fillLoanAmount = kwargs.get('fillLoanAmount', None)
-        assert self.fillLoanAmount is not None
-        self.relayerFeeLST = kwargs.get('relayerFeeLST', None)
-        assert self.relayerFeeLST is not None
-        self.monitoringFeeLST = kwargs.get('monitoringFeeLST', None)
-        assert self.monitoringFeeLST is not None
-        self.rolloverFeeLST = kwargs.get('rolloverFeeLST', None)
-        assert self.rolloverFeeLST is not None
-        self.closureFeeLST = kwargs.get('closureFeeLST', None)
-        assert self.closureFeeLST is not None
-        self.creatorSalt = kwargs.get('creatorSalt', None)
-        assert self.creatorSalt is not None
-        self.ecSignatureCreator = kwargs.get('ecSignatureCreator', None)
-        assert self.ecSignatureCreator is not None
-
-
-class LoanObject:
-    """ Base Python class to represent a loan object."""
-
-    def __init__(self, *args, **kwargs):
-        self.lender = Web3.toChecksumAddress(kwargs.get('lender', None))
-        self.borrower = Web3.toChecksumAddress(kwargs.get('borrower', None))
-        self.relayer = Web3.toChecksumAddress(kwargs.get('relayer', None))
-        self.wrangler = Web3.toChecksumAddress(kwargs.get('wrangler', None))
-        self.filler = Web3.toChecksumAddress(kwargs.get('filler', None))
-        self.loanToken = Web3.toChecksumAddress(kwargs.get('loanToken', None))
-        self.collateralToken = Web3.toChecksumAddress(kwargs.get('collateralToken', None))
-        self.offerExpiry = kwargs.get('offerExpiry', None)
-        assert self.offerExpiry is not None
-        self.interestRatePerDay = kwargs.get('interestRatePerDay', None)
-        assert self.interestRatePerDay is not None
-        self.loanDuration = kwargs.get('loanDuration', None)
-        assert self.loanDuration is not None
-        self.loanAmountOffered = kwargs.get('loanAmountOffered', None)
-        assert self.loanAmountOffered is not None
-        self.fillLoanAmount = kwargs.get('fillLoanAmount', None)
-        assert self.fillLoanAmount is not None
-        self.relayerFeeLST = kwargs.get('relayerFeeLST', None)
-        assert self.relayerFeeLST is not None
-        self.monitoringFeeLST = kwargs.get('monitoringFeeLST', None)
-        assert self.monitoringFeeLST is not None
-        self.rolloverFeeLST = kwargs.get('rolloverFeeLST', None)
-        assert self.rolloverFeeLST is not None
-        self.closureFeeLST = kwargs.get('closureFeeLST', None)
-        assert self.closureFeeLST is not None
-        self.creatorSalt = kwargs.get('creatorSalt', None)
-        assert self.creatorSalt is not None
-        self.ecSignatureCreator = kwargs.get('ecSignatureCreator', None)
-        assert self.ecSignatureCreator is not None
-
-
 class SimpleWrangler:
     """ Base Python class to perform simple operations such as
         1. Approving a loan request
         2. Liquidating a loan (WIP)
+
+        One instance is meant to be shared by every thread of a process. It only
+        holds configuration, contract handles and caches; each request runs on its
+        own lightweight context (see context()), which carries the request's state.
     """
 
+    # checks of a loan request that need no reads, run before anything is fetched
+    LOCAL_CHECKS = ValidationGraph([
+        Step('validate_wrangler', local=True),
+        Step('validate_offer_expiry', local=True),
+        Step('validate_configured_currencies', local=True),
+    ])
+    # the reads of an approval and the checks they feed; the block header and the
+    # exchange rate are fetched concurrently, the checks run once their reads are in
+    APPROVAL_STEPS = ValidationGraph([
+        Step('validate_kernel'),
+        Step('prefetch_rate'),
+        Step('sync_read_caches', after=['validate_kernel']),
+        Step('prefetch_reads', after=['sync_read_caches']),
+        Step('validate_supported_wrangler', after=['prefetch_reads'], local=True),
+        Step('validate_supported_lend_currency', after=['prefetch_reads'], local=True),
+        Step('validate_supported_borrow_currency', after=['prefetch_reads'], local=True),
+        Step('create_loan_object', after=['validate_supported_wrangler', 'validate_supported_lend_currency', 'validate_supported_borrow_currency', 'prefetch_rate']),
+        Step('validate_lend_currency_balance', after=['create_loan_object'], local=True),
+        Step('validate_lend_currency_allowance', after=['create_loan_object'], local=True),
+        Step('validate_borrow_currency_balance', after=['create_loan_object'], local=True),
+        Step('validate_borrow_currency_allowance', after=['create_loan_object'], local=True),
+        Step('validate_protocol_currency_balance', after=['create_loan_object'], local=True),
+        Step('validate_protocol_currency_allowance', after=['create_loan_object'], local=True),
+    ])
+
     def __init__(self, *args, **kwargs):
         self.config = kwargs.get('config', None)
         assert(self.config is not None)
@@ -102,91 +99,240 @@ class SimpleWrangler:
         assert(self.web3_client is not None)
         self.CURRENT_NET =kwargs.get('current_net', None)
         assert(self.CURRENT_NET is not None)
+        # send the on-chain reads of an approval as one JSON-RPC batch
+        self.batch_reads = kwargs.get('batch_reads', True)
+        # concurrent position scanning
+        self.scan_concurrency = kwargs.get('scan_concurrency', 8)
+        self.scan_rate_limit = kwargs.get('scan_rate_limit', None)
+        self.scan_retries = kwargs.get('scan_retries', 3)
+        # monitor from a local position store kept current through events
+        self.incremental_monitor = kwargs.get('incremental_monitor', True)
+        self.reorg_depth = kwargs.get('reorg_depth', 12)
+        self.block_interval = kwargs.get('block_interval', 15)
+        # SQLite file persisting the position store, for warm restarts
+        self.position_snapshot = kwargs.get('position_snapshot', None)
+        self.position_store = None
+        self.expiry_queue = ExpiryQueue()
+        # the last liquidation sent for each due position, by position hash
+        self.liquidations = {}
+        # shared TTL cache of exchange rates
+        self.rate_cache = kwargs.get('rate_cache', None) or rate_cache
+        # compute position hashes off-chain once they are verified against the contract
+        self.local_signing = kwargs.get('local_signing', True)
+        # loan requests of one bulk approval processed at a time
+        self.approval_concurrency = kwargs.get('approval_concurrency', 8)
+        # fill_kernel gas estimates cached per kernel shape; on a miss either estimate
+        # live or fall back to a fixed gas limit. Without a live estimate the fill is
+        # still simulated with an eth_call before it is signed
+        self.gas_estimates = kwargs.get('gas_estimates', None) or fill_kernel_gas
+        self.live_gas_estimate = kwargs.get('live_gas_estimate', True)
+        self.fill_kernel_gas_limit = kwargs.get('fill_kernel_gas_limit', 1150000)
+        # serve supported wranglers and tokens from a cache kept current through events
+        self.cache_protocol_parameters = kwargs.get('cache_protocol_parameters', True)
+        # serve balances and allowances from a cache kept current through token events
+        self.cache_balances = kwargs.get('cache_balances', True)
+        # stop reading and signing once a loan request has failed a check
+        self.fail_fast = kwargs.get('fail_fast', True)
+        # seconds the latest block may lag the wall clock; an offer that expired longer
+        # ago than this is rejected without waiting for a block header
+        self.clock_tolerance = kwargs.get('clock_tolerance', 300)
+        # answer a retried loan request with the approval it was already given
+        self.approval_cache = (kwargs.get('approval_cache', None) or ApprovalCache()) if kwargs.get('cache_approvals', True) else None
 
         self.ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
-        self.errors = []
         self.initial_margin = 1.5
-        self.loan_request = {}
-        self.loan_object = {}
-        self.approval = {}
+        # the monitor recomputes collateral health on every rate and reports the positions
+        # whose health drops below the threshold (by default, collateral worth less than the loan)
+        self.health_engine = HealthEngine(
+            kwargs.get('health_threshold', None) or 100 / self.initial_margin,
+            initial_margin=self.initial_margin,
+            callback=kwargs.get('health_callback', None) or self._log_unhealthy_positions,
+            queue=kwargs.get('health_queue', None)
+        )
+        self.shared = True
+        self._reset_request_state()
 
-        self.supported_addresses = {Web3.toChecksumAddress(contract_address): contract_name for contract_name, contract_address in self.config[self.CURRENT_NET]["contracts"].items()}
-        print('\n\nself.supported_addresses:\n{0}\n\n'.format(self.supported_addresses))
+        self.supported_addresses = {checksum_address(contract_address): contract_name for contract_name, contract_address in self.config[self.CURRENT_NET]["contracts"].items()}
+        logger.debug("supported_addresses: %s", self.supported_addresses)
+        # build every contract handle up front, so requests never construct one
+        registry.preload(self.web3_client, self.config, self.CURRENT_NET)
+
+    def _reset_request_state(self):
+        self.errors = []
+        self.loan_request = None
+        self.loan_object = None
+        self.approval = {}
+        self.reads = None
+        self.block = None
+        self.rate = None
+
+    def context(self):
+        """ A per-request context: a shallow copy sharing this wrangler's configuration,
+            contract handles and caches, with its own request state.
+        """
+        context = copy.copy(self)
+        context.shared = False
+        context._reset_request_state()
+        return context
+
+    def block_context(self):
+        if self.block is None:
+            self.block = BlockContext(self.web3_client)
+        return self.block
 
     def current_block_timestamp(self):
-        return self.web3_client.eth.getBlock('latest')['timestamp']
+        return self.block_context().timestamp
 
     def maker_medianizer_contract(self):
-        return self.web3_client.eth.contract(
-            address=Web3.toChecksumAddress(self.config[self.CURRENT_NET]["contracts"]["maker_medianizer"]),
-            abi=get_abi('MakerMedianizer-{}'.format(self.CURRENT_NET)),
+        return registry.contract(
+            self.web3_client,
+            self.CURRENT_NET,
+            self.config[self.CURRENT_NET]["contracts"]["maker_medianizer"],
+            'MakerMedianizer-{}'.format(self.CURRENT_NET)
         )
 
     def protocol_contract(self):
-        return self.web3_client.eth.contract(
-            address=Web3.toChecksumAddress(self.config[self.CURRENT_NET]["contracts"]["protocol"]),
-            abi=get_abi('protocol'),
+        return registry.contract(
+            self.web3_client,
+            self.CURRENT_NET,
+            self.config[self.CURRENT_NET]["contracts"]["protocol"],
+            'protocol'
         )
 
     def ERC20_contract(self, _address):
-        return self.web3_client.eth.contract(
-            address=Web3.toChecksumAddress(_address),
-            abi=get_abi('ERC20'),
+        return registry.contract(self.web3_client, self.CURRENT_NET, _address, 'ERC20')
+
+    def protocol_parameters(self):
+        contracts = self.config[self.CURRENT_NET]["contracts"]
+        return get_protocol_parameters(
+            self.web3_client,
+            self.protocol_contract(),
+            wranglers=[self.config[self.CURRENT_NET]["wrangler"]],
+            tokens=[contract_address for contract_name, contract_address in contracts.items() if contract_name not in ("protocol", "maker_medianizer")]
+        )
+
+    def token_balances(self):
+        contracts = self.config[self.CURRENT_NET]["contracts"]
+        return get_token_balances(
+            self.web3_client,
+            [contract_address for contract_name, contract_address in contracts.items() if contract_name not in ("protocol", "maker_medianizer")]
         )
 
+    def read_caches(self):
+        """ The caches that serve approval reads, as configured."""
+        caches = []
+        if self.cache_protocol_parameters:
+            caches.append(self.protocol_parameters())
+        if self.cache_balances:
+            caches.append(self.token_balances())
+        return caches
+
+    def sync_read_caches(self):
+        """ Bring the protocol parameter cache up to this request's block.
+
+            The balance cache is only loaded here. Tailing token logs is left to its
+            follow_forever() thread; balances it has not caught up on are read from
+            the node with the other reads.
+        """
+        block_number = self.block_context().number
+        if self.cache_protocol_parameters:
+            self.protocol_parameters().sync(block_number)
+        if self.cache_balances:
+            self.token_balances().start(block_number)
+
+    def read_caches_synced(self, block_number):
+        """ Whether sync_read_caches() has nothing left to do at block_number."""
+        if self.cache_protocol_parameters and not self.protocol_parameters().is_current(block_number):
+            return False
+        return not self.cache_balances or self.token_balances().block_number is not None
+
+    @timed
     def validate_wrangler(self):
-        assert len(self.loan_request.__dict__), "self.loan_request needs to be filled"
+        assert self.loan_request is not None, "self.loan_request needs to be filled"
         try:
-            assert self.loan_request.wrangler == Web3.toChecksumAddress(self.config[self.CURRENT_NET]["wrangler"])
+            assert self.loan_request.wrangler == checksum_address(self.config[self.CURRENT_NET]["wrangler"])
         except AssertionError as err:
             self.errors.append({
                 'label': 'invalid_wrangler',
                 'message': 'Your wrangler is either invalid, or not authorized to approve your loan.'
             })
 
+    @timed
     def validate_supported_wrangler(self):
-        assert len(self.loan_request.__dict__), "self.loan_request needs to be filled"
+        assert self.loan_request is not None, "self.loan_request needs to be filled"
         try:
-            assert self.protocol_contract().functions.wranglers(self.loan_request.wrangler).call()
+            assert self._read('supported_wrangler')
         except AssertionError as err:
             self.errors.append({
                 'label': 'wrangler_not_supported',
                 'message': 'The wrangler {0} is not supported.'.format(self.loan_request.wrangler)
             })
 
+    @timed
     def validate_supported_lend_currency(self):
-        assert len(self.loan_request.__dict__), "self.loan_request needs to be filled"
+        assert self.loan_request is not None, "self.loan_request needs to be filled"
         try:
-            assert self.protocol_contract().functions.supported_tokens(self.loan_request.loanToken).call()
+            assert self._read('supported_lend_currency')
         except AssertionError as err:
-            self.errors.append({
-                'label': 'lend_currency_not_supported',
-                'message': 'The lend currency address {0} is not supported.'.format(self.loan_request.loanToken)
-            })
+            self._lend_currency_not_supported()
 
+    @timed
     def validate_supported_borrow_currency(self):
-        assert len(self.loan_request.__dict__), "self.loan_request needs to be filled"
+        assert self.loan_request is not None, "self.loan_request needs to be filled"
         try:
-            assert self.protocol_contract().functions.supported_tokens(self.loan_request.collateralToken).call()
+            assert self._read('supported_borrow_currency')
         except AssertionError as err:
-            self.errors.append({
-                'label': 'borrow_currency_not_supported',
-                'message': 'The borrow currency address {0} is not supported.'.format(self.loan_request.collateralToken)
-            })
+            self._borrow_currency_not_supported()
 
-    def validate_kernel(self):
-        assert len(self.loan_request.__dict__), "self.loan_request needs to be filled"
-        if self.current_block_timestamp() >= float(self.loan_request.offerExpiry):
+    def _lend_currency_not_supported(self):
+        self.errors.append({
+            'label': 'lend_currency_not_supported',
+            'message': 'The lend currency address {0} is not supported.'.format(self.loan_request.loanToken)
+        })
+
+    def _borrow_currency_not_supported(self):
+        self.errors.append({
+            'label': 'borrow_currency_not_supported',
+            'message': 'The borrow currency address {0} is not supported.'.format(self.loan_request.collateralToken)
+        })
+
+    def _has_configured_currencies(self):
+        return self.loan_request.loanToken in self.supported_addresses and self.loan_request.collateralToken in self.supported_addresses
+
+    @timed
+    def validate_configured_currencies(self):
+        # a currency missing from the config has no ticker to price it with
+        assert self.loan_request is not None, "self.loan_request needs to be filled"
+        if self.loan_request.loanToken not in self.supported_addresses:
+            self._lend_currency_not_supported()
+        if self.loan_request.collateralToken not in self.supported_addresses:
+            self._borrow_currency_not_supported()
+
+    def _kernel_expired(self):
+        if not any(error['label'] == 'kernel_expired' for error in self.errors):
             self.errors.append({
                 'label': 'kernel_expired',
                 'message': 'The order has expired. Please fill another order.'
             })
 
+    @timed
+    def validate_offer_expiry(self):
+        assert self.loan_request is not None, "self.loan_request needs to be filled"
+        if self.loan_request.offerExpiry + self.clock_tolerance <= time.time():
+            self._kernel_expired()
+
+    @timed
+    def validate_kernel(self):
+        assert self.loan_request is not None, "self.loan_request needs to be filled"
+        if self.current_block_timestamp() >= self.loan_request.offerExpiry:
+            self._kernel_expired()
+
+    @timed
     def validate_lend_currency_balance(self):
-        assert len(self.loan_object), "self.loan_object needs to be filled"
-        lend_currency_filled_value = float(Web3.fromWei(float(self.loan_object['loanAmountFilled']), 'ether'))
+        assert self.loan_object is not None, "self.loan_object needs to be filled"
+        lend_currency_filled_value = float(Web3.fromWei(self.loan_object.loanAmountFilled, 'ether'))
         try:
-            balance = self.ERC20_contract(self.loan_request.loanToken).functions.balanceOf(Web3.toChecksumAddress(self.loan_object['lender'])).call()
+            balance = self._read('lend_currency_balance')
             assert float(Web3.fromWei(balance, 'ether')) >= lend_currency_filled_value
         except AssertionError as err:
             self.errors.append({
@@ -194,11 +340,12 @@ class SimpleWrangler:
                 'message': 'Lender does not have enough balance ({0}) of lend currency.'.format(lend_currency_filled_value)
             })
 
+    @timed
     def validate_lend_currency_allowance(self):
-        assert len(self.loan_object), "self.loan_object needs to be filled"
-        lend_currency_filled_value = float(Web3.fromWei(float(self.loan_object['loanAmountFilled']), 'ether'))
+        assert self.loan_object is not None, "self.loan_object needs to be filled"
+        lend_currency_filled_value = float(Web3.fromWei(self.loan_object.loanAmountFilled, 'ether'))
         try:
-            allowance = self.ERC20_contract(self.loan_request.loanToken).functions.allowance(Web3.toChecksumAddress(self.loan_object['lender']), Web3.toChecksumAddress(self.protocol_contract().address)).call()
+            allowance = self._read('lend_currency_allowance')
             assert float(Web3.fromWei(allowance, 'ether')) >= lend_currency_filled_value
         except AssertionError as err:
             self.errors.append({
@@ -206,11 +353,12 @@ class SimpleWrangler:
                 'message': 'Lender has not set allowance ({0}) for lend currency.'.format(lend_currency_filled_value)
             })
 
+    @timed
     def validate_borrow_currency_balance(self):
-        assert len(self.loan_object), "self.loan_object needs to be filled"
+        assert self.loan_object is not None, "self.loan_object needs to be filled"
         _borrow_currency_value = self._borrow_currency_value()
         try:
-            balance = self.ERC20_contract(self.loan_request.collateralToken).functions.balanceOf(Web3.toChecksumAddress(self.loan_object['borrower'])).call()
+            balance = self._read('borrow_currency_balance')
             assert float(Web3.fromWei(balance, 'ether')) >= _borrow_currency_value
         except AssertionError as err:
             self.errors.append({
@@ -218,11 +366,12 @@ class SimpleWrangler:
                 'message': 'Borrower does not have enough balance {0} of borrow currency.'.format(_borrow_currency_value)
             })
 
+    @timed
     def validate_borrow_currency_allowance(self):
-        assert len(self.loan_object), "self.loan_object needs to be filled"
+        assert self.loan_object is not None, "self.loan_object needs to be filled"
         _borrow_currency_value = self._borrow_currency_value()
         try:
-            allowance = self.ERC20_contract(self.loan_request.collateralToken).functions.allowance(Web3.toChecksumAddress(self.loan_object['borrower']), Web3.toChecksumAddress(self.protocol_contract().address)).call()
+            allowance = self._read('borrow_currency_allowance')
             assert float(Web3.fromWei(allowance, 'ether')) >= _borrow_currency_value
         except AssertionError as err:
             self.errors.append({
@@ -230,11 +379,12 @@ class SimpleWrangler:
                 'message': 'Borrower has not set allowance {0} for borrow currency.'.format(_borrow_currency_value)
             })
 
+    @timed
     def validate_protocol_currency_balance(self):
-        assert len(self.loan_object), "self.loan_object needs to be filled"
-        _monitoring_fee = float(Web3.fromWei(float(self.loan_object['monitoringFeeLST']), 'ether'))
+        assert self.loan_object is not None, "self.loan_object needs to be filled"
+        _monitoring_fee = float(Web3.fromWei(self.loan_object.monitoringFeeLST, 'ether'))
         try:
-            balance = self.ERC20_contract(self.config[self.CURRENT_NET]['contracts']['lst']).functions.balanceOf(Web3.toChecksumAddress(self.loan_object['lender'])).call()
+            balance = self._read('protocol_currency_balance')
             assert float(Web3.fromWei(balance, 'ether')) >= _monitoring_fee
         except AssertionError as err:
             self.errors.append({
@@ -242,11 +392,12 @@ class SimpleWrangler:
                 'message': 'Lender does not have enough balance {0} of LST.'.format(_monitoring_fee)
             })
 
+    @timed
     def validate_protocol_currency_allowance(self):
-        assert len(self.loan_object), "self.loan_object needs to be filled"
-        _monitoring_fee = float(Web3.fromWei(float(self.loan_object['monitoringFeeLST']), 'ether'))
+        assert self.loan_object is not None, "self.loan_object needs to be filled"
+        _monitoring_fee = float(Web3.fromWei(self.loan_object.monitoringFeeLST, 'ether'))
         try:
-            allowance = self.ERC20_contract(self.config[self.CURRENT_NET]['contracts']['lst']).functions.allowance(Web3.toChecksumAddress(self.loan_object['lender']), Web3.toChecksumAddress(self.protocol_contract().address)).call()
+            allowance = self._read('protocol_currency_allowance')
             assert float(Web3.fromWei(allowance, 'ether')) >= _monitoring_fee
         except AssertionError as err:
             self.errors.append({
@@ -254,12 +405,100 @@ class SimpleWrangler:
                 'message': 'Lender has not set allowance {0} for LST.'.format(_monitoring_fee)
             })
 
+    def _approval_read_functions(self):
+        protocol = self.protocol_contract()
+        lend_currency = self.ERC20_contract(self.loan_request.loanToken)
+        borrow_currency = self.ERC20_contract(self.loan_request.collateralToken)
+        protocol_currency = self.ERC20_contract(self.config[self.CURRENT_NET]['contracts']['lst'])
+        functions = OrderedDict([
+            ('supported_wrangler', lambda: protocol.functions.wranglers(self.loan_request.wrangler)),
+            ('supported_lend_currency', lambda: protocol.functions.supported_tokens(self.loan_request.loanToken)),
+            ('supported_borrow_currency', lambda: protocol.functions.supported_tokens(self.loan_request.collateralToken)),
+            ('wrangler_nonce', lambda: protocol.functions.wrangler_nonces(self.loan_request.wrangler, self._kernel_creator())),
+            ('owed_value', lambda: protocol.functions.owed_value(
+                self.loan_request.fillLoanAmount,
+                self.loan_request.dailyInterestRate,
+                self.loan_request.loanDuration
+            )),
+            ('lend_currency_balance', lambda: lend_currency.functions.balanceOf(self._lender())),
+            ('lend_currency_allowance', lambda: lend_currency.functions.allowance(self._lender(), protocol.address)),
+            ('borrow_currency_balance', lambda: borrow_currency.functions.balanceOf(self._borrower())),
+            ('borrow_currency_allowance', lambda: borrow_currency.functions.allowance(self._borrower(), protocol.address)),
+            ('protocol_currency_balance', lambda: protocol_currency.functions.balanceOf(self._lender())),
+            ('protocol_currency_allowance', lambda: protocol_currency.functions.allowance(self._lender(), protocol.address)),
+        ])
+        if self._is_weth_dai_pair():
+            functions['medianizer_rate'] = lambda: self.maker_medianizer_contract().functions.read()
+        return functions
+
+    def _read_cache(self, key):
+        """ The (lookup, record, key) of a read served by the protocol parameter or balance cache, or None."""
+        if self.cache_protocol_parameters and key in ('supported_wrangler', 'supported_lend_currency', 'supported_borrow_currency'):
+            protocol_parameters = self.protocol_parameters()
+            return protocol_parameters.flag, protocol_parameters.record, {
+                'supported_wrangler': ('wranglers', self.loan_request.wrangler),
+                'supported_lend_currency': ('supported_tokens', self.loan_request.loanToken),
+                'supported_borrow_currency': ('supported_tokens', self.loan_request.collateralToken),
+            }[key]
+        if self.cache_balances and key.endswith(('_balance', '_allowance')):
+            token_balances = self.token_balances()
+            token = {
+                'lend_currency': self.loan_request.loanToken,
+                'borrow_currency': self.loan_request.collateralToken,
+                'protocol_currency': checksum_address(self.config[self.CURRENT_NET]['contracts']['lst']),
+            }[key.rsplit('_', 1)[0]]
+            owner = self._borrower() if key.startswith('borrow_currency') else self._lender()
+            spender = self.protocol_contract().address if key.endswith('_allowance') else None
+            lookup = functools.partial(token_balances.amount, block_number=self.block_context().number)
+            return lookup, token_balances.record, (token, owner, spender)
+        return None
+
+    def _cached_read(self, key, count=True):
+        read_cache = self._read_cache(key)
+        if read_cache is None:
+            return None
+        lookup, record, cache_key = read_cache
+        return lookup(*cache_key, count=count)
+
+    def _uncached_approval_read_functions(self):
+        """ The reads of an approval that the protocol parameter and balance caches cannot answer."""
+        # only _read() counts a lookup as a cache hit or miss
+        return OrderedDict((key, contract_function) for key, contract_function in self._approval_read_functions().items() if self._cached_read(key, count=False) is None)
+
+    @timed
+    def prefetch_approval_reads(self):
+        """ Send every on-chain read of an approval in one round-trip, pinned to one block."""
+        reader = BatchReader(self.web3_client, block_identifier=self.block_context().number)
+        for key, contract_function in self._uncached_approval_read_functions().items():
+            reader.add(key, contract_function())
+        self.reads = reader.execute()
+
+    def prefetch_reads(self):
+        # a bulk approval's reads are prefetched for all its requests at once
+        if self.batch_reads and self.reads is None:
+            self.prefetch_approval_reads()
+
+    def prefetch_rate(self):
+        # the WETH/DAI rate comes from the medianizer, read with the others
+        if not self._is_weth_dai_pair():
+            self._borrow_currency_rate()
+
+    def _read(self, key):
+        value = self._cached_read(key)
+        if value is not None:
+            return value
+        if self.reads is not None and key in self.reads:
+            value = self.reads.result(key)
+        else:
+            value = self.block_context().call(self._approval_read_functions()[key]())
+        read_cache = self._read_cache(key)
+        if read_cache is not None:
+            lookup, record, cache_key = read_cache
+            record(*cache_key, value, self.block_context().number)
+        return value
+
     def _owed_value(self):
-        return self.protocol_contract().functions.owed_value(
-            Web3.toInt(text=self.loan_request.fillLoanAmount),
-            Web3.toWei(self.loan_request.interestRatePerDay, "ether"),
-            Web3.toInt(text=self.loan_request.loanDuration)
-        ).call()
+        return self._read('owed_value')
 
     def _is_kernel_creator_lender(self):
         return self.loan_request.lender != self.ZERO_ADDRESS
@@ -267,43 +506,87 @@ class SimpleWrangler:
     def _kernel_creator(self):
         return self.loan_request.lender if self._is_kernel_creator_lender() else self.loan_request.borrower
 
+    def _lender(self):
+        return self.loan_request.lender if self._is_kernel_creator_lender() else self.loan_request.filler
+
+    def _borrower(self):
+        return self.loan_request.borrower if self.loan_request.borrower != self.ZERO_ADDRESS else self.loan_request.filler
+
+    def _is_weth_dai_pair(self):
+        return self.supported_addresses.get(self.loan_request.collateralToken) == 'weth' and self.supported_addresses.get(self.loan_request.loanToken) == 'dai'
+
     def _weth_dai_rate(self):
-        medianizer_rate = float(Web3.fromWei(Web3.toInt(self.maker_medianizer_contract().functions.read().call()), 'ether'))
+        medianizer_rate = float(Web3.fromWei(Web3.toInt(self._read('medianizer_rate')), 'ether'))
         if medianizer_rate != 0.0:
             return 1/medianizer_rate
         return float(cmc_rate_per_weth('dai'))
 
-    def _borrow_currency_rate(self):
-        if self.supported_addresses[self.loan_request.collateralToken] == 'weth' and self.supported_addresses[self.loan_request.loanToken] == 'dai':
+    def _rate_key(self, lend_currency_ticker, borrow_currency_ticker):
+        return (self.CURRENT_NET, lend_currency_ticker, borrow_currency_ticker)
+
+    def _fetch_borrow_currency_rate(self):
+        if self._is_weth_dai_pair():
             return self._weth_dai_rate()
         return cryptocompare_rate(
             self.supported_addresses[self.loan_request.loanToken],
             self.supported_addresses[self.loan_request.collateralToken])
 
+    def _borrow_currency_rate(self):
+        # snapshot the rate so the whole approval uses one price
+        if self.rate is None:
+            self.rate = self.rate_cache.get(
+                self._rate_key(self.supported_addresses[self.loan_request.loanToken], self.supported_addresses[self.loan_request.collateralToken]),
+                self._fetch_borrow_currency_rate
+            )
+        return self.rate
+
     def _borrow_currency_value(self):
-        return float(Web3.fromWei(float(self.loan_request.fillLoanAmount), 'ether')) * self._borrow_currency_rate() * self.initial_margin
+        return float(Web3.fromWei(self.loan_request.fillLoanAmount, 'ether')) * self._borrow_currency_rate() * self.initial_margin
 
     def _position_hash_addresses(self):
-        return [Web3.toChecksumAddress(self._kernel_creator()), Web3.toChecksumAddress(self.loan_object['lender']), Web3.toChecksumAddress(self.loan_object['borrower']), Web3.toChecksumAddress(self.loan_object['relayer']), Web3.toChecksumAddress(self.loan_object['wrangler']), Web3.toChecksumAddress(self.loan_object['collateralToken']), Web3.toChecksumAddress(self.loan_object['loanToken'])]
+        return [self._kernel_creator()] + self._approval_addresses()
+
+    def _approval_addresses(self):
+        return [self.loan_object.lender, self.loan_object.borrower, self.loan_object.relayer, self.loan_object.wrangler, self.loan_object.collateralToken, self.loan_object.loanToken]
 
     def _position_hash_values(self):
-        return [Web3.toInt(text=self.loan_object['collateralAmount']),Web3.toInt(text=self.loan_request.loanAmountOffered),Web3.toInt(text=self.loan_object['relayerFeeLST']),Web3.toInt(text=self.loan_object['monitoringFeeLST']),Web3.toInt(text=self.loan_object['rolloverFeeLST']),Web3.toInt(text=self.loan_object['closureFeeLST']),Web3.toInt(text=self.loan_object['loanAmountFilled'])]
+        return [self.loan_object.collateralAmount, self.loan_request.loanAmountOffered, self.loan_object.relayerFeeLST, self.loan_object.monitoringFeeLST, self.loan_object.rolloverFeeLST, self.loan_object.closureFeeLST, self.loan_object.loanAmountFilled]
 
-    def _signed_approval(self):
-        position_hash = self.protocol_contract().functions.position_hash(
+    def _position_hash_arguments(self):
+        return (
             self._position_hash_addresses(),
             self._position_hash_values(),
-            self.loan_object['loanAmountOwed'],
-            Web3.toInt(text=self.loan_object['nonce'])
-        ).call()
+            self.loan_object.loanAmountOwed,
+            self.loan_object.nonce
+        )
 
-        position_hash = Web3.soliditySha3(['bytes32', 'bytes32'], [Web3.toBytes(text='\x19Ethereum Signed Message:\n32'), position_hash])
-        _signature = self.web3_client.eth.account.signHash(position_hash, private_key=Web3.toBytes(hexstr=self.config[self.CURRENT_NET]["private_key"]))
-        return _signature.signature
+    def _position_hash_function(self):
+        return self.protocol_contract().functions.position_hash(*self._position_hash_arguments())
+
+    def _remote_position_hash(self):
+        return self.block_context().call(self._position_hash_function())
+
+    def _position_hash(self):
+        protocol_address = self.protocol_contract().address
+        verified = signing.is_verified(protocol_address) if self.local_signing else False
+        if verified is False:
+            return self._remote_position_hash()
+        local_hash = signing.position_hash(protocol_address, *self._position_hash_arguments())
+        if verified:
+            return local_hash
+        # until the off-chain hash has matched the contract once, the contract's hash is used
+        remote_hash = self._remote_position_hash()
+        signing.record_verification(protocol_address, local_hash, remote_hash)
+        return remote_hash
+
+    @timed
+    def _signed_approval(self):
+        position_hash = signing.signed_message_hash(self._position_hash())
+        return signing.sign_hash(signing.private_key(self.config[self.CURRENT_NET]["private_key"]), position_hash)
 
-    def _sign_fill_kernel_transaction(self):
+    def _fill_kernel_function(self):
         assert len(self.approval), "self.approval needs to be filled"
-        gas_estimate = self.protocol_contract().functions.fill_kernel(
+        return self.protocol_contract().functions.fill_kernel(
             self.approval['_addresses'],
             self.approval['_values'],
             self.approval['_nonce'],
@@ -314,189 +597,477 @@ class SimpleWrangler:
             self.approval['_kernel_creator_salt'],
             self.approval['_sig_data_kernel_creator'],
             self.approval['_sig_data_wrangler']
-        ).estimateGas()
+        )
 
-        chain_id = 0
-        if self.CURRENT_NET == 'mainnet':
-            chain_id = 1
-        elif self.CURRENT_NET == 'kovan':
-            chain_id = 42
-        else:
-            chain_id = 101
-        assert chain_id > 0, "invalid chain id {0}".format(chain_id)
-
-        signed_raw_tx_bytes = self.web3_client.eth.account.signTransaction(
-            self.protocol_contract().functions.fill_kernel(
-                self.approval['_addresses'],
-                self.approval['_values'],
-                self.approval['_nonce'],
-                self.approval['_kernel_daily_interest_rate'],
-                self.approval['_is_creator_lender'],
-                self.approval['_timestamps'],
-                self.approval['_position_duration_in_seconds'],
-                self.approval['_kernel_creator_salt'],
-                self.approval['_sig_data_kernel_creator'],
-                self.approval['_sig_data_wrangler']
-            ).buildTransaction({
-                'chainId': chain_id,
-                'gas': gas_estimate,
-                'gasPrice': self.web3_client.eth.gasPrice,
-                'nonce': self.web3_client.eth.getTransactionCount(Web3.toChecksumAddress(self.config[self.CURRENT_NET]["wrangler"])),
-            }),
-            private_key=Web3.toBytes(hexstr=self.config[self.CURRENT_NET]["private_key"])
-        ).rawTransaction
-        signed_raw_tx_hex = Web3.toHex(signed_raw_tx_bytes)
+    def gas_price_oracle(self):
+        return get_gas_price_oracle(self.web3_client)
+
+    def _fill_kernel_shape(self):
+        fees = (self.loan_request.relayerFeeLST, self.loan_request.monitoringFeeLST, self.loan_request.rolloverFeeLST, self.loan_request.closureFeeLST)
+        return (self.loan_request.loanToken, self.loan_request.collateralToken, self._is_kernel_creator_lender(), tuple(fee > 0 for fee in fees))
+
+    def _fill_kernel_transaction(self):
+        # encoded once, for both the gas estimate and the signed transaction
+        return encode_call(self._fill_kernel_function())
+
+    def _fill_kernel_preflight(self, transaction):
+        # simulate the fill as the wrangler account would send it
+        return [dict(transaction, **{'from': self.transaction_submitter().address}), block_param(self.block_context().number)]
+
+    def _check_fill_kernel_preflight(self, return_data):
+        """ Raise ValueError unless the simulated fill_kernel succeeded (older nodes return no data on a revert)."""
+        if isinstance(return_data, str):
+            return_data = Web3.toBytes(hexstr=return_data)
+        if not len(return_data) or not decode_call(self._fill_kernel_function(), return_data):
+            raise ValueError("fill_kernel would fail for this kernel at block {0}".format(self.block_context().number))
+
+    def _fill_kernel_gas(self, transaction):
+        # a live estimate simulates fill_kernel; without one, an eth_call does, so a
+        # kernel that would revert (bad signature, reused salt, ...) is never signed
+        shape = self._fill_kernel_shape()
+        gas_estimate = self.gas_estimates.get(shape)
+        if gas_estimate is not None or not self.live_gas_estimate:
+            self._check_fill_kernel_preflight(self.web3_client.eth.call(*self._fill_kernel_preflight(transaction)))
+            return gas_estimate if gas_estimate is not None else self.fill_kernel_gas_limit
+        gas_estimate = self.web3_client.eth.estimateGas(transaction)
+        self.gas_estimates.record(shape, gas_estimate)
+        return gas_estimate
+
+    @timed
+    def _sign_fill_kernel_transaction(self):
+        block_number = self.block_context().number
+        transaction = self._fill_kernel_transaction()
+        gas_estimate = self._fill_kernel_gas(transaction)
+        signed_raw_tx_hex = self._signed_fill_kernel_transaction(
+            transaction,
+            gas_estimate,
+            self.gas_price_oracle().price(block_number),
+            self.transaction_submitter().nonces.current(block_number)
+        )
 
         return gas_estimate, signed_raw_tx_hex
 
+    def _signed_fill_kernel_transaction(self, transaction, gas_estimate, gas_price, nonce):
+        signed_raw_tx_bytes = self.transaction_submitter().sign(dict(
+            transaction,
+            value=0,
+            gas=gas_estimate,
+            gasPrice=gas_price,
+            nonce=nonce
+        )).rawTransaction
+        return Web3.toHex(signed_raw_tx_bytes)
+
+    @timed
     def create_loan_object(self):
-        current_nonce = self.protocol_contract().functions.wrangler_nonces(self.loan_request.wrangler, Web3.toChecksumAddress(self._kernel_creator())).call()
+        current_nonce = self._read('wrangler_nonce')
         nonce = current_nonce + 1
         lending_currency_owed_value = self._owed_value()
-        self.loan_object = {
-            'collateralToken': self.loan_request.collateralToken,
-            'loanToken': self.loan_request.loanToken,
-            'collateralAmount': Web3.toWei(self._borrow_currency_value(), 'ether'),
-            'loanAmountFilled': self.loan_request.fillLoanAmount,
-            'loanAmountOwed': lending_currency_owed_value,
-            'expiresAtTimestamp': self.current_block_timestamp() + int(self.loan_request.loanDuration),
-            'lender': self.loan_request.lender if self._is_kernel_creator_lender() else self.loan_request.filler,
-            'borrower': self.loan_request.borrower if self.loan_request.borrower != self.ZERO_ADDRESS else self.loan_request.filler,
-            "relayer": self.loan_request.relayer,
-            "wrangler": self.loan_request.wrangler,
-            'relayerFeeLST': self.loan_request.relayerFeeLST,
-            'monitoringFeeLST': self.loan_request.monitoringFeeLST,
-            'rolloverFeeLST': self.loan_request.rolloverFeeLST,
-            'closureFeeLST': self.loan_request.closureFeeLST,
-            'nonce': Web3.toInt(nonce)
-        }
+        self.loan_object = LoanObject(
+            collateralToken=self.loan_request.collateralToken,
+            loanToken=self.loan_request.loanToken,
+            collateralAmount=Web3.toWei(self._borrow_currency_value(), 'ether'),
+            loanAmountFilled=self.loan_request.fillLoanAmount,
+            loanAmountOwed=lending_currency_owed_value,
+            expiresAtTimestamp=self.current_block_timestamp() + self.loan_request.loanDuration,
+            lender=self._lender(),
+            borrower=self._borrower(),
+            relayer=self.loan_request.relayer,
+            wrangler=self.loan_request.wrangler,
+            relayerFeeLST=self.loan_request.relayerFeeLST,
+            monitoringFeeLST=self.loan_request.monitoringFeeLST,
+            rolloverFeeLST=self.loan_request.rolloverFeeLST,
+            closureFeeLST=self.loan_request.closureFeeLST,
+            nonce=Web3.toInt(nonce)
+        )
 
+    @timed
     def create_approval(self):
-        _addresses = [
-            self.loan_object['lender'],
-            self.loan_object['borrower'],
-            self.loan_request.relayer,
-            self.loan_object['wrangler'],
-            self.loan_object['collateralToken'],
-            self.loan_object['loanToken']
-        ]
-        _values = [
-            str(Web3.toWei(self._borrow_currency_value(), 'ether')),
-            self.loan_request.loanAmountOffered,
-            self.loan_request.relayerFeeLST,
-            self.loan_request.monitoringFeeLST,
-            self.loan_request.rolloverFeeLST,
-            self.loan_request.closureFeeLST,
-            self.loan_request.fillLoanAmount
-        ]
-        _timestamps = [
-            self.loan_request.offerExpiry,
-            str(self.current_block_timestamp() + (2 * 60))
-        ]
-
-
         self.approval = {
-            "_addresses": [Web3.toChecksumAddress(self.loan_object['lender']),Web3.toChecksumAddress(self.loan_object['borrower']),Web3.toChecksumAddress(self.loan_object['relayer']),Web3.toChecksumAddress(self.loan_object['wrangler']),Web3.toChecksumAddress(self.loan_object['collateralToken']),Web3.toChecksumAddress(self.loan_object['loanToken'])],
+            "_addresses": self._approval_addresses(),
             "_values": self._position_hash_values(),
-            "_nonce": Web3.toInt(text=self.loan_object['nonce']),
-            "_kernel_daily_interest_rate": Web3.toWei(self.loan_request.interestRatePerDay, "ether"),
+            "_nonce": self.loan_object.nonce,
+            "_kernel_daily_interest_rate": self.loan_request.dailyInterestRate,
             "_is_creator_lender": self._is_kernel_creator_lender(),
-            "_timestamps": [Web3.toInt(text=_timestamp) for _timestamp in _timestamps],
-            "_position_duration_in_seconds": Web3.toInt(text=self.loan_request.loanDuration),
+            "_timestamps": [self.loan_request.offerExpiry, self.current_block_timestamp() + (2 * 60)],
+            "_position_duration_in_seconds": self.loan_request.loanDuration,
             "_kernel_creator_salt": self.loan_request.creatorSalt,
             "_sig_data_kernel_creator": self.loan_request.ecSignatureCreator,
             "_sig_data_wrangler": Web3.toHex(self._signed_approval())
         }
 
-    def approve_loan(self, data):
-        self.loan_request = LoanRequest(**data)
+    def reset_approval(self, data):
         # reset parameters
-        self.errors = []
-        self.loan_object = {}
-        self.approval = {}
-        # perform validations
+        self._reset_request_state()
+        self.loan_request = LoanRequest(**data)
+
+    @timed
+    def validate_loan_request(self):
         self.validate_wrangler()
+        self.validate_offer_expiry()
         self.validate_supported_wrangler()
         self.validate_supported_lend_currency()
         self.validate_supported_borrow_currency()
         self.validate_kernel()
-        # create loan object
-        self.create_loan_object()
-        # perform some more validations
+
+    @timed
+    def validate_loan_object(self):
         self.validate_lend_currency_balance()
         self.validate_lend_currency_allowance()
         self.validate_borrow_currency_balance()
         self.validate_borrow_currency_allowance()
         self.validate_protocol_currency_balance()
         self.validate_protocol_currency_allowance()
+
+    def run_local_checks(self):
+        """ Run the checks that need no reads, returning False when the approval should stop there.
+
+            Whatever fail_fast says, a request with a currency missing from the config
+            stops here, since nothing could price it.
+        """
+        return self.LOCAL_CHECKS.run(self, self.fail_fast) and self._has_configured_currencies()
+
+    def set_fill_kernel_transaction(self, gas_estimate, signed_tx):
+        logger.debug("Gas estimate to transact with fill_kernel: %s", gas_estimate)
+        self.approval["_gas_estimate"] = gas_estimate
+        self.approval["_signed_transaction"] = signed_tx
+
+    def set_invalid_parameters(self, err):
+        self.errors.append({
+            'label': 'invalid_paramaters',
+            'message': """{0}""".format(err)
+        })
+
+    def approval_result(self):
+        loan = self.loan_object.serialize() if self.loan_object is not None else {}
+        return loan, self.approval, self.errors
+
+    @request_scoped
+    @timed
+    def approve_loan(self, data):
+        self.reset_approval(data)
+        # local checks run on every request, cached or not
+        if not self.run_local_checks():
+            return self.approval_result()
+        if self.approval_cache is None or len(self.errors):
+            return self._approve_loan()
+        return self.approval_cache.get(self.loan_request, self._approve_loan)
+
+    def _approve_loan(self):
+        # pin every read of this approval to the latest block
+        self.block = BlockContext(self.web3_client)
+        # perform the remaining validations and create the loan object
+        if not self.APPROVAL_STEPS.run(self, self.fail_fast):
+            return self.approval_result()
         # create approval
         self.create_approval()
 
         if not len(self.errors):
             # estimate gas cost for transaction
             try:
-                gas_estimate, signed_tx = self._sign_fill_kernel_transaction()
-                print("Gas estimate to transact with fill_kernel: {0}\n".format(gas_estimate))
-                self.approval["_gas_estimate"] = gas_estimate
-                self.approval["_signed_transaction"] = signed_tx
+                self.set_fill_kernel_transaction(*self._sign_fill_kernel_transaction())
             except ValueError as err:
-                self.errors.append({
-                    'label': 'invalid_paramaters',
-                    'message': """{0}""".format(err)
-                })
-
-        self.loan_object['loanAmountOwed'] = str(self.loan_object['loanAmountOwed'])
-
-        return self.loan_object, self.approval, self.errors
-
-    def get_positions(self, _address=None):
-        positions = []
-        _address = _address or None
-        if not _address:
-            last_position_index = self.protocol_contract().functions.last_position_index().call()
-            while last_position_index > -1:
-                position_hash = self.protocol_contract().functions.position_index(last_position_index).call()
-                position = self.protocol_contract().functions.position(position_hash).call()
-                positions.append(position)
-                last_position_index -= 1
+                self.set_invalid_parameters(err)
+
+        return self.approval_result()
+
+    def _map(self, function, items):
+        with ThreadPoolExecutor(max_workers=self.approval_concurrency) as executor:
+            return list(executor.map(function, items))
+
+    def _bulk_approval(self, data, block):
+        approval = self.context()
+        try:
+            approval.reset_approval(data)
+        except (AssertionError, TypeError, ValueError) as err:
+            approval.set_invalid_parameters(err)
+        approval.block = block
+        return approval
+
+    def _prefetch_bulk_reads(self, approvals, block):
+        """ Read what all the approvals need in one round-trip, sending each distinct call once."""
+        reader = BatchReader(self.web3_client, block_identifier=block.number, batched=self.batch_reads)
+        for approval in approvals:
+            approval.reads = BatchView(reader, {
+                key: reader.add_call(contract_function())
+                for key, contract_function in approval._uncached_approval_read_functions().items()
+            })
+        reader.execute()
+
+    def _wrangler_nonce_key(self):
+        return (self.loan_request.wrangler, self._kernel_creator())
+
+    def _assign_bulk_wrangler_nonces(self, approvals):
+        # the contract's nonce is read once per kernel creator, so kernels of the
+        # same creator take consecutive nonces in the order they were submitted
+        offsets = {}
+        for approval in approvals:
+            key = approval._wrangler_nonce_key()
+            approval.loan_object.nonce += offsets.get(key, 0)
+            offsets[key] = offsets.get(key, 0) + 1
+
+    def _estimate_fill_kernel_gas(self, transaction):
+        try:
+            return self._fill_kernel_gas(transaction)
+        except ValueError as err:
+            return err
+
+    def _sign_bulk_fill_kernel_transactions(self, approvals, block):
+        transactions = [approval._fill_kernel_transaction() for approval in approvals]
+        # a kernel whose nonce follows another one in the batch cannot be estimated
+        # before that one is filled, so it reuses the estimate of the first kernel
+        first_transactions = OrderedDict()
+        for approval, transaction in zip(approvals, transactions):
+            first_transactions.setdefault(approval._wrangler_nonce_key(), (approval, transaction))
+        gas_estimates = dict(zip(first_transactions.keys(), self._map(lambda item: item[0]._estimate_fill_kernel_gas(item[1]), first_transactions.values())))
+        gas_price = self.gas_price_oracle().price(block.number)
+        nonce = self.transaction_submitter().nonces.current(block.number)
+        for approval, transaction in zip(approvals, transactions):
+            gas_estimate = gas_estimates[approval._wrangler_nonce_key()]
+            if isinstance(gas_estimate, ValueError):
+                approval.set_invalid_parameters(gas_estimate)
+                continue
+            approval.set_fill_kernel_transaction(gas_estimate, approval._signed_fill_kernel_transaction(transaction, gas_estimate, gas_price, nonce))
+            nonce += 1
+
+    def _validate_bulk_approval(self):
+        try:
+            self.APPROVAL_STEPS.run(self, self.fail_fast)
+        except (KeyError, ValueError) as err:
+            self.set_invalid_parameters(err)
+
+    def _create_bulk_approval(self):
+        try:
+            self.create_approval()
+        except ValueError as err:
+            self.set_invalid_parameters(err)
+
+    @request_scoped
+    @timed
+    def approve_loans(self, items):
+        """ Approve many loan requests at once, returning a result per request.
+
+            All requests are approved against one block with one shared batch of reads,
+            so reads common to several requests (supported tokens, the wrangler, balances
+            and allowances of a repeated lender) are made once. Kernels from the same
+            creator get consecutive wrangler nonces, in the order they were submitted.
+        """
+        self.block = block = BlockContext(self.web3_client)
+        self.sync_read_caches()
+        approvals = [self._bulk_approval(data, block) for data in items]
+        # nothing is read for requests that fail a local check
+        parsed = [approval for approval in approvals if approval.loan_request is not None and approval.run_local_checks()]
+        if len(parsed):
+            self._prefetch_bulk_reads(parsed, block)
+        self._map(lambda approval: approval._validate_bulk_approval(), parsed)
+        created = [approval for approval in parsed if approval.loan_object is not None]
+        self._assign_bulk_wrangler_nonces([approval for approval in created if not len(approval.errors)])
+        self._map(lambda approval: approval._create_bulk_approval(), [approval for approval in created if not (self.fail_fast and len(approval.errors))])
+        valid = [approval for approval in created if not len(approval.errors)]
+        if len(valid):
+            self._sign_bulk_fill_kernel_transactions(valid, block)
+
+        return [approval.approval_result() for approval in approvals]
+
+    def position_scanner(self):
+        return PositionScanner(
+            self.block_context(),
+            self.protocol_contract(),
+            concurrency=self.scan_concurrency,
+            rate_limit=self.scan_rate_limit,
+            retries=self.scan_retries
+        )
+
+    @request_scoped
+    def get_positions(self, _address=None, ordered=True, lender=None, borrower=None, status=None):
+        """ Read all positions, or those where _address is the lender or the borrower,
+            and/or those of a lender and/or a borrower.
+
+            Positions of an address are found through the protocol's lend_positions and
+            borrow_positions, or through the warm position store when there is one, so
+            they cost O(that address's positions) rather than O(all positions).
+        """
+        store = self.position_store if self.position_store is not None and self.position_store.is_bootstrapped() else None
+        if not (_address or lender or borrower):
+            positions = store.values() if store is not None else self.position_scanner().scan(ordered=ordered)
+            return filter_positions(positions, status=status)
+        scanner = self.position_scanner()
+        def position_hashes(role, _address):
+            if store is not None:
+                return store.position_hashes(role, _address)
+            return set(bytes(position_hash) for position_hash in scanner.address_position_hashes(role, checksum_address(_address)))
+        selections = []
+        if _address:
+            selections.append(position_hashes('lend', _address) | position_hashes('borrow', _address))
+        if lender:
+            selections.append(position_hashes('lend', lender))
+        if borrower:
+            selections.append(position_hashes('borrow', borrower))
+        selected = sorted(set.intersection(*selections))
+        if store is not None:
+            positions = [position for position in map(store.get, selected) if position is not None]
+        else:
+            positions = scanner.positions(selected)
+        positions = filter_positions(positions, status=status)
+        if ordered:
+            positions.sort(key=lambda position: position[0], reverse=True)
         return positions
 
-    def liquidate(self, position_hash):
+    def transaction_submitter(self):
+        return get_submitter(
+            self.web3_client,
+            self.config[self.CURRENT_NET]["wrangler"],
+            self.config[self.CURRENT_NET]["private_key"],
+            chain_id_for(self.CURRENT_NET)
+        )
+
+    def liquidate(self, position_hash, wait=False):
+        """ Send a liquidate_position transaction without waiting for it to be mined, unless wait is set."""
         assert position_hash is not None, "position_hash cannot be None"
-        print("Sending transaction to liquidate_position : {0}\n".format(position_hash))
-        chain_id = 0
-        if self.CURRENT_NET == 'mainnet':
-            chain_id = 1
-        elif self.CURRENT_NET == 'kovan':
-            chain_id = 42
-        else:
-            chain_id = 101
-        assert chain_id > 0, "invalid chain id {0}".format(chain_id)
-        tx_nonce = self.web3_client.eth.getTransactionCount(Web3.toChecksumAddress(self.config[self.CURRENT_NET]["wrangler"]))
-        liquidate_txn = self.protocol_contract().functions.liquidate_position(position_hash).buildTransaction({
-            'chainId': chain_id,
-            'gas': 1150000,
-            'gasPrice': self.web3_client.eth.gasPrice,
-            'nonce': tx_nonce,
-        })
-        signed_txn = self.web3_client.eth.account.signTransaction(liquidate_txn, private_key=Web3.toBytes(hexstr=self.config[self.CURRENT_NET]["private_key"]))
-        tx_hash = self.web3_client.eth.sendRawTransaction(signed_txn.rawTransaction)
-        receipt = wait_for_receipt(self.web3_client, tx_hash, 1)
-        print("Transaction receipt mined: \n")
-        pprint.pprint(dict(receipt))
+        pending = self._send_liquidation(position_hash)
+        if wait:
+            self.transaction_submitter().wait(pending)
 
         return True
 
+    def _send_liquidation(self, position_hash):
+        logger.info("Sending transaction to liquidate_position : %s", position_hash)
+        submitter = self.transaction_submitter()
+        liquidate_txn = self.protocol_contract().functions.liquidate_position(position_hash).buildTransaction({
+            'chainId': submitter.chain_id,
+            'gas': 1150000,
+            # shares the per-block gas price with approvals when a block is at hand
+            'gasPrice': self.gas_price_oracle().price(self.block.number if self.block is not None else None),
+        })
+        return submitter.submit(liquidate_txn, on_receipt=self._print_receipt)
+
+    def _should_liquidate(self, position_hash):
+        """ Whether to send a liquidation: none was sent yet, it was given up on or
+            reverted, or it was mined but the store has since synced past it and still
+            shows the position open.
+        """
+        pending = self.liquidations.get(position_hash, None)
+        if pending is None or pending.error is not None:
+            return True
+        if pending.receipt is None:
+            return False
+        return not pending.receipt.get('status', 1) or self.position_store.tailer.last_block > pending.receipt['blockNumber']
+
+    def _print_receipt(self, receipt):
+        logger.info("Transaction receipt mined:\n%s", pprint.pformat(dict(receipt)))
+
+
+    def sync_positions(self):
+        """ Sync the local position store and queue the positions that changed."""
+        if self.position_store is None:
+            snapshot = None
+            if self.position_snapshot is not None:
+                snapshot = PositionSnapshot(self.position_snapshot, self.protocol_contract().address)
+            self.position_store = PositionStore(self, reorg_depth=self.reorg_depth, snapshot=snapshot)
+            # rates fetched anywhere in the process are price ticks for the health engine
+            self.rate_cache.subscribe(self._on_rate)
+        for position in self.position_store.sync():
+            self.expiry_queue.update(position)
+            self.health_engine.update(position)
+            if position[15] != POSITION_STATUS_OPEN:
+                self.liquidations.pop(bytes(position[21]), None)
 
     def monitor(self):
-        # iterate over each position
-        for position in self.get_positions():
-            # check if the position has expired and is still open
-            if (self.current_block_timestamp() >= position[8]) and (position[15] == 1):
-                # liquidate the position
-                self.liquidate(position[21])
+        # reuse the cached block header until a new block arrives
+        self.block_context().refresh()
+        if not self.incremental_monitor:
+            # iterate over each position
+            for position in self.get_positions():
+                # check if the position has expired and is still open
+                if (self.current_block_timestamp() >= position[8]) and (position[15] == POSITION_STATUS_OPEN):
+                    # liquidate the position
+                    self.liquidate(position[21])
+            return
+        self.sync_positions()
+        self.refresh_position_rates()
+        # only visit the positions that are due; they stay queued until the store shows
+        # them closed, so a liquidation that fails, reverts or is dropped is sent again
+        for position_hash in self.expiry_queue.due(self.current_block_timestamp()):
+            position = self.position_store.get(position_hash)
+            if position is None or position[15] != POSITION_STATUS_OPEN:
+                self.expiry_queue.discard(position_hash)
+                self.liquidations.pop(position_hash, None)
+                continue
+            if not self._should_liquidate(position_hash):
+                continue
+            try:
+                self.liquidations[position_hash] = self._send_liquidation(position[21])
+            except Exception:
+                logger.exception("Failed to liquidate position %s", Web3.toHex(position_hash))
+
+    def _position_pair_tickers(self, pair):
+        return self.supported_addresses.get(pair[0], None), self.supported_addresses.get(pair[1], None)
+
+    def _fetch_position_rate(self, borrow_currency_ticker, lend_currency_ticker):
+        # the medianizer prices WETH in DAI on-chain
+        if {borrow_currency_ticker, lend_currency_ticker} == {'weth', 'dai'} and "maker_medianizer" in self.config[self.CURRENT_NET]["contracts"]:
+            medianizer_rate = float(Web3.fromWei(Web3.toInt(self.block_context().call(self.maker_medianizer_contract().functions.read())), 'ether'))
+            if medianizer_rate != 0.0:
+                return medianizer_rate if borrow_currency_ticker == 'weth' else 1/medianizer_rate
+        return cryptocompare_rate(borrow_currency_ticker, lend_currency_ticker)
+
+    def refresh_position_rates(self):
+        """ Feed the health engine the current rate of every pair with open positions."""
+        for pair in list(self.health_engine.pairs):
+            tickers = self._position_pair_tickers(pair)
+            if None in tickers:
+                continue
+            try:
+                rate = self.rate_cache.get(self._rate_key(*tickers), functools.partial(self._fetch_position_rate, *tickers))
+            except Exception as err:
+                logger.warning("Failed to fetch the rate of %s: %s", tickers, err)
+                continue
+            self.health_engine.on_rate(pair, rate)
+
+    def _on_rate(self, key, rate):
+        net, from_ticker, to_ticker = key
+        if net != self.CURRENT_NET or not rate:
+            return
+        tickers = {contract_name: contract_address for contract_address, contract_name in self.supported_addresses.items()}
+        if from_ticker not in tickers or to_ticker not in tickers:
+            return
+        # a rate of `to` per `from` prices positions borrowing `from`, and inverted, those lending it
+        self.health_engine.on_rate((tickers[from_ticker], tickers[to_ticker]), rate)
+        self.health_engine.on_rate((tickers[to_ticker], tickers[from_ticker]), 1 / rate)
+
+    def _log_unhealthy_positions(self, records):
+        for record in records:
+            logger.warning("Position %s (%s) fell below health %s: %s", record['position_index'], record['position_hash'], self.health_engine.threshold, record['health'])
+
+    def follow_positions_forever(self):
+        """ Keep the position store synced on a daemon thread, once per block, without liquidating."""
+        def run():
+            while True:
+                try:
+                    self.block_context().refresh()
+                    self.sync_positions()
+                except Exception:
+                    logger.exception("Failed to sync positions")
+                time.sleep(self.block_interval)
+        thread = threading.Thread(target=run, name='wrangler-positions', daemon=True)
+        thread.start()
+        return thread
+
+    def monitor_forever(self):
+        """ Run monitor() sweeps, sleeping until the next expiry or the next block, whichever comes first."""
+        while True:
+            wait = self.block_interval
+            try:
+                self.monitor()
+                # positions already due wait for their liquidations, checked once per block
+                next_expiry = self.expiry_queue.next_expiry(after=self.current_block_timestamp())
+                if next_expiry is not None:
+                    wait = min(wait, next_expiry - self.current_block_timestamp())
+            except Exception:
+                logger.exception("Monitor sweep failed")
+            time.sleep(max(wait, 1))
 
 
+    @request_scoped
     def get_loan_health(self, position_index):
         health = 0
         self.errors = []
@@ -506,28 +1077,63 @@ class SimpleWrangler:
                 'message': 'Loan position index cannot be negative'
             })
         # get the position
-        position_hash = self.protocol_contract().functions.position_index(Web3.toInt(text=position_index)).call()
-        position = self.protocol_contract().functions.position(position_hash).call()
-        borrow_currency_address = Web3.toChecksumAddress(position[9])
-        lend_currency_address = Web3.toChecksumAddress(position[10])
-        initial_collateral_amount = float(Web3.fromWei(float(position[11]), 'ether'))
-        lend_currency_filled = float(Web3.fromWei(float(position[13]), 'ether'))
-
-        lend_currency_current_rate_per_borrow_currency = cryptocompare_rate(
-            self.supported_addresses[borrow_currency_address],
-            self.supported_addresses[lend_currency_address]
-        )
+        self.block = BlockContext(self.web3_client)
+        position_hash = self.block.call(self.protocol_contract().functions.position_index(Web3.toInt(text=position_index)))
+        position = self.block.call(self.protocol_contract().functions.position(position_hash))
+        tickers = self._position_tickers(position)
+        lend_currency_current_rate_per_borrow_currency = self.rate_cache.get(self._rate_key(*tickers), lambda: cryptocompare_rate(*tickers))
 
-        health = initial_collateral_amount * lend_currency_current_rate_per_borrow_currency * 100 / self.initial_margin / lend_currency_filled
+        health = self._position_health(position, lend_currency_current_rate_per_borrow_currency)
 
         return health, self.errors
 
+    @request_scoped
+    def get_loans_health(self, lender=None, borrower=None, status=None):
+        """ Return the health of every position matching the filters, fetching each pair's rate once."""
+        self.errors = []
+        self.block = BlockContext(self.web3_client)
+        # the store is kept current by the monitor or follow_positions_forever(), which
+        # also queue what changed; a request only reads it
+        positions = self.get_positions(lender=lender, borrower=borrower, status=status)
+
+        rates = {}
+        position_rates = []
+        for position in positions:
+            try:
+                tickers = self._position_tickers(position)
+            except KeyError:
+                # the position's currencies are not supported on this network
+                position_rates.append(float('nan'))
+                continue
+            if tickers not in rates:
+                # bind the pair now: a stale rate is refreshed later, on another thread
+                rates[tickers] = self.rate_cache.get(self._rate_key(*tickers), functools.partial(cryptocompare_rate, *tickers))
+            position_rates.append(rates[tickers])
+
+        health = positions_health(positions, position_rates, self.initial_margin)
+
+        return (health_record(position, position_health) for position, position_health in zip(positions, health)), self.errors
+
+    def _position_tickers(self, position):
+        borrow_currency_address = checksum_address(position[9])
+        lend_currency_address = checksum_address(position[10])
+        return self.supported_addresses[borrow_currency_address], self.supported_addresses[lend_currency_address]
+
+    def _position_health(self, position, lend_currency_current_rate_per_borrow_currency):
+        initial_collateral_amount = float(Web3.fromWei(float(position[11]), 'ether'))
+        lend_currency_filled = float(Web3.fromWei(float(position[13]), 'ether'))
+        return initial_collateral_amount * lend_currency_current_rate_per_borrow_currency * 100 / self.initial_margin / lend_currency_filled
+
 
+    @request_scoped
     def is_valid_protocol_transaction_sender(self, sender, txHash):
         protocol_tx = self.web3_client.eth.getTransaction(txHash)
-        print('\n\nprotocol_tx:\n{0}\n\n'.format(protocol_tx))
+        logger.debug("protocol_tx: %s", protocol_tx)
+        return self._is_valid_sender(protocol_tx, sender)
+
+    def _is_valid_sender(self, protocol_tx, sender):
         if protocol_tx['gas'] > 500000:
             # this was most likely a fill tx
-            return Web3.toChecksumAddress(protocol_tx['from']) == Web3.toChecksumAddress(self.config[self.CURRENT_NET]["wrangler"])
+            return checksum_address(protocol_tx['from']) == checksum_address(self.config[self.CURRENT_NET]["wrangler"])
         else:
-            return Web3.toChecksumAddress(protocol_tx['from']) == Web3.toChecksumAddress(sender)
+            return checksum_address(protocol_tx['from']) == checksum_address(sender)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import sqlite3
+import threading
+
+from .models import checksum_address
+
+
+logger = logging.getLogger(__name__)
+
+# position[21], the only bytes field of a position
+POSITION_HASH = 21
+SCHEMA_VERSION = '1'
+
+
+def encode_position(position):
+    position = list(position)
+    position[POSITION_HASH] = bytes(position[POSITION_HASH]).hex()
+    return json.dumps(position, separators=(',', ':'))
+
+
+def decode_position(record):
+    position = json.loads(record)
+    position[POSITION_HASH] = bytes.fromhex(position[POSITION_HASH])
+    return position
+
+
+class PositionSnapshot:
+    """ SQLite file holding a PositionStore's positions and the block they were synced to.
+
+        Positions are stored one row each, so a sync only writes the positions that
+        changed. Alongside them the snapshot keeps the hashes of positions touched in
+        the last reorg_depth blocks, which a warm start re-reads in case those blocks
+        were reorged out while the process was down. A snapshot of another protocol
+        deployment is ignored.
+    """
+
+    def __init__(self, path, protocol_address):
+        self.path = path
+        self.protocol_address = checksum_address(protocol_address)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS positions (position_hash BLOB PRIMARY KEY, position TEXT NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _state(self):
+        return dict(self._connection.execute("SELECT key, value FROM state"))
+
+    def load(self):
+        """ Return (block_number, positions, recent position hashes), or None when there is no usable snapshot."""
+        with self._lock:
+            state = self._state()
+            if state.get('version', None) != SCHEMA_VERSION or state.get('protocol', None) != self.protocol_address:
+                return None
+            positions = [decode_position(record) for record, in self._connection.execute("SELECT position FROM positions")]
+        recent = [bytes.fromhex(position_hash) for position_hash in json.loads(state['recent'])]
+        logger.info("Loaded %d positions at block %s from %s", len(positions), state['block_number'], self.path)
+        return int(state['block_number']), positions, recent
+
+    def save(self, block_number, updated=(), removed=(), recent=(), reset=False):
+        """ Record the positions that changed and the block the store is now synced to, atomically."""
+        state = {
+            'version': SCHEMA_VERSION,
+            'protocol': self.protocol_address,
+            'block_number': str(block_number),
+            'recent': json.dumps(sorted(bytes(position_hash).hex() for position_hash in recent)),
+        }
+        with self._lock, self._connection:
+            if reset:
+                self._connection.execute("DELETE FROM positions")
+            self._connection.executemany(
+                "DELETE FROM positions WHERE position_hash = ?",
+                ((bytes(position_hash),) for position_hash in removed)
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO positions (position_hash, position) VALUES (?, ?)",
+                ((bytes(position[POSITION_HASH]), encode_position(position)) for position in updated)
+            )
+            self._connection.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", state.items())
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from web3 import Web3
+
+
+logger = logging.getLogger(__name__)
+
+# how geth and parity reject a transaction whose nonce is not the account's next one
+NONCE_ERRORS = ('nonce too low', 'nonce too high', 'nonce is too low', 'nonce is too high', 'invalid nonce')
+
+
+def is_nonce_error(err):
+    return any(message in str(err).lower() for message in NONCE_ERRORS)
+
+
+def chain_id_for(current_net):
+    if current_net == 'mainnet':
+        return 1
+    elif current_net == 'kovan':
+        return 42
+    return 101
+
+
+class NonceManager:
+    """ Hands out transaction nonces for one account locally.
+
+        The pending transaction count is read once and then incremented in memory,
+        so back-to-back transactions need no RPC to pick their nonce.
+    """
+
+    def __init__(self, web3_client, address):
+        self.web3_client = web3_client
+        self.address = Web3.toChecksumAddress(address)
+        self._nonce = None
+        self._synced_block = None
+        self._lock = threading.Lock()
+
+    def _sync(self):
+        self._nonce = self.web3_client.eth.getTransactionCount(self.address, 'pending')
+
+    def current(self, block_number=None):
+        """ The next unused nonce, without reserving it.
+
+            Transactions this process signs but does not send itself (e.g. fill_kernel
+            transactions returned to the relayer) move the account's nonce behind our
+            back, so when a block number is given the count is re-read once per block.
+        """
+        with self._lock:
+            if self._nonce is None:
+                self._sync()
+            elif block_number is not None and block_number != self._synced_block:
+                nonce = self._nonce
+                self._sync()
+                self._nonce = max(nonce, self._nonce)
+            self._synced_block = block_number
+            return self._nonce
+
+    def is_synced(self, block_number):
+        return self._nonce is not None and block_number is not None and block_number == self._synced_block
+
+    def update(self, block_number, count):
+        """ Record a pending transaction count read elsewhere, e.g. in a JSON-RPC batch."""
+        with self._lock:
+            self._nonce = count if self._nonce is None else max(self._nonce, count)
+            self._synced_block = block_number
+
+    def reserve(self):
+        with self._lock:
+            if self._nonce is None:
+                self._sync()
+            nonce = self._nonce
+            self._nonce += 1
+            return nonce
+
+    def reset(self):
+        with self._lock:
+            self._sync()
+
+
+class PendingTransaction:
+    """ A sent transaction that has not been mined yet.
+
+        done is set once it is mined (receipt) or given up on (error).
+    """
+
+    def __init__(self, transaction, tx_hash, on_receipt=None):
+        self.transaction = transaction
+        self.tx_hash = tx_hash
+        self.hashes = [tx_hash]
+        self.sent_at = time.monotonic()
+        self.on_receipt = on_receipt
+        self.receipt = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class TransactionSubmitter:
+    """ Sign and send transactions for one account without waiting for them to be mined.
+
+        Nonces come from a local NonceManager, so many transactions can go out back to
+        back. A single background thread polls receipts for every pending transaction
+        and re-sends any transaction still pending after `stuck_after` seconds with the
+        same nonce and its gas price bumped by `gas_bump`. A transaction whose nonce was
+        taken by another transaction of the account is given up on.
+    """
+
+    def __init__(self, web3_client, address, private_key, chain_id, poll_interval=1, stuck_after=120, gas_bump=1.125):
+        self.web3_client = web3_client
+        self.address = Web3.toChecksumAddress(address)
+        self.private_key = Web3.toBytes(hexstr=private_key) if isinstance(private_key, str) else private_key
+        self.chain_id = chain_id
+        self.poll_interval = poll_interval
+        self.stuck_after = stuck_after
+        self.gas_bump = gas_bump
+        self.nonces = NonceManager(web3_client, address)
+        self.pending = {}
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def sign(self, transaction):
+        transaction = dict(transaction, chainId=self.chain_id)
+        return self.web3_client.eth.account.signTransaction(transaction, private_key=self.private_key)
+
+    def submit(self, transaction, on_receipt=None):
+        """ Assign a nonce, sign and send a transaction. Returns its PendingTransaction."""
+        transaction = dict(transaction)
+        if 'gasPrice' not in transaction:
+            transaction['gasPrice'] = self.web3_client.eth.gasPrice
+        transaction['nonce'] = self.nonces.reserve()
+        try:
+            tx_hash = self._send(transaction)
+        except ValueError as err:
+            # release the reserved nonce; the node may have kept the transaction (e.g.
+            # "already known"), so it is not sent again under another nonce
+            self.nonces.reset()
+            if not is_nonce_error(err):
+                raise
+            # the local nonce drifted from the node (e.g. the account was used elsewhere)
+            transaction['nonce'] = self.nonces.reserve()
+            try:
+                tx_hash = self._send(transaction)
+            except ValueError:
+                # release the reserved nonce so no gap is left behind
+                self.nonces.reset()
+                raise
+        pending = PendingTransaction(transaction, tx_hash, on_receipt=on_receipt)
+        with self._lock:
+            self.pending[transaction['nonce']] = pending
+            self._start_poller()
+        return pending
+
+    def _send(self, transaction):
+        return self.web3_client.eth.sendRawTransaction(self.sign(transaction).rawTransaction)
+
+    def bump(self, pending):
+        """ Replace a stuck transaction with the same nonce and a higher gas price."""
+        transaction = dict(pending.transaction, gasPrice=int(pending.transaction['gasPrice'] * self.gas_bump) + 1)
+        tx_hash = self._send(transaction)
+        pending.transaction = transaction
+        pending.tx_hash = tx_hash
+        pending.hashes.append(tx_hash)
+        pending.sent_at = time.monotonic()
+
+    def _start_poller(self):
+        if self._poller is None or not self._poller.is_alive():
+            self._poller = threading.Thread(target=self._poll, name='wrangler-receipts', daemon=True)
+            self._poller.start()
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                if not len(self.pending):
+                    self._poller = None
+                    return
+                pending_transactions = list(self.pending.items())
+            for nonce, pending in pending_transactions:
+                try:
+                    self.poll_once(nonce, pending)
+                except Exception as err:
+                    logger.warning("Failed to poll transaction %s: %s", Web3.toHex(pending.tx_hash), err)
+            time.sleep(self.poll_interval)
+
+    def _check_receipts(self, nonce, pending):
+        # any of the hashes sent for this nonce may be the one that gets mined
+        for tx_hash in pending.hashes:
+            receipt = self.web3_client.eth.getTransactionReceipt(tx_hash)
+            if receipt:
+                pending.receipt = receipt
+                with self._lock:
+                    self.pending.pop(nonce, None)
+                pending.done.set()
+                if pending.on_receipt is not None:
+                    pending.on_receipt(receipt)
+                return True
+        return False
+
+    def poll_once(self, nonce, pending):
+        if self._check_receipts(nonce, pending) or time.monotonic() - pending.sent_at < self.stuck_after:
+            return
+        if self.web3_client.eth.getTransactionCount(self.address) > nonce:
+            # the nonce is mined; unless it was one of ours after all, another transaction
+            # of the account (e.g. a fill_kernel sent by a relayer) took it
+            if not self._check_receipts(nonce, pending):
+                pending.error = ValueError("Nonce {0} was used by another transaction".format(nonce))
+                logger.warning("Giving up on transaction %s: %s", Web3.toHex(pending.tx_hash), pending.error)
+                with self._lock:
+                    self.pending.pop(nonce, None)
+                pending.done.set()
+            return
+        try:
+            self.bump(pending)
+        except Exception as err:
+            # try again after another stuck_after rather than on every poll
+            pending.sent_at = time.monotonic()
+            logger.warning("Failed to bump transaction %s: %s", Web3.toHex(pending.tx_hash), err)
+
+    def wait(self, pending, timeout=None):
+        pending.done.wait(timeout)
+        return pending.receipt
+
+
+_submitters = {}
+_submitters_lock = threading.Lock()
+
+
+def get_submitter(web3_client, address, private_key, chain_id):
+    """ The process-wide TransactionSubmitter for an account."""
+    key = (web3_client, Web3.toChecksumAddress(address))
+    with _submitters_lock:
+        if key not in _submitters:
+            _submitters[key] = TransactionSubmitter(web3_client, address, private_key, chain_id)
+        return _submitters[key]
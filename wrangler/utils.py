@@ -2,10 +2,17 @@
 import os
 
 import json
+import functools
 import requests
 
 from web3 import Web3
 
+from .metrics import price_feed_calls
+
+
+# keep-alive connection pool shared by the price feeds
+session = requests.Session()
+
 
 def get_json_data_from_file(filename):
     data = None
@@ -15,6 +22,7 @@ def get_json_data_from_file(filename):
     return data
 
 
+@functools.lru_cache(maxsize=None)
 def get_abi(contract=None):
     contract = contract or None
     assert(contract is not None)
@@ -22,16 +30,21 @@ def get_abi(contract=None):
     return get_json_data_from_file(filename)
 
 
+def cmc_api_url(ticker):
+    return "https://api.coinmarketcap.com/v1/ticker/{0}/?convert=ETH".format(ticker)
+
+
 def cmc_rate_per_weth(ticker):
-    api_url = "https://api.coinmarketcap.com/v1/ticker/{0}/?convert=ETH".format(ticker)
-    return requests.get(api_url).json()[0]["price_eth"]
+    price_feed_calls.inc('coinmarketcap')
+    return session.get(cmc_api_url(ticker), timeout=10).json()[0]["price_eth"]
 
 
 def to_32byte_hex(val):
     return Web3.toHex(Web3.toBytes(val).rjust(32, b'\0'))
 
 
-def cryptocompare_rate(lend_currency_ticker, borrow_currency_ticker):
+def cryptocompare_api_url(lend_currency_ticker, borrow_currency_ticker):
+    """ Return the price api url, and the key of the rate in its response."""
     if lend_currency_ticker.lower() == 'weth':
         lend_currency_ticker = 'eth'
     if borrow_currency_ticker.lower() == 'weth':
@@ -39,4 +52,10 @@ def cryptocompare_rate(lend_currency_ticker, borrow_currency_ticker):
     lend_currency_ticker = lend_currency_ticker.upper()
     borrow_currency_ticker = borrow_currency_ticker.upper()
     api_url = "https://min-api.cryptocompare.com/data/price?fsym={0}&tsyms={1}".format(lend_currency_ticker, borrow_currency_ticker)
-    return requests.get(api_url).json()[borrow_currency_ticker]
+    return api_url, borrow_currency_ticker
+
+
+def cryptocompare_rate(lend_currency_ticker, borrow_currency_ticker):
+    api_url, borrow_currency_ticker = cryptocompare_api_url(lend_currency_ticker, borrow_currency_ticker)
+    price_feed_calls.inc('cryptocompare')
+    return session.get(api_url, timeout=10).json()[borrow_currency_ticker]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# runs the remote steps of a wave that do not run on the calling thread
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='wrangler-validation')
+
+
+class Step:
+    """ One method of an approval, the steps it needs to run after, and whether it is local (no I/O)."""
+
+    __slots__ = ('name', 'after', 'local')
+
+    def __init__(self, name, after=(), local=False):
+        self.name = name
+        self.after = tuple(after)
+        self.local = local
+
+
+class ValidationGraph:
+    """ The steps of an approval as a dependency graph.
+
+        Steps run in waves: a step runs in the first wave after all the steps it
+        depends on. Within a wave local steps run first, in order, and the remaining
+        steps run concurrently. With fail_fast, the graph stops at the first local
+        step that records an error, or after the first wave that did, so no further
+        reads or signing are paid for.
+    """
+
+    def __init__(self, steps):
+        depths = {}
+        for step in steps:
+            for name in step.after:
+                assert name in depths, "{0} must come after {1}, which is not declared before it".format(step.name, name)
+            depths[step.name] = 1 + max([depths[name] for name in step.after], default=-1)
+        self.waves = [[] for _ in range(1 + max(depths.values(), default=-1))]
+        for step in steps:
+            self.waves[depths[step.name]].append(step)
+        for wave in self.waves:
+            wave.sort(key=lambda step: not step.local)
+
+    def _stop(self, context, fail_fast):
+        return fail_fast and len(context.errors)
+
+    def run(self, context, fail_fast=True):
+        """ Run the steps as methods of context. Returns False if fail_fast stopped it early."""
+        for wave in self.waves:
+            remote = []
+            for step in wave:
+                if not step.local:
+                    remote.append(step)
+                    continue
+                getattr(context, step.name)()
+                if self._stop(context, fail_fast):
+                    return False
+            if len(remote):
+                futures = [_executor.submit(getattr(context, step.name)) for step in remote[1:]]
+                getattr(context, remote[0].name)()
+                for future in futures:
+                    future.result()
+            if self._stop(context, fail_fast):
+                return False
+        return True
+
+    async def run_async(self, context, fail_fast=True):
+        """ Like run(), for contexts whose remote steps may be coroutines, which are awaited together."""
+        for wave in self.waves:
+            awaitables = []
+            for step in wave:
+                result = getattr(context, step.name)()
+                if asyncio.iscoroutine(result):
+                    awaitables.append(result)
+                elif step.local and self._stop(context, fail_fast):
+                    return False
+            if len(awaitables):
+                await asyncio.gather(*awaitables)
+            if self._stop(context, fail_fast):
+                return False
+        return True